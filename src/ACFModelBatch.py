@@ -0,0 +1,266 @@
+import os
+import sys
+import json
+import time
+import pickle
+import argparse
+import traceback
+import numpy as np
+
+# Project imports
+from src.records.Session import Session, SOURCES
+from src.fileIO.RawImporter import IMPORTERS, getImporter
+from src.fileIO.ChromExporter import EXPORTERS, getExporter
+from src.fitting.SpectrumEngine import MODEL_TYPES
+
+"""
+HEADLESS BATCH PROCESSING
+Runs the import -> filter -> fit -> mass spectrum model -> export pipeline of the GUI without Qt, configured by a
+JSON file, e.g. on a compute node over whole directories of sequences:
+
+    python -m src.ACFModelBatch -c config.json [input directories or files ...] [-o output directory]
+
+Every directory holding data files of the chosen importer is a sequence and is processed as its own session (or all
+files as one session with "group": "all"); results are written to <output>/<sequence>.  Keys missing from the
+configuration take the GUI defaults in DEFAULTS:
+
+    inputs      list of directories (searched recursively) or data files
+    output      output directory
+    importer    RawImporter name or label
+    isotopes    isotope names of files without a method (*.inf), in acquisition order
+    deadTime    machine dead time (ns) overriding the method
+    filter      pMax, pMin, aMin thresholds (cps) and outlier (Tukey IQR multiple, null for none)
+    fit         algorithm ('Ordinary', 'Weighted' or 'Robust'), norm of robust fits, bootstrap ('scan', 'sample'
+                or null) and workers
+    spectrum    model, weighted and robust per parameter (a1, a2, tau), model one of MODEL_TYPES or its index;
+                alphaSource and tauSource 'auto' (the GUI recommendation) or one of SOURCES for every isotope
+    export      format (ChromExporter name or label), postProcessed, streamed (model the exported series chunk by
+                chunk from the raw files instead of the session's time series) and pickle (save the session)
+"""
+
+DEFAULTS = {'inputs': [],
+            'output': '.',
+            'importer': 'Element',
+            'group': 'sequence',
+            'isotopes': None,
+            'deadTime': None,
+            'filter': {'pMax': 5E+6, 'pMin': 0, 'aMin': 2000, 'outlier': None},
+            'fit': {'algorithm': 'Weighted', 'norm': None, 'bootstrap': None, 'workers': None},
+            'spectrum': {'a1': {'model': 'Linear', 'weighted': True, 'robust': False},
+                         'a2': {'model': 'Linear', 'weighted': True, 'robust': False},
+                         'tau': {'model': 'Linear', 'weighted': True, 'robust': False},
+                         'alphaSource': 'auto',
+                         'tauSource': 'auto'},
+            'export': {'format': 'FIN2', 'postProcessed': True, 'streamed': False, 'pickle': True}}
+
+
+def loadConfig(path=None):
+    """
+    :param path: string path of a JSON configuration, None for the defaults
+    :return: dictionary configuration, missing keys (and keys of the sections) filled from DEFAULTS
+    """
+    user = {}
+    if path is not None:
+        with open(path) as fid:
+            user = json.load(fid)
+    config = json.loads(json.dumps(DEFAULTS))
+    for key, value in user.items():
+        if isinstance(value, dict) and isinstance(config.get(key), dict):
+            for subKey, subValue in value.items():
+                if isinstance(subValue, dict) and isinstance(config[key].get(subKey), dict):
+                    config[key][subKey].update(subValue)
+                else:
+                    config[key][subKey] = subValue
+        else:
+            config[key] = value
+    return config
+
+
+def findSequences(inputs, importer, group='sequence'):
+    """
+    :param inputs: list of directories (searched recursively) or data files
+    :param importer: RawDataImporter subclass
+    :param group: 'sequence' for one session per directory of data files, 'all' for one session
+    :return: {name: [data file paths]} in sorted order
+    """
+    paths = []
+    for entry in inputs:
+        if os.path.isdir(entry):
+            for dirPath, dirNames, fileNames in os.walk(entry):
+                dirNames.sort()
+                paths += [os.path.join(dirPath, fileName) for fileName in sorted(fileNames)
+                          if fileName.lower().endswith(importer.extensions)]
+        elif os.path.isfile(entry):
+            paths.append(entry)
+    if group == 'all':
+        name = os.path.basename(os.path.normpath(inputs[0])) if len(inputs) == 1 else 'session'
+        return {os.path.splitext(name)[0]: paths} if paths else {}
+    sequences = {}
+    for path in paths:
+        sequences.setdefault(os.path.dirname(path), []).append(path)
+    return {os.path.basename(os.path.normpath(seqDir)) or 'session': seqPaths
+            for seqDir, seqPaths in sequences.items()}
+
+
+def importFiles(session: Session, paths, config):
+    """
+    Imports the data files into the session as ImportWorker does and completes the session setup
+    """
+    if config['isotopes'] is not None:
+        # Method of files without *.inf, as entered in the IsotopeIDQuery dialog of the GUI
+        deadTime = config['deadTime'] * 1E-9 if config['deadTime'] is not None else 0
+        session.method = {'isotopes': list(config['isotopes']), 'runs': None, 'passes': None, 'cycle': None,
+                          'masses': len(config['isotopes']), 'deadTime': deadTime}
+    session.startTime = time.localtime()
+    for path in paths:
+        getImporter(config['importer'])(path, session).importFile()
+    session.status['imported'] = True
+    session.timeOffsets()
+    session.startTime = np.min(session.scanTime)
+    for massName, massRecord in session.masses.items():
+        massRecord.count()
+    session.updateDeadTime()
+    if config['deadTime'] is not None:
+        session.machineDeadTime = config['deadTime'] * 1E-9
+    session.status['new'] = True
+
+
+def filterSession(session: Session, settings):
+    """
+    :param settings: dictionary pMax, pMin, aMin and outlier (None disables the Tukey filter)
+    """
+    session.isotopeFit['pMax'] = settings['pMax']
+    session.isotopeFit['pMin'] = settings['pMin']
+    session.isotopeFit['aMin'] = settings['aMin']
+    session.isotopeFit['outlier'] = 10 if settings['outlier'] is None else settings['outlier']
+    session.filterRawData()
+    session.status['filtered'] = True
+
+
+def fitSession(session: Session, settings):
+    """
+    :param settings: dictionary algorithm, norm, bootstrap and workers
+    """
+    session.isotopeFit['algorithm'] = settings['algorithm']
+    session.isotopeFit['norm'] = settings['norm'] if settings['algorithm'] == 'Robust' else None
+    session.isotopeFit['bootstrap'] = settings['bootstrap']
+    session.regressRawData(workers=settings['workers'])
+
+
+def modelDesign(settings):
+    """
+    :param settings: spectrum settings with model (MODEL_TYPES name or index), weighted and robust per parameter
+    :return: dictionary {par: {'order', 'weighted', 'robust'}} as ModelDesignTable.getFitPars
+    """
+    design = {}
+    for par in ['a1', 'a2', 'tau']:
+        model = settings[par]['model']
+        order = MODEL_TYPES.index(model) if isinstance(model, str) else int(model)
+        design[par] = {'order': order, 'weighted': bool(settings[par]['weighted']),
+                       'robust': bool(settings[par]['robust'])}
+    return design
+
+
+def modelSpectrum(session: Session, settings, log=print):
+    """
+    Fits the mass spectrum models, chooses the source of each isotope's parameters and models the time series
+    :param settings: spectrum settings (see modelDesign) with alphaSource and tauSource
+    :param log: callable(str) receiving warnings
+    """
+    session.spectrumFit = type(session.spectrumFit)()
+    sf = session.spectrumFit
+    sf.getMassFits(session)
+    sf.recommendSources()
+    for par in ['a1', 'a2', 'tau']:
+        if not any(sf[par]['mask']):
+            # Without a recommended isotope the model is fit to every finite isotope regression
+            sf[par]['mask'] = list(np.isfinite(sf[par]['Y']) & np.isfinite(sf[par]['seY']))
+            log(f'No isotope recommended for the {par} model; using all {sum(sf[par]["mask"])} isotope fits')
+    for key in ['alphaSource', 'tauSource']:
+        if settings[key] != 'auto':
+            sf[key] = [SOURCES.index(settings[key])] * len(sf[key])
+    sf.fitByMass(modelDesign(settings))
+    session.commitSpectrumFits()
+    session.postProcessTimeSeries()
+
+
+def exportSession(session: Session, outDir, baseName, settings):
+    """
+    :param settings: dictionary format, postProcessed, streamed and pickle
+    :return: list of file names written
+    """
+    os.makedirs(outDir, exist_ok=True)
+    exporter = getExporter(settings['format'])(session, outDir, baseName, settings['postProcessed'])
+    fNames = exporter.export(streamed=bool(settings.get('streamed', False)))
+    if settings['pickle']:
+        session.pickleFile = os.path.join(outDir, baseName + '.p')
+        with open(session.pickleFile, 'wb') as fid:
+            pickle.dump(session, fid)
+        fNames.append(baseName + '.p')
+    return fNames
+
+
+def runPipeline(config, log=print):
+    """
+    Processes every sequence of the configuration; a failing sequence is reported and skipped
+    :param config: dictionary configuration (see loadConfig)
+    :param log: callable(str) receiving progress messages
+    :return: {sequence name: list of file names written, or None if the sequence failed}
+    """
+    importer = getImporter(config['importer'])
+    sequences = findSequences(config['inputs'], importer, config['group'])
+    if not sequences:
+        log(f"No {'/'.join(importer.extensions)} files found in {', '.join(config['inputs'])}")
+    results = {}
+    for seqName, paths in sequences.items():
+        outDir = os.path.join(config['output'], seqName)
+        start = time.perf_counter()
+        try:
+            log(f'{seqName}: importing {len(paths)} files')
+            session = Session()
+            importFiles(session, paths, config)
+            log(f'{seqName}: filtering and fitting {len(session.masses)} isotopes')
+            filterSession(session, config['filter'])
+            fitSession(session, config['fit'])
+            log(f'{seqName}: modeling the mass spectrum')
+            modelSpectrum(session, config['spectrum'], lambda msg: log(f'{seqName}: {msg}'))
+            results[seqName] = exportSession(session, outDir, seqName, config['export'])
+            log(f'{seqName}: wrote {len(results[seqName])} files to {outDir} in {time.perf_counter() - start:0.1f} s')
+        except Exception:
+            log(f'{seqName}: failed\n{traceback.format_exc()}')
+            results[seqName] = None
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m src.ACFModelBatch',
+                                     description='Headless import, filter, fit, mass spectrum model and export of '
+                                                 'sequences of raw data files')
+    parser.add_argument('-c', '--config', help='JSON configuration file (GUI defaults if omitted)')
+    parser.add_argument('inputs', nargs='*', help='directories or data files, overriding the configuration')
+    parser.add_argument('-o', '--output', help='output directory, overriding the configuration')
+    parser.add_argument('--importer', help=f"raw data importer: {', '.join(IMPORTERS)}")
+    parser.add_argument('--format', help=f"export format: {', '.join(EXPORTERS)}")
+    parser.add_argument('--print-config', action='store_true', help='print the effective configuration and exit')
+    args = parser.parse_args(argv)
+
+    config = loadConfig(args.config)
+    if args.inputs:
+        config['inputs'] = args.inputs
+    if args.output:
+        config['output'] = args.output
+    if args.importer:
+        config['importer'] = args.importer
+    if args.format:
+        config['export']['format'] = args.format
+    if args.print_config:
+        print(json.dumps(config, indent=4))
+        return 0
+    if not config['inputs']:
+        parser.error('no inputs given in the configuration or on the command line')
+    results = runPipeline(config, lambda msg: print(msg, flush=True))
+    return 0 if results and all(fNames is not None for fNames in results.values()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,68 @@
+import sys
+import json
+import argparse
+import subprocess
+import numpy as np
+
+"""
+IMPORT TIME BENCHMARK
+Times the cold import of the core modules, each in a fresh interpreter, and lists the heavy optional libraries
+(statistics, plotting, Qt) the import pulled in.  The core must parse *.dat files, fit and export without them, so
+they are loaded lazily on first use.
+
+    python -m src.benchmarks.ImportBenchmark [--repeats 5] [--budget 1.0] [modules ...]
+
+Exits with status 1 if the median import time of a module exceeds the budget (s) or a heavy library was imported.
+"""
+
+CORE_MODULES = ['src.fileIO.ThermoE2XR', 'src.records.Session', 'src.fitting.LinearEngine',
+                'src.fitting.RobustEngine', 'src.fitting.SpectrumEngine', 'src.fitting.JointEngine',
+                'src.fileIO.RawImporter', 'src.fileIO.ChromExporter', 'src.ACFModelBatch']
+HEAVY_MODULES = ['scipy', 'statsmodels', 'sklearn', 'pandas', 'matplotlib', 'PyQt6']
+
+PROBE = """
+import sys, time, json
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{'seconds': elapsed, 'heavy': [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def timeImport(module, repeats=5):
+    """
+    :param module: string dotted module name
+    :param repeats: int number of fresh interpreters
+    :return: list of float import times (s), list of heavy modules imported
+    """
+    times = []
+    heavy = []
+    for i in range(repeats):
+        out = subprocess.run([sys.executable, '-c', PROBE.format(module=module, heavy=HEAVY_MODULES)],
+                             capture_output=True, text=True, check=True).stdout
+        result = json.loads(out.strip().splitlines()[-1])
+        times.append(result['seconds'])
+        heavy = result['heavy']
+    return times, heavy
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m src.benchmarks.ImportBenchmark',
+                                     description='Cold import time of the core modules')
+    parser.add_argument('modules', nargs='*', default=CORE_MODULES, help='modules to time')
+    parser.add_argument('--repeats', type=int, default=5, help='fresh interpreters per module')
+    parser.add_argument('--budget', type=float, default=1.0, help='maximum median import time (s)')
+    args = parser.parse_args(argv)
+
+    ok = True
+    print(f"{'module':<28}{'median (s)':>12}{'max (s)':>10}  heavy imports")
+    for module in args.modules:
+        times, heavy = timeImport(module, args.repeats)
+        median = float(np.median(times))
+        ok = ok and median <= args.budget and not heavy
+        print(f"{module:<28}{median:>12.3f}{max(times):>10.3f}  {', '.join(heavy) or '-'}")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
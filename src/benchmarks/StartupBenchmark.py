@@ -0,0 +1,98 @@
+import os
+import sys
+import json
+import argparse
+import subprocess
+import numpy as np
+
+"""
+GUI STARTUP BENCHMARK
+Times the cold start of ACFModelMain in fresh interpreters (offscreen Qt platform unless QT_QPA_PLATFORM is set):
+importing the window module, building the window, the first paint, and the background preload of the plotting and
+statistics libraries that follows it.  Also lists the heavy libraries already loaded at the first paint, which lazy
+tab construction keeps out of the startup path.
+
+    python -m src.benchmarks.StartupBenchmark [--repeats 5] [--budget 1.5] [--root baseline checkout]
+
+Exits with status 1 if the median time to the first paint exceeds the budget (s).
+"""
+
+HEAVY_MODULES = ['matplotlib', 'scipy', 'statsmodels', 'sklearn', 'pandas']
+PHASES = ['import', 'build', 'paint', 'preload']
+
+PROBE = """
+import sys, time, json
+start = time.perf_counter()
+from PyQt6.QtWidgets import QApplication
+from PyQt6.QtCore import QObject, QEvent
+app = QApplication(sys.argv)
+import src.ui.MainCrossCallWindow as main
+imported = time.perf_counter()
+window = main.ACFModelMain()
+built = time.perf_counter()
+
+class PaintWatch(QObject):
+    painted = False
+    def eventFilter(self, obj, event):
+        if event.type() == QEvent.Type.Paint:
+            PaintWatch.painted = True
+        return False
+
+watch = PaintWatch()
+window.installEventFilter(watch)
+window.show()
+deadline = built + {timeout}
+while not watch.painted and time.perf_counter() < deadline:
+    app.processEvents()
+painted = time.perf_counter()
+heavy = [m for m in {heavy!r} if m in sys.modules]
+# Builds without background preloading have nothing left to load after the first paint
+while getattr(window, 'preloadTime', 0) is None and time.perf_counter() < deadline:
+    app.processEvents()
+    time.sleep(0.002)
+preloaded = time.perf_counter()
+print(json.dumps({{'import': imported - start, 'build': built - start, 'paint': painted - start,
+                   'preload': preloaded - start, 'heavy': heavy}}))
+"""
+
+
+def timeStartup(repeats=5, timeout=60, root=None):
+    """
+    :param repeats: int number of fresh interpreters
+    :param timeout: float seconds to wait for the first paint and the preload
+    :param root: string directory holding the src package to time (e.g. a checkout of an earlier version), None for
+    the current directory
+    :return: {phase: list of float seconds since interpreter start}, list of heavy modules loaded at first paint
+    """
+    env = dict(os.environ)
+    env.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    times = {phase: [] for phase in PHASES}
+    heavy = []
+    for i in range(repeats):
+        out = subprocess.run([sys.executable, '-c', PROBE.format(timeout=timeout, heavy=HEAVY_MODULES)],
+                             capture_output=True, text=True, check=True, env=env, cwd=root).stdout
+        result = json.loads(out.strip().splitlines()[-1])
+        for phase in PHASES:
+            times[phase].append(result[phase])
+        heavy = result['heavy']
+    return times, heavy
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m src.benchmarks.StartupBenchmark',
+                                     description='Cold start time of the GUI')
+    parser.add_argument('--repeats', type=int, default=5, help='fresh interpreters')
+    parser.add_argument('--budget', type=float, default=1.5, help='maximum median time to the first paint (s)')
+    parser.add_argument('--root', help='directory holding the src package to time, e.g. a baseline checkout')
+    args = parser.parse_args(argv)
+
+    times, heavy = timeStartup(args.repeats, root=args.root)
+    print(f"{'phase':<10}{'median (s)':>12}{'max (s)':>10}")
+    for phase in PHASES:
+        print(f"{phase:<10}{float(np.median(times[phase])):>12.3f}{max(times[phase]):>10.3f}")
+    print(f"loaded at first paint: {', '.join(heavy) or '-'}")
+    return 0 if float(np.median(times['paint'])) <= args.budget else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
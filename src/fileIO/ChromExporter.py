@@ -1,44 +1,283 @@
-from src.fileIO import ThermoElement
-class ChromExporter:
-    def __init__(self):
-        pass
+import os
+import time
+import importlib.util
+import numpy as np
+from abc import ABC, abstractmethod
+from datetime import datetime
 
-    def write(self):
-        pass
+# Project imports
+from src.records.Session import Session
+from src.fileIO.ThermoE2XR import ThermoFIN2
+from src.fileIO import ChromFormat
+from src.fitting import PostProcess
 
-class ThermoFIN2(ChromExporter):
-    def __init__(self):
-        super().__init__():
-        pass
+"""
+CHROMATOGRAM EXPORTERS
+Registry of time series writers sharing one streaming interface:
 
-    def write(self):
-        ThermoElement.writeFIN2()
-        ThermoElement.writeFIN()
+    exporter = getExporter(name)(session, outDir, baseName, postProcessed)
+    exporter.begin()
+    exporter.writeSample(chunk)     # once per chunk of scans of each sample, in scan order
+    exporter.finish()
 
+or exporter.export() to drive the whole session.  A chunk is a dictionary with the sample name and record, start
+(index of its first scan within the sample), nScans (scans in the sample), sampleStart (absolute time of the first
+scan of the sample), time (seconds since sampleStart) and columns (one time series per isotope).  Exporters with
+optional dependencies report them through available().  Text formats share the vectorized fixed-point formatting of
+ChromFormat; new formats are added with the registerExporter decorator.
+"""
 
+EXPORTERS = {}
 
 
-class Agilent(ChromExporter):
-    def __init__(self):
-        super().__init__():
-        pass
+def registerExporter(cls):
+    """
+    Class decorator adding an exporter to the registry under its name
+    """
+    EXPORTERS[cls.name] = cls
+    return cls
 
-    def write(self):
-        pass
 
+def getExporter(name):
+    """
+    :param name: string registered exporter name or label
+    :return: ChromExporter subclass
+    """
+    for cls in EXPORTERS.values():
+        if name in (cls.name, cls.label):
+            return cls
+    raise KeyError(f'No exporter for {name}')
 
-class PerkinElmerExporter(ChromExporter):
-    def __init__(self):
-        super().__init__():
-        pass
 
-    def write(self):
-        pass
+class ChromExporter(ABC):
+    name = None
+    label = None
+    extension = None
+
+    def __init__(self, session: Session, outDir, baseName, postProcessed: bool = True):
+        """
+        :param session: Session
+        :param outDir: string output directory
+        :param baseName: string name of the export (index or session file name without extension)
+        :param postProcessed: bool True to export modeled time series, False for the reported time series
+        """
+        self.session = session
+        self.outDir = outDir
+        self.baseName = baseName
+        self.postProcessed = postProcessed
+        self.isotopes = [str(isotope) for isotope in session.masses.keys()]
+        self.fNames = []
+
+    @classmethod
+    def available(cls):
+        """
+        :return: bool True if the dependencies of the format are installed
+        """
+        return True
 
-class NuExporter(ChromExporter):
-    def __init__(self):
-        super().__init__():
+    def begin(self):
+        os.makedirs(self.outDir, exist_ok=True)
+        self.startTime = time.localtime(datetime.now().timestamp())
+        self.fNames = []
+
+    @abstractmethod
+    def writeSample(self, chunk):
+        """
+        :param chunk: dictionary chunk of scans of one sample (see chunks)
+        """
+
+    def finish(self):
         pass
 
-    def write(self):
-        pass
\ No newline at end of file
+    def chunks(self, chunkSize=PostProcess.CHUNK_SCANS, streamed: bool = False, postProcessed=None):
+        """
+        :param chunkSize: int number of scans per chunk
+        :param streamed: bool True to model chunks from the raw *.dat files (at their import paths), False to use
+        the session time series
+        :param postProcessed: bool modeled (True) or reported (False) time series, None for self.postProcessed
+        :return: generator of chunks of every sample, in session order
+        """
+        if postProcessed is None:
+            postProcessed = self.postProcessed
+        source = ThermoFIN2(self.session)
+        for smpName, smpRecord in self.session.samples.items():
+            mask = self.session.sampleKeys == smpRecord.ID
+            nScans = int(np.count_nonzero(mask))
+            sampleStart = np.amin(self.session.scanTime[mask]) if nScans else np.nan
+            start = 0
+            for cycleTime, columns in source.seriesChunks(smpRecord, postProcessed, chunkSize, streamed):
+                yield {'name': smpName, 'sample': smpRecord, 'start': start, 'nScans': nScans,
+                       'sampleStart': sampleStart, 'time': cycleTime, 'columns': columns}
+                start += len(cycleTime)
+
+    def export(self, chunkSize=PostProcess.CHUNK_SCANS, streamed: bool = False, progress=None):
+        """
+        Writes the whole session
+        :param chunkSize: int number of scans per chunk
+        :param streamed: bool True to model chunks from the raw *.dat files (at their import paths), False to use
+        the session time series
+        :param progress: callable(sampleName) invoked as each sample completes
+        :return: list of file names written
+        """
+        self.begin()
+        for chunk in self.chunks(chunkSize, streamed):
+            self.writeSample(chunk)
+            if progress is not None and chunk['start'] + len(chunk['time']) == chunk['nScans']:
+                progress(chunk['name'])
+        self.finish()
+        return self.fNames
+
+
+@registerExporter
+class FIN2Exporter(ChromExporter):
+    name = 'FIN2'
+    label = 'Thermo Element (*.FIN2)'
+    extension = '.FIN2'
+
+    def __init__(self, session: Session, outDir, baseName, postProcessed: bool = True):
+        super().__init__(session, outDir, baseName, postProcessed)
+        self.writer = ThermoFIN2(session)
+        self.finName = baseName + '.FIN'
+        self.file = None
+
+    def writeSample(self, chunk):
+        if chunk['start'] == 0:
+            fName = chunk['name'] + self.extension
+            self.fNames.append(fName)
+            self.file = open(os.path.join(self.outDir, fName), 'w', newline='')
+            self.writer.writeHeader(self.file, chunk['sample'], self.finName, chunk['nScans'])
+        self.file.write(self.writer.chromText(self.writer.chromRows(chunk['time'], chunk['columns'])))
+        if chunk['start'] + len(chunk['time']) >= chunk['nScans']:
+            self.file.close()
+            self.file = None
+
+    def finish(self):
+        if len(self.session.samples) > 0:
+            lastSample = list(self.session.samples.values())[-1]
+            self.writer.writeFIN(os.path.join(self.outDir, self.finName), self.fNames, lastSample, self.startTime)
+
+
+@registerExporter
+class LongCSVExporter(ChromExporter):
+    name = 'CSV'
+    label = 'Long format (*.csv)'
+    extension = '.csv'
+
+    def begin(self):
+        super().begin()
+        fName = self.baseName + self.extension
+        self.fNames.append(fName)
+        self.file = open(os.path.join(self.outDir, fName), 'w', newline='')
+        self.file.write(ChromFormat.formatTable([(np.array(['Sample']), None), (np.array(['Time']), None),
+                                                 (np.array(['Isotope']), None), (np.array(['CPS']), None)]))
+
+    def writeSample(self, chunk):
+        """
+        One row per scan and isotope: sample, time (0.1 ms), isotope, intensity (0.01 CPS).  Unlike the int cast of
+        the FIN2 block, truncation keeps missing (NaN) and over-range (inf) intensities, written as nan and inf.
+        """
+        n, m = len(chunk['time']), len(self.isotopes)
+        intensities = np.column_stack(chunk['columns']) if m else np.empty((n, 0))
+        self.file.write(ChromFormat.formatTable([(np.repeat(np.array([chunk['name']]), n * m), None),
+                                                 (np.repeat(ChromFormat.truncate(chunk['time'], 4), m), 4),
+                                                 (np.tile(np.array(self.isotopes), n), None),
+                                                 (ChromFormat.truncate(intensities, 2).ravel(), 2)]))
+
+    def finish(self):
+        self.file.close()
+
+
+@registerExporter
+class NumpyExporter(ChromExporter):
+    name = 'NPZ'
+    label = 'NumPy columns (*.npz)'
+    extension = '.npz'
+
+    def begin(self):
+        super().begin()
+        self.parts = []
+
+    def writeSample(self, chunk):
+        """
+        Full-precision columns; the chunks of a sample are saved together when its last chunk arrives
+        """
+        self.parts.append(np.column_stack([chunk['time']] + list(chunk['columns'])))
+        if chunk['start'] + len(chunk['time']) >= chunk['nScans']:
+            data = np.concatenate(self.parts) if self.parts else np.empty((0, 1 + len(self.isotopes)))
+            fName = chunk['name'] + self.extension
+            self.fNames.append(fName)
+            columns = {isotope: data[:, j + 1] for j, isotope in enumerate(self.isotopes)}
+            np.savez(os.path.join(self.outDir, fName), Time=data[:, 0], **columns)
+            self.parts = []
+
+
+@registerExporter
+class ParquetExporter(ChromExporter):
+    name = 'Parquet'
+    label = 'Apache Parquet (*.parquet)'
+    extension = '.parquet'
+    compression = 'zstd'
+
+    @classmethod
+    def available(cls):
+        return importlib.util.find_spec('pyarrow') is not None
+
+    def begin(self):
+        """
+        One file for the session: sample name and ID, absolute scan time (float64) and, per isotope, the reported
+        time series and (for post-processed exports) the modeled time series as float32 columns
+        """
+        super().begin()
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError('Parquet export requires pyarrow (pip install pyarrow)')
+        self.pa = pyarrow
+        fields = [pyarrow.field('sample', pyarrow.dictionary(pyarrow.int32(), pyarrow.string())),
+                  pyarrow.field('sampleID', pyarrow.int32()),
+                  pyarrow.field('scanTime', pyarrow.float64())]
+        fields += [pyarrow.field(isotope, pyarrow.float32()) for isotope in self.isotopes]
+        if self.postProcessed:
+            fields += [pyarrow.field(isotope + '_modeled', pyarrow.float32()) for isotope in self.isotopes]
+        self.schema = pyarrow.schema(fields)
+        fName = self.baseName + self.extension
+        self.fNames.append(fName)
+        self.file = pyarrow.parquet.ParquetWriter(os.path.join(self.outDir, fName), self.schema,
+                                                  compression=self.compression)
+        self.parts = []
+
+    def chunks(self, chunkSize=PostProcess.CHUNK_SCANS, streamed: bool = False, postProcessed=None):
+        """
+        Chunks carry the reported time series in columns and, for post-processed exports, the modeled time series
+        in modeled
+        """
+        reported = super().chunks(chunkSize, streamed, False)
+        if not self.postProcessed:
+            yield from reported
+            return
+        modeled = super().chunks(chunkSize, streamed, True)
+        for chunk, modeledChunk in zip(reported, modeled):
+            chunk['modeled'] = modeledChunk['columns']
+            yield chunk
+
+    def writeSample(self, chunk):
+        """
+        Chunks of a sample are collected and written as one row group when its last chunk arrives
+        """
+        self.parts.append(chunk)
+        if chunk['start'] + len(chunk['time']) < chunk['nScans']:
+            return
+        pa = self.pa
+        n = sum(len(part['time']) for part in self.parts)
+        arrays = [pa.DictionaryArray.from_arrays(np.zeros(n, dtype=np.int32), [str(chunk['name'])]),
+                  pa.array(np.full(n, chunk['sample'].ID, dtype=np.int32)),
+                  pa.array(np.concatenate([part['sampleStart'] + part['time'] for part in self.parts]))]
+        for key in ['columns', 'modeled'] if self.postProcessed else ['columns']:
+            for j in range(len(self.isotopes)):
+                arrays.append(pa.array(np.concatenate([part[key][j] for part in self.parts]).astype(np.float32)))
+        self.file.write_table(pa.Table.from_arrays(arrays, schema=self.schema), row_group_size=max(n, 1))
+        self.parts = []
+
+    def finish(self):
+        self.file.close()
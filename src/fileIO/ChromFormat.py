@@ -0,0 +1,139 @@
+import csv
+import io
+import numpy as np
+
+"""
+FIXED-POINT TEXT FORMATTING OF CHROMATOGRAM BLOCKS
+Vectorized replacement for csv.writer.writerows on a float array of truncated values (x = int(x*10^d)/10^d).  The
+csv module writes repr(x); for such values below 10^(15-d) in magnitude the shortest round-trip repr is exactly the
+decimal k/10^d with trailing zeros removed and at least one decimal digit, so the text is assembled from integer
+digit arithmetic into one character matrix.  The few values outside that range (e.g. the int64 sentinel of a
+truncated NaN) fall back to repr, so the output is byte-identical to the csv writer.
+"""
+
+DELIMITER = b','
+LINE_TERMINATOR = b'\r\n'  # csv.writer default
+
+
+def truncate(values, decimals):
+    """
+    :param values: array of floats
+    :param decimals: int number of decimal places kept
+    :return: float array truncated towards zero, x = trunc(x*10^d)/10^d; NaN and inf are kept
+    """
+    with np.errstate(invalid='ignore', over='ignore'):
+        return np.trunc(np.asarray(values, dtype=float) * 10 ** decimals) / 10 ** decimals
+
+
+def digitMatrix(values, width):
+    """
+    :param values: (n,) non-negative int64
+    :param width: int number of digits
+    :return: (n, width) uint8 ASCII digits, most significant first
+    """
+    digits = np.empty((len(values), width), dtype=np.uint8)
+    remainder = values.copy()
+    for j in range(width - 1, -1, -1):
+        remainder, digits[:, j] = np.divmod(remainder, 10)
+    return digits + ord('0')
+
+
+def formatColumn(values, decimals):
+    """
+    Fixed-point text of one column
+    :param values: (n,) float64 values truncated to `decimals` decimal places
+    :param decimals: int number of decimal places
+    :return: (n, w) uint8 character matrix, (n, w) bool mask of the characters in use, (n,) bool repr fallback
+    """
+    values = np.asarray(values, dtype=float)
+    with np.errstate(invalid='ignore'):
+        fallback = ~(np.abs(values) < 10.0 ** (15 - decimals))
+    scaled = np.rint(np.where(fallback, 0, values) * 10 ** decimals).astype(np.int64)
+    negative = scaled < 0
+    integer, fraction = np.divmod(np.abs(scaled), 10 ** decimals)
+    width = max(len(str(int(np.max(integer, initial=0)))), 1)
+    nDigits = np.ones(len(values), dtype=int)
+    for j in range(1, width):
+        nDigits += integer >= 10 ** j
+    fracDigits = digitMatrix(fraction, decimals)
+    # Trailing zeros of the fraction are dropped but one decimal digit is always written (repr(1.0) == '1.0')
+    nFrac = np.ones(len(values), dtype=int)
+    for j in range(2, decimals + 1):
+        nFrac = np.where(fraction % 10 ** (decimals - j + 1) != 0, np.maximum(nFrac, j), nFrac)
+
+    chars = np.empty((len(values), 1 + width + 1 + decimals), dtype=np.uint8)
+    chars[:, 0] = ord('-')
+    chars[:, 1:1 + width] = digitMatrix(integer, width)
+    chars[:, 1 + width] = ord('.')
+    chars[:, 2 + width:] = fracDigits
+    mask = np.zeros(chars.shape, dtype=bool)
+    mask[:, 0] = negative
+    mask[:, 1:1 + width] = np.arange(width) >= (width - nDigits)[:, None]
+    mask[:, 1 + width] = True
+    mask[:, 2 + width:] = np.arange(decimals) < nFrac[:, None]
+    return chars, mask, fallback
+
+
+def labelColumn(labels):
+    """
+    Text of a column of ASCII labels (written unquoted; formatTable hands labels that need quoting to csv)
+    :param labels: (n,) array-like of strings
+    :return: (n, w) uint8 character matrix, (n, w) bool mask of the characters in use
+    """
+    encoded = np.asarray(labels, dtype=bytes)
+    width = max(encoded.dtype.itemsize, 1)
+    chars = np.frombuffer(encoded.astype(f'S{width}').tobytes(), dtype=np.uint8).reshape(len(encoded), width)
+    return chars, chars != 0
+
+
+def formatTable(columns):
+    """
+    Text of a table as written by csv.writer(delimiter=',').writerows
+    :param columns: list of (values, decimals): (n,) float64 truncated values with int decimal places, or (n,)
+    strings with decimals None
+    :return: string
+    """
+    n = len(columns[0][0]) if len(columns) else 0
+    if n == 0:
+        return ''
+    blocks = []
+    masks = []
+    fallback = np.zeros(n, dtype=bool)
+    for j, (values, decimals) in enumerate(columns):
+        if decimals is None:
+            chars, mask = labelColumn(values)
+            # Labels csv would quote are written by the csv module
+            fallback |= np.any((chars == ord(',')) | (chars == ord('"')) | (chars == ord('\n')) | (chars == ord('\r')),
+                               axis=1)
+        else:
+            chars, mask, columnFallback = formatColumn(values, decimals)
+            fallback |= columnFallback
+        separator = DELIMITER if j < len(columns) - 1 else LINE_TERMINATOR
+        blocks += [chars, np.tile(np.frombuffer(separator, dtype=np.uint8), (n, 1))]
+        masks += [mask, np.ones((n, len(separator)), dtype=bool)]
+    chars = np.concatenate(blocks, axis=1)
+    mask = np.concatenate(masks, axis=1)
+    text = chars[mask].tobytes().decode('ascii')
+    if not np.any(fallback):
+        return text
+    # Rows holding a value outside the fixed-point range (or a quoted label) are written by the csv module
+    lengths = np.sum(mask, axis=1)
+    ends = np.cumsum(lengths)
+    rows = [text[end - length:end] for end, length in zip(ends, lengths)]
+    for i in np.flatnonzero(fallback):
+        line = io.StringIO()
+        fields = [str(values[i]) if decimals is None else float(values[i]) for values, decimals in columns]
+        csv.writer(line, delimiter=',').writerow(fields)
+        rows[i] = line.getvalue()
+    return ''.join(rows)
+
+
+def formatRows(data, decimals):
+    """
+    Text of a 2D block as written by csv.writer(delimiter=',').writerows
+    :param data: (n, m) float64 array of truncated values
+    :param decimals: list of m ints, decimal places of each column
+    :return: string
+    """
+    data = np.asarray(data, dtype=float)
+    return formatTable([(data[:, j], decimals[j]) for j in range(data.shape[1])])
@@ -1,43 +1,422 @@
-from src.records import Session
-from src.fileIO.ThermoE2XR import ThermoDAT
+import io
+import os
+import re
+import time
+import numpy as np
+from abc import ABC, abstractmethod
+from datetime import datetime
+
+# Project imports
+from src.records.Session import Session, Sample
+from src.fileIO.ThermoE2XR import ThermoDAT, MASS_NUMERIC_PRECISION, SAMPLE_NUM_SEPARATOR
+
+"""
+RAW DATA IMPORTERS
+Registry of instrument readers sharing one interface:
+
+    importer = getImporter(path)(path, session)
+    smpRecord = importer.importFile()       # parses the file and appends its scans to the session
+
+Each importer reads a file into a Sample and a columnar record of its scans, the same record ThermoDAT.readScans
+returns: nScans, per-scan ACF, FCF, EDAC and absolute scanTime arrays, and masses, {isotope: {pulse, analog, faraday,
+chDwell, channels, magMasses, actMasses}} with (scans x channels) intensity blocks.  Session.appendRecord merges the
+record into the session, so everything downstream of the import is vendor neutral.  New formats are added with the
+registerImporter decorator.
+"""
+
+IMPORTERS = {}
+
+
+def registerImporter(cls):
+    """
+    Class decorator adding an importer to the registry under its name
+    """
+    IMPORTERS[cls.name] = cls
+    return cls
+
+
+def getImporter(name):
+    """
+    :param name: string registered importer name or label, or the path of a file to import (matched by extension)
+    :return: RawDataImporter subclass
+    """
+    for cls in IMPORTERS.values():
+        if name in (cls.name, cls.label):
+            return cls
+    extension = os.path.splitext(name)[1].lower()
+    for cls in IMPORTERS.values():
+        if extension in cls.extensions:
+            return cls
+    raise KeyError(f'No importer for {name}')
+
+
+class RawDataImporter(ABC):
+    name = None
+    label = None
+    fileFilter = None
+    extensions = ()
 
-class RawDataImporter:
     def __init__(self, fPath, session: Session):
-        self.type = None
+        """
+        :param fPath: string path of the file to import
+        :param session: Session receiving the sample
+        """
         self.filePath = fPath
         self.session = session
 
-    def import(self, paths):
-        pass
+    @abstractmethod
+    def read(self):
+        """
+        :return: Sample, dictionary record of its scans (see ThermoDAT.readScans)
+        """
+
+    def importFile(self):
+        """
+        Parses the file and appends its scans to the session
+        :return: Sample
+        """
+        smpRecord, scans = self.read()
+        self.session.appendRecord(smpRecord, scans, MASS_NUMERIC_PRECISION)
+        if self.session.startTime is None:
+            self.session.startTime = smpRecord.fileTimes["DAT"]
+        else:
+            self.session.startTime = min(self.session.startTime, smpRecord.fileTimes["DAT"])
+        if self.session.method is None:
+            self.session.method = {'isotopes': smpRecord.isotopes,
+                                   'runs': smpRecord.metaData['runs'],
+                                   'passes': smpRecord.metaData['passes'],
+                                   'cycle': smpRecord.metaData['cycles'],
+                                   'masses': smpRecord.metaData['masses'],
+                                   'deadTime': smpRecord.metaData['deadTime']}
+        self.session.isotopes = smpRecord.isotopes
+        return smpRecord
+
+    def newSample(self, acquired):
+        """
+        Sample record named after the file, with a unique ID and the group and sample number parsed from the name
+        :param acquired: struct_time start of the acquisition
+        :return: Sample
+        """
+        smpRecord = Sample()
+        smpRecord.session = self.session
+        smpRecord.ID = self.session.unique
+        self.session.unique += 1
+        _, basename = os.path.split(self.filePath)
+        root = os.path.splitext(basename)[0]
+        smpRecord.name = root
+        smpRecord.group = re.split(f"{SAMPLE_NUM_SEPARATOR}[0-9a-zA-Z]+$", root)[0]
+        try:
+            smpRecord.smpNum = int(re.split(f"{re.escape(smpRecord.group)}{SAMPLE_NUM_SEPARATOR}", root)[1])
+        except (IndexError, ValueError):
+            smpRecord.smpNum = smpRecord.ID
+        # Vendor exports carry no sequence, method or tune files; the FIN2 header writes the entries as empty lines
+        for key in ["DAT", "DAT0"]:
+            smpRecord.filePaths[key] = self.filePath
+        for key in ["SEQ", "MET", "TPF"]:
+            smpRecord.filePaths[key] = ''
+        smpRecord.filePaths["FIN2"] = os.path.splitext(self.filePath)[0] + ".FIN2"
+        smpRecord.fileTimes["DAT"] = acquired
+        return smpRecord
 
 
+@registerImporter
 class ElementImporter(RawDataImporter):
-    from src.fileIO.ThermoElement import SampleData
-    def __init__(self, fPath, session: Session):
-        self.type = 'Element DAT'
-        super().__init__(fPath, session)
-        self.smpData = SampleData()
+    name = 'Element'
+    label = 'Thermo Element (*.dat)'
+    fileFilter = 'Element Data Files (*.dat)'
+    extensions = ('.dat',)
+
+    def read(self):
+        dat = ThermoDAT(self.filePath, self.session)
+        dat.getDatMetaData()
+        return dat, dat.readScans()
+
+    def importFile(self):
+        """
+        The *.inf file next to the *.dat file supplies the isotope names and method of the session
+        """
+        dat = ThermoDAT(self.filePath, self.session)
+        dat.parseDAT()
+        return dat
+
+
+@registerImporter
+class CSVImporter(RawDataImporter):
+    """
+    Time resolved intensity exports of quadrupole instruments (PerkinElmer NexION, Agilent MassHunter): a block of
+    free-form metadata lines, one header line naming the time column and one column per isotope, then one row per
+    scan (optionally followed by a free-form footer).  Intensities are in counts per second; columns qualified with
+    "P"/"Pulse" or "A"/"Analog" fill the pulse and analog blocks of the isotope, unqualified columns are pulse
+    counts.  Analog exports are already in counts per second, so the stored ACF is 1.
+    """
+    name = 'CSV'
+    label = 'NexION / Agilent (*.csv)'
+    fileFilter = 'Time Resolved Exports (*.csv)'
+    extensions = ('.csv',)
+    delimiter = ','
+    headLines = 256  # lines searched for the header
+    tailBytes = 65536  # bytes searched for a footer
+    blockBytes = 1 << 24  # bytes counted at once
+    chunkBytes = 1 << 20  # bytes parsed at once
+    timeFormats = ['%m/%d/%Y %I:%M:%S %p', '%m/%d/%Y %H:%M:%S', '%d/%m/%Y %H:%M:%S', '%Y-%m-%d %H:%M:%S',
+                   '%m/%d/%Y %I:%M %p', '%m/%d/%Y %H:%M']
+
+    def read(self):
+        with open(self.filePath, mode='rb') as raw:
+            metaLines, header, bodyOffset = self.findHeader(raw)
+            bodyEnd = self.footerOffset(raw, bodyOffset)
+            nRows = self.countRows(raw, bodyOffset, bodyEnd)
+        acquired = self.acquisitionTime(metaLines)
+        smpRecord = self.newSample(acquired)
+        timeIdx, columns = self.mapColumns(header)
+        usecols = [timeIdx] + [j for detectors in columns.values() for idx in detectors.values() for j in idx]
+        data = self.loadColumns(bodyOffset, bodyEnd, nRows, usecols)
+        data = {j: data[:, k] for k, j in enumerate(usecols)}
+        return smpRecord, self.buildRecord(smpRecord, header, timeIdx, columns, data, metaLines)
+
+    def findHeader(self, raw):
+        """
+        Locates the header as the line above the first row of numbers.  Importers without a fixed delimiter try tab,
+        comma, semicolon and whitespace in turn and keep the first that splits the rows into numeric fields.
+        :param raw: file opened for binary read
+        :return: list of metadata lines, list of header labels, int byte offset of the first scan row
+        """
+        lines = []
+        offsets = []
+        for i in range(self.headLines):
+            offsets.append(raw.tell())
+            line = raw.readline()
+            if not line:
+                break
+            lines.append(line.decode('utf-8-sig', errors='replace').strip())
+        delimiters = [self.delimiter] if self.delimiter is not None else ['\t', ',', ';', None]
+        for delimiter in delimiters:
+            self.delimiter = delimiter
+            for i, line in enumerate(lines):
+                fields = self.splitFields(line)
+                if i > 0 and len(fields) > 1 and self.isNumeric(fields):
+                    header = self.splitFields(lines[i - 1])
+                    if len(header) >= len(fields):
+                        return lines[:i - 1], header[:len(fields)], offsets[i]
+                    break
+        raise ValueError(f'No header line followed by numeric rows in the first {self.headLines} lines of '
+                         f'{self.filePath}')
+
+    def footerOffset(self, raw, bodyOffset):
+        """
+        :param raw: file opened for binary read
+        :param bodyOffset: int byte offset of the first scan row
+        :return: int byte offset of the end of the last scan row
+        """
+        raw.seek(0, os.SEEK_END)
+        size = raw.tell()
+        tailOffset = max(bodyOffset, size - self.tailBytes)
+        raw.seek(tailOffset)
+        return tailOffset + len(self.stripFooter(raw.read()))
+
+    def countRows(self, raw, bodyOffset, bodyEnd):
+        """
+        Line count of the scan rows, counted in binary blocks without decoding, to preallocate the parsed array
+        :return: int number of lines between the first scan row and the end of the last
+        """
+        raw.seek(bodyOffset)
+        remaining = bodyEnd - bodyOffset
+        nRows = 1 if remaining > 0 else 0
+        while remaining > 0:
+            block = raw.read(min(self.blockBytes, remaining))
+            if not block:
+                break
+            nRows += block.count(b'\n')
+            remaining -= len(block)
+        return nRows
+
+    def bodyChunks(self, bodyOffset, bodyEnd):
+        """
+        Scan rows between the two byte offsets, read in binary blocks and split at line ends, so neither the header
+        nor the footer is parsed
+        :return: generator of decoded text blocks of whole lines
+        """
+        with open(self.filePath, mode='rb') as raw:
+            raw.seek(bodyOffset)
+            remaining = bodyEnd - bodyOffset
+            carry = b''
+            while remaining > 0:
+                block = raw.read(min(self.chunkBytes, remaining))
+                if not block:
+                    break
+                remaining -= len(block)
+                block = carry + block
+                end = block.rfind(b'\n') + 1 if remaining > 0 else len(block)
+                carry = block[end:]
+                if block[:end].strip():
+                    yield block[:end].decode('utf-8', errors='replace')
+            if carry.strip():
+                yield carry.decode('utf-8', errors='replace')
+
+    def loadColumns(self, bodyOffset, bodyEnd, nRows, usecols):
+        """
+        Parses the scan rows block by block with the C reader of np.loadtxt into one preallocated array
+        :param bodyOffset: int byte offset of the first scan row
+        :param bodyEnd: int byte offset of the end of the last scan row
+        :param nRows: int number of lines of the scan rows (see countRows)
+        :param usecols: list of column indices to keep
+        :return: (rows, len(usecols)) float64 array
+        """
+        data = np.empty((nRows, len(usecols)))
+        filled = 0
+        for chunk in self.bodyChunks(bodyOffset, bodyEnd):
+            # Without max_rows the reader stops at the end of the chunk and skips blank lines itself
+            try:
+                block = np.loadtxt(io.StringIO(chunk), delimiter=self.delimiter, usecols=usecols, ndmin=2,
+                                   comments=None)
+            except ValueError:
+                # Empty cells (e.g. over-range channels) are missing values; the slower converter only runs on chunks
+                # that have them
+                block = np.loadtxt(io.StringIO(chunk), delimiter=self.delimiter, usecols=usecols, ndmin=2,
+                                   comments=None, converters=self.toFloat)
+            data[filled:filled + len(block)] = block
+            filled += len(block)
+        return data[:filled]
+
+    def splitFields(self, line):
+        fields = [field.strip().strip('"') for field in line.split(self.delimiter)]
+        while fields and fields[-1] == '':
+            fields.pop()
+        return fields
+
+    @staticmethod
+    def toFloat(field):
+        """
+        :param field: string field of a scan row
+        :return: float value, NaN for an empty field
+        """
+        return float(field) if field.strip() else np.nan
 
+    @staticmethod
+    def isNumeric(fields):
+        """
+        :param fields: list of string fields of a line
+        :return: bool True if every field is a number or empty (a missing value), and at least one is a number
+        """
+        try:
+            values = [float(field) for field in fields if field]
+        except ValueError:
+            return False
+        return len(values) > 0
 
-    def import(self, paths):
-        self.smpData.parseDAT(paths)
+    def stripFooter(self, body):
+        """
+        :param body: bytes from the first scan row (or any later line) to the end of the file
+        :return: bytes up to the end of the last scan row, trailing non-numeric lines removed
+        """
+        body = body.rstrip()
+        while body:
+            end = body.rfind(b'\n')
+            last = self.splitFields(body[end + 1:].decode('utf-8', errors='replace'))
+            if last and self.isNumeric(last):
+                break
+            body = body[:max(end, 0)].rstrip()
+        return body
 
+    def acquisitionTime(self, metaLines):
+        """
+        :param metaLines: list of metadata lines preceding the header
+        :return: struct_time of the first date and time found in the metadata, or the modification time of the file
+        """
+        pattern = re.compile(r'\d{1,4}[/-]\d{1,2}[/-]\d{1,4}[ T]+\d{1,2}:\d{2}(?::\d{2})?(?:\s*[AaPp][Mm])?')
+        for line in metaLines:
+            for match in pattern.findall(line):
+                stamp = re.sub(r'\s+', ' ', match.replace('T', ' ')).upper()
+                for form in self.timeFormats:
+                    try:
+                        return datetime.strptime(stamp, form).timetuple()
+                    except ValueError:
+                        continue
+        return time.localtime(os.path.getmtime(self.filePath))
 
-    def getStartTime(self):
-        self.smpData.
+    @staticmethod
+    def parseLabel(label):
+        """
+        :param label: string column label, e.g. "Pb208", "208Pb (A)", "Pb-208 Pulse", "Pb 208 -> 208 CPS"
+        :return: isotope key (element symbol and mass number, e.g. "Pb208") or None, detector ('pulse' or 'analog')
+        """
+        match = re.search(r'(?<![A-Za-z0-9])(?:(\d{1,3})\s*-?\s*([A-Z][a-z]?)|([A-Z][a-z]?)\s*-?\s*(\d{1,3}))'
+                          r'(?![0-9])', label)
+        if match is None:
+            return None, None
+        mass, symbol = (match.group(1), match.group(2)) if match.group(1) else (match.group(4), match.group(3))
+        rest = label[match.end():]
+        detector = 'pulse'
+        if re.search(r'(?<![A-Za-z])(?:A|An|Analog|Analogue)(?![A-Za-z])', rest, re.IGNORECASE):
+            detector = 'analog'
+        return f'{symbol}{int(mass)}', detector
 
-class AgilentImporter(RawImporter):
-    def __init__(self):
-        self.type = 'Agilent'
-        super.__init__()
+    def mapColumns(self, header):
+        """
+        :param header: list of column labels
+        :return: int index of the time column, {isotope: {detector: [column indices]}} in column order
+        """
+        timeIdx = None
+        columns = {}
+        for j, label in enumerate(header):
+            if timeIdx is None and re.search('time', label, re.IGNORECASE):
+                timeIdx = j
+                continue
+            isotope, detector = self.parseLabel(label)
+            if isotope is None:
+                continue
+            columns.setdefault(isotope, {}).setdefault(detector, []).append(j)
+        if timeIdx is None:
+            raise ValueError(f'No time column in {self.filePath}')
+        if not columns:
+            raise ValueError(f'No isotope columns in {self.filePath}')
+        return timeIdx, columns
 
-    def import(self):
-        pass
+    def buildRecord(self, smpRecord, header, timeIdx, columns, data, metaLines):
+        """
+        :param data: {column index: (scans,) values}
+        :return: dictionary record of the scans (see ThermoDAT.readScans)
+        """
+        cycleTime = data[timeIdx]
+        if re.search(r'\bms\b|msec|milli', header[timeIdx], re.IGNORECASE):
+            cycleTime = cycleTime / 1000
+        nScans = len(cycleTime)
+        # Without a dwell entry the scan interval is shared evenly by the isotope channels
+        nChannels = sum(len(detectors.get('pulse', detectors.get('analog'))) for detectors in columns.values())
+        interval = np.median(np.diff(cycleTime)) if nScans > 1 else 0
+        chDwell = interval / nChannels
+        scans = {'nScans': nScans,
+                 'ACF': np.ones(nScans),
+                 'FCF': np.ones(nScans),
+                 'EDAC': np.zeros(nScans),
+                 'scanTime': cycleTime + time.mktime(smpRecord.fileTimes["DAT"]),
+                 'masses': {}}
+        for isotope, detectors in columns.items():
+            pulse = np.column_stack([data[j] for j in detectors.get('pulse', [])]) if 'pulse' in detectors else None
+            analog = np.column_stack([data[j] for j in detectors.get('analog', [])]) if 'analog' in detectors else None
+            if pulse is None:
+                pulse = np.full_like(analog, np.nan)
+            if analog is None:
+                analog = np.full_like(pulse, np.nan)
+            channels = pulse.shape[1]
+            mass = float(re.search(r'\d+', isotope).group())
+            scans['masses'][isotope] = {'pulse': pulse, 'analog': analog, 'faraday': np.full_like(pulse, np.nan),
+                                        'chDwell': chDwell, 'channels': channels,
+                                        'magMasses': np.full(channels, mass), 'actMasses': np.full(channels, mass)}
+        smpRecord.isotopes = list(columns.keys())
+        smpRecord.metaData = {'runs': 1, 'passes': 1, 'cycles': nScans, 'masses': len(columns),
+                              'deadTime': self.session.machineDeadTime, 'header': metaLines}
+        return scans
 
-class PerkinElmerImporter(RawImporter):
-    def __init__(self):
-        self.type = 'Perkin-Elmer'
-        super.__init__()
 
-    def import(self):
-        pass
\ No newline at end of file
+@registerImporter
+class TextImporter(CSVImporter):
+    """
+    Delimited text exports of any instrument laid out as CSVImporter files, separated by tabs, commas, semicolons or
+    whitespace
+    """
+    name = 'Text'
+    label = 'Any File (*.txt)'
+    fileFilter = 'Text Exports (*.txt)'
+    extensions = ('.txt',)
+    delimiter = None
@@ -1,12 +1,16 @@
 import csv
+import io
 import struct
 import time
 import re
 import numpy as np
 import os
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
 #Project imports
 from src.records.Session import Session, Mass, Sample
+from src.fitting import PostProcess
+from src.fileIO import ChromFormat
 
 
 """ BEGIN INSTRUMENT CONSTANTS """
@@ -163,11 +167,15 @@ class ThermoDAT(Sample):
             self.fileTimes["DAT"] = time.localtime(tmp[0])
         dat.close()
 
-    def getDatScans(self, infRead = True):
+    def readScans(self, start=0, stop=None):
         """
-        Extracts raw data block based on entries in DatHdr.
-        :param dat: file object for binary read (opened for binary read)
-        :return:
+        Reads and decodes a range of scans from the *.dat file without loading them into the session.  The mass
+        table (dwell, magnet and actual masses, detector of each intensity column) is taken from the first scan of
+        the file, so any chunk of scans decodes the same way as the whole file.
+        :param start: int index of the first scan
+        :param stop: int index one past the last scan, None to read to the end of the file
+        :return: dictionary with nScans (in the file), ACF, FCF, EDAC, scanTime (absolute) of the scans read and
+        masses, {isotope: {pulse, analog, faraday, chDwell, channels, magMasses, actMasses}} in acquisition order
         """
         with open(self.datPath, mode='rb') as dat:
             dat.seek(OFFSET_HEADER_START)
@@ -180,157 +188,102 @@ class ThermoDAT(Sample):
 
             length = datHdr[1] - datHdr[0]
             nVals = int(length / 4)
-            rows = len(datHdr)
-            cols = nVals
-            datScans = np.zeros((rows, cols), dtype=np.uint32)
-            # print(f'Len: {length}, rows: {rows}, cols {cols}')
-            for i, x in enumerate(datHdr):
+            dat.seek(datHdr[0])
+            parseRow = np.frombuffer(dat.read(length), dtype='<u4').astype(np.uint32)
+            offsets = datHdr[start:stop]
+            datScans = np.zeros((len(offsets), nVals), dtype=np.uint32)
+            for i, x in enumerate(offsets):
                 dat.seek(x)
-                line = struct.unpack('<%dL' % nVals, dat.read(length))
-                try:
-                    datScans[i, :] = line
-                except:
-                    for j, val in enumerate(line):
-                        try:
-                            datScans[i, j] = np.uint32(val)
-                        except:
-                            print(f'{i},{j}: {type(val)}')
-
-            ACF = np.array(datScans[:, 12] / 64)
-            FCF = np.array(datScans[:, 34] >> 8)
-            EDAC = np.array(datScans[:, 31])
-            scanTime = np.array((datScans[:, 19] - datScans[0, 18]) / 1000)
-            scanTime += time.mktime(self.fileTimes["DAT"])  #ScanTime needs to be absolute for this analysis
-            sampleKeys = np.ones_like(scanTime)*self.ID
-
-            # SELECT FIRST ROW TO MASK KEYS FOR POPULATING RAW DATA
-            # dwell, magnet mass, actual mass, and truncated mass are pulled from 1st scan (i.e. not a time series)
-            # for Intensities the column at the current index is selected (i.e. all scans)
-
-            parseRow = datScans[0, :]
-            massIdx = 0
-            idx = 46
-            channels = 0
-            dwell = 0
-            # String of isotope ID, used as key for dictionary
-            magMasses = np.array([])
-            actMasses = np.array([])
-            pulse = np.array([])
-            analog = np.array([])
-            faraday = np.array([])
-
-            for x in parseRow[idx:]:
-                key = x & DAT_TYPE_MASK  # DAT_TYPE_MASK   = 0xF0000000
-                dataBits = x & DAT_DATA_MASK  # DAT_DATA_MASK   = 0x0FFFFFFF
-                if key == KEY_DWELL:
-                    dwell = dataBits /1E+6
-                    idx += 1
-                elif key == KEY_MAG:
-                    magMass = dataBits * 1.0 / (2.0 ** (MAG_DAC_BITS))
-                    magMasses = np.append(magMasses, magMass)
-                    idx += 1
-                elif key == KEY_MAGF:
-                    magMass = magMasses[-1]
-                    actMass = 1 / (float(dataBits)) * magMass * EDAC[0] * 1000
-                    actMasses = np.append(actMasses, actMass)
-                    idx += 1
-                    channels += 1
-                elif key == KEY_INTENSITY:
-                    detType = dataBits & DETECT_TYP_MASK
-                    allScans = datScans[:, idx]
-                    iExp = (allScans & DATA_EXP_MASK) >> 16 #EXP_SHIFT
-                    iBase = allScans & DATA_BASE_MASK
-                    iFlag = (allScans & DATA_FLAG_MASK) > 0
-                    values = np.where(iFlag, iBase * float("nan"), iBase << iExp)
-                    values = np.expand_dims(values, 1)
-                    if detType == KEY_PULSE:
-                        if channels == 1:
-                            pulse = values
-                        else:
-                            pulse = np.append(pulse, values, axis=1)
-                    elif detType == KEY_ANALOG:
-                        if channels == 1:
-                            analog = values
-                        else:
-                            analog = np.append(analog, values, axis=1)
-                    elif detType == KEY_FARADAY:
-                        if channels == 1:
-                            faraday = values
-                        else:
-                            faraday = np.append(faraday, values, axis=1)
-                    idx += 1
-                elif key == KEY_END_OF_MASS:
-                    if self.isotopes is None:
-                        isotope = massIdx
-                    else:
-                        isotope = self.isotopes[massIdx]
-                    # Calculate CHROM Data
-                    pCross = self.session.pCross  # Cross-over to analog counts
-                    analogCounts = (analog.T * ACF).T
-                    # Filter pulse count array NaNs or P-greater-than-threshold values are replaced with corresponding ACF-scaled analog value
-                    reported = np.where(pCross > pulse, pulse, analogCounts)
-                    if not self.session.ignoreFaraday:
-                        reported = np.where(np.isnan(reported), (faraday.T * FCF).T, reported)
-                    timeSeries = np.nanmean(reported, axis=1)
-
-                    if isotope not in self.session.masses.keys():
-                        self.session.masses[isotope] = Mass(self.session)
-                        self.session.masses[isotope].ACF = ACF
-                        self.session.masses[isotope].pulse = pulse
-                        self.session.masses[isotope].analog = analog
-                        self.session.masses[isotope].faraday = faraday
-                        self.session.masses[isotope].timeSeries = timeSeries
-                        self.session.masses[isotope].chDwell = dwell
-                        self.session.masses[isotope].aveMass = np.mean(actMasses)
-                        truncMass = round(np.mean(actMasses) / MASS_NUMERIC_PRECISION) * MASS_NUMERIC_PRECISION
-                        self.session.masses[isotope].truncMass = truncMass
-                        self.session.masses[isotope].channels = channels
-                        self.session.masses[isotope].totalDwell = channels * dwell
-                        self.session.masses[isotope].magMasses = magMasses
-                        self.session.masses[isotope].actMasses = actMasses
-                    else:
-                        self.session.masses[isotope].ACF = np.append(self.session.masses[isotope].ACF, ACF, axis=0)
-                        self.session.masses[isotope].pulse = np.append(self.session.masses[isotope].pulse, pulse, axis=0)
-                        self.session.masses[isotope].analog = np.append(self.session.masses[isotope].analog, analog, axis=0)
-                        self.session.masses[isotope].faraday = np.append(self.session.masses[isotope].analog, faraday, axis=0)
-                        self.session.masses[isotope].timeSeries = np.append(self.session.masses[isotope].timeSeries, timeSeries, axis=0)
-
-                    channels = 0
-                    massIdx += 1
-                    idx += 1
-                    pulse = np.array([[]])
-                    analog = np.array([[]])
-                    faraday = np.array([[]])
-                    magMasses = np.array([])
-                    actMasses = np.array([])
-
-                elif key == KEY_END_OF_SCAN:
-                    if self.session.FCF.size == 0:
-                        self.session.FCF = FCF
-                    else:
-                        self.session.FCF = np.append(self.session.FCF, FCF)
-                    if self.session.EDAC.size == 0:
-                        self.session.EDAC = EDAC
+                datScans[i, :] = np.frombuffer(dat.read(length), dtype='<u4')
+
+        scans = {'nScans': len(datHdr)}
+        scans['ACF'] = np.array(datScans[:, 12] / 64)
+        scans['FCF'] = np.array(datScans[:, 34] >> 8)
+        scans['EDAC'] = np.array(datScans[:, 31])
+        scanTime = np.array((datScans[:, 19] - parseRow[18]) / 1000)
+        scanTime += time.mktime(self.fileTimes["DAT"])  #ScanTime needs to be absolute for this analysis
+        scans['scanTime'] = scanTime
+        scans['masses'] = {}
+
+        # SELECT FIRST ROW TO MASK KEYS FOR POPULATING RAW DATA
+        # dwell, magnet mass, actual mass, and truncated mass are pulled from 1st scan (i.e. not a time series)
+        # for Intensities the column at the current index is selected (i.e. all scans)
+        massIdx = 0
+        idx = 46
+        channels = 0
+        dwell = 0
+        # String of isotope ID, used as key for dictionary
+        magMasses = np.array([])
+        actMasses = np.array([])
+        pulse = np.array([])
+        analog = np.array([])
+        faraday = np.array([])
+
+        for x in parseRow[idx:]:
+            key = x & DAT_TYPE_MASK  # DAT_TYPE_MASK   = 0xF0000000
+            dataBits = x & DAT_DATA_MASK  # DAT_DATA_MASK   = 0x0FFFFFFF
+            if key == KEY_DWELL:
+                dwell = dataBits /1E+6
+                idx += 1
+            elif key == KEY_MAG:
+                magMass = dataBits * 1.0 / (2.0 ** (MAG_DAC_BITS))
+                magMasses = np.append(magMasses, magMass)
+                idx += 1
+            elif key == KEY_MAGF:
+                magMass = magMasses[-1]
+                actMass = 1 / (float(dataBits)) * magMass * parseRow[31] * 1000
+                actMasses = np.append(actMasses, actMass)
+                idx += 1
+                channels += 1
+            elif key == KEY_INTENSITY:
+                detType = dataBits & DETECT_TYP_MASK
+                allScans = datScans[:, idx]
+                iExp = (allScans & DATA_EXP_MASK) >> 16 #EXP_SHIFT
+                iBase = allScans & DATA_BASE_MASK
+                iFlag = (allScans & DATA_FLAG_MASK) > 0
+                values = np.where(iFlag, iBase * float("nan"), iBase << iExp)
+                values = np.expand_dims(values, 1)
+                if detType == KEY_PULSE:
+                    if channels == 1:
+                        pulse = values
                     else:
-                        self.session.EDAC = np.append(self.session.EDAC, EDAC)
-                    if self.session.scanTime.size == 0:
-                        self.session.scanTime = scanTime
+                        pulse = np.append(pulse, values, axis=1)
+                elif detType == KEY_ANALOG:
+                    if channels == 1:
+                        analog = values
                     else:
-                        self.session.scanTime = np.append(self.session.scanTime, scanTime)
-                    if self.session.sampleKeys.size == 0:
-                        self.session.sampleKeys = sampleKeys
+                        analog = np.append(analog, values, axis=1)
+                elif detType == KEY_FARADAY:
+                    if channels == 1:
+                        faraday = values
                     else:
-                        self.session.sampleKeys = np.append(self.session.sampleKeys, sampleKeys)
-
-                    # print(f"End of Scan @{idx}")
-                    if not infRead:
-                        for key in self.session.masses.keys():
-                            intMass = self.session.masses[key].truncMass
-                        # TODO: Query
-                    self.session.samples[self.name] = self
-                    # IoLog.debug(f"{name} DAT file read complete")
-        dat.close()
+                        faraday = np.append(faraday, values, axis=1)
+                idx += 1
+            elif key == KEY_END_OF_MASS:
+                if self.isotopes is None:
+                    isotope = massIdx
+                else:
+                    isotope = self.isotopes[massIdx]
+                scans['masses'][isotope] = {'pulse': pulse, 'analog': analog, 'faraday': faraday, 'chDwell': dwell,
+                                            'channels': channels, 'magMasses': magMasses, 'actMasses': actMasses}
+                channels = 0
+                massIdx += 1
+                idx += 1
+                pulse = np.array([[]])
+                analog = np.array([[]])
+                faraday = np.array([[]])
+                magMasses = np.array([])
+                actMasses = np.array([])
+            elif key == KEY_END_OF_SCAN:
+                break
+        return scans
 
+    def getDatScans(self, infRead = True):
+        """
+        Extracts raw data block based on entries in DatHdr and appends it to the session.
+        """
+        self.session.appendRecord(self, self.readScans(), MASS_NUMERIC_PRECISION)
+        # IoLog.debug(f"{name} DAT file read complete")
 
 
 class ThermoINF:
@@ -423,42 +376,211 @@ class ThermoFIN2:
         fNames = []
         finPath = os.path.join(fin2Dir, finName)
         for smpName, smpRecord in self.session.samples.items():
-            fName = smpName +".FIN2"
-            fPath = os.path.join(fin2Dir, fName)
-            fNames.append(fName)
-            mask = np.where(self.session.sampleKeys == smpRecord.ID)
-            cycleTime = self.session.scanTime[mask]
-            cycleTime = cycleTime - np.amin(cycleTime)
-            cycleTime = cycleTime*10000
-            cycleTime = cycleTime.astype(int)/10000
-            chromData = np.expand_dims(cycleTime, axis=1)
-            chromHdr = ['Time']
-            line6 = []
-            for massName, massObj in self.session.masses.items():
+            fNames.append(self.writeSample(fin2Dir, finName, smpName, smpRecord, postProcessed))
+        self.writeFIN(finPath, fNames, smpRecord, startTime)
+
+    def writeSample(self, fin2Dir, finName, smpName, smpRecord, postProcessed: bool = False):
+        """
+        Writes the FIN2 file of one sample from the time series held in the session
+        :return: string FIN2 file name
+        """
+        fName = smpName +".FIN2"
+        fPath = os.path.join(fin2Dir, fName)
+        mask = np.where(self.session.sampleKeys == smpRecord.ID)
+        cycleTime = self.session.scanTime[mask]
+        cycleTime = cycleTime - np.amin(cycleTime)
+        columns = []
+        for massName, massObj in self.session.masses.items():
+            if not postProcessed:
+                columns.append(massObj.timeSeries[mask])
+            else:
+                columns.append(massObj.modeledTimeSeries[mask])
+        text = io.StringIO()
+        self.writeHeader(text, smpRecord, finName, len(cycleTime))
+        text.write(self.chromText(self.chromRows(cycleTime, columns)))  # Data    :  2D data array
+        with open(fPath, 'w', newline='') as fin2:
+            fin2.write(text.getvalue())
+        return fName
+
+    def writeStreamed(self, fin2Dir, finName, postProcessed: bool = True, chunkSize=PostProcess.CHUNK_SCANS):
+        """
+        Writes the same files as write, one sample and one chunk of scans at a time.  Raw data of each chunk are
+        re-read from the sample's *.dat file, modeled with the committed postProcessPars of every isotope and written
+        straight away, so peak memory is set by chunkSize rather than by the length of the session and the
+        modeledTimeSeries of the isotopes are not needed.
+        :param fin2Dir: string output directory
+        :param finName: string name of the *.FIN index file
+        :param postProcessed: bool True to write modeled time series, False for the reported time series
+        :param chunkSize: int number of scans held in memory at once
+        """
+        startTime = time.localtime(datetime.now().timestamp())
+        fNames = []
+        finPath = os.path.join(fin2Dir, finName)
+        for smpName, smpRecord in self.session.samples.items():
+            fNames.append(self.writeSampleStreamed(fin2Dir, finName, smpName, smpRecord, postProcessed, chunkSize))
+        self.writeFIN(finPath, fNames, smpRecord, startTime)
+
+    def writeSampleStreamed(self, fin2Dir, finName, smpName, smpRecord, postProcessed: bool = True,
+                            chunkSize=PostProcess.CHUNK_SCANS):
+        """
+        Writes the FIN2 file of one sample chunk by chunk from its raw data (see writeStreamed)
+        :return: string FIN2 file name
+        """
+        fName = smpName +".FIN2"
+        fPath = os.path.join(fin2Dir, fName)
+        nScans = np.count_nonzero(self.session.sampleKeys == smpRecord.ID)
+        with open(fPath, 'w', newline='') as fin2:
+            self.writeHeader(fin2, smpRecord, finName, nScans)
+            for cycleTime, columns in self.seriesChunks(smpRecord, postProcessed, chunkSize, streamed=True):
+                fin2.write(self.chromText(self.chromRows(cycleTime, columns)))
+        return fName
+
+    def seriesChunks(self, smpRecord, postProcessed: bool = True, chunkSize=PostProcess.CHUNK_SCANS,
+                     streamed: bool = False):
+        """
+        Time series of one sample, chunk by chunk
+        :param smpRecord: Sample
+        :param postProcessed: bool True for modeled time series, False for the reported time series
+        :param chunkSize: int number of scans per chunk
+        :param streamed: bool True to model each chunk from its raw data, re-read from the *.dat file at its import
+        path; False to slice the time series held in the session (timeSeries or modeledTimeSeries)
+        :return: generator of (cycleTime (n,) since the first scan of the sample, list of (n,) series per isotope)
+        """
+        sessionStart = np.amin(self.session.scanTime)
+        mask = np.where(self.session.sampleKeys == smpRecord.ID)[0]
+        sampleStart = np.amin(self.session.scanTime[mask]) if len(mask) else sessionStart
+        if not streamed:
+            for start in range(0, len(mask), chunkSize):
+                rows = mask[start:start + chunkSize]
+                columns = []
+                for massName, massObj in self.session.masses.items():
+                    series = massObj.modeledTimeSeries if postProcessed else massObj.timeSeries
+                    columns.append(series[rows])
+                yield self.session.scanTime[rows] - sampleStart, columns
+            return
+        for scans in self.sampleChunks(smpRecord, mask, chunkSize):
+            # Blocks are matched to the isotopes by acquisition order: files without a method (*.inf) are read with
+            # numbered isotopes, which the session renames after import
+            blocks = list(scans['masses'].values())
+            if len(blocks) != len(self.session.masses):
+                raise ValueError(f'{smpRecord.filePaths["DAT"]} holds {len(blocks)} isotopes, the session '
+                                 f'{len(self.session.masses)}')
+            columns = []
+            for block, massObj in zip(blocks, self.session.masses.values()):
                 if not postProcessed:
-                    fixedPrecision = 100 * massObj.timeSeries[mask]
+                    series = PostProcess.reportedArrays(block['pulse'], block['analog'], block['faraday'],
+                                                        scans['ACF'], scans['FCF'], self.session)
                 else:
-                    fixedPrecision = 100 * massObj.modeledTimeSeries[mask]
-                fixedPrecision = fixedPrecision.astype(int)
-                fixedPrecision = fixedPrecision / 100
-                fixedPrecision = np.expand_dims(fixedPrecision,axis=1)
-                chromData = np.append(chromData, fixedPrecision, axis=1)
-                chromHdr.append(massName)
-                line6.append("16")
-            with open(fPath, 'w', newline='') as fin2:
-                    fin2writer = csv.writer(fin2, delimiter=',')
-                    fin2writer.writerow(["Finnigan MAT ELEMENT Raw Data"])  # Header 1:  File type description
-                    timestamp = time.strftime('%A, %B %d, %Y %H:%M:%S', smpRecord.fileTimes["DAT"])
-                    fin2.write(timestamp + '\r\n')  # Header 2:  timestamp
-                    fin2writer.writerow([finName])  # Header 3:  FIN file name
-                    fin2writer.writerow([f'{len(cycleTime)}'])  # Header 4:  n Scans
-                    fin2writer.writerow([0])  # Header 5:  unknown
-                    fin2writer.writerow(line6)  # Header 6:  unknown
-                    fin2writer.writerow(["CPS"])  # Header 7:  units
-                    fin2writer.writerow(chromHdr)  # Header 8:  column names
-                    fin2writer.writerows(chromData)  # Data    :  2D data array
-                    fin2.close()
-        # Write FIN File
+                    alpha, deadTime = PostProcess.modelSources(massObj)
+                    with np.errstate(divide='ignore', invalid='ignore'):
+                        series = PostProcess.modelArrays(block['pulse'], block['analog'], scans['ACF'],
+                                                         scans['scanTime'] - sessionStart, alpha, deadTime,
+                                                         massObj.chDwell, self.session)[0]
+                columns.append(series)
+            yield scans['scanTime'] - sampleStart, columns
+
+    def writeParallel(self, fin2Dir, finName, postProcessed: bool = True, streamed: bool = False, workers=None,
+                      progress=None):
+        """
+        Writes the sample FIN2 files concurrently in a thread pool (file I/O and the NumPy formatting release the
+        GIL) and the *.FIN index last, once every sample file is complete.  Files are identical to write and
+        writeStreamed.
+        :param fin2Dir: string output directory
+        :param finName: string name of the *.FIN index file
+        :param postProcessed: bool True to write modeled time series, False for the reported time series
+        :param streamed: bool True to model each sample from its raw data (writeSampleStreamed, the *.dat files must
+        be at their import paths), False to write the time series held in the session (writeSample)
+        :param workers: int number of threads, None for one per core
+        :param progress: callable(fName) invoked from the calling thread as each sample file completes
+        :return: list of FIN2 file names in session order
+        """
+        startTime = time.localtime(datetime.now().timestamp())
+        finPath = os.path.join(fin2Dir, finName)
+        writer = self.writeSampleStreamed if streamed else self.writeSample
+        samples = list(self.session.samples.items())
+        workers = workers or os.cpu_count() or 1
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(samples)))) as pool:
+            futures = [pool.submit(writer, fin2Dir, finName, smpName, smpRecord, postProcessed)
+                       for smpName, smpRecord in samples]
+            for future in as_completed(futures):
+                fName = future.result()
+                if progress is not None:
+                    progress(fName)
+        fNames = [future.result() for future in futures]
+        if len(samples) > 0:
+            self.writeFIN(finPath, fNames, samples[-1][1], startTime)
+        return fNames
+
+    def sampleChunks(self, smpRecord, mask, chunkSize):
+        """
+        Raw data of a sample, chunk by chunk: read from the *.dat file when the sample has one, otherwise sliced from
+        the session arrays
+        :param smpRecord: Sample
+        :param mask: (n,) session scan indices of the sample
+        :param chunkSize: int number of scans per chunk
+        :return: generator of readScans-style dictionaries (scanTime, ACF, FCF, masses)
+        """
+        for start in range(0, len(mask), chunkSize):
+            if hasattr(smpRecord, 'readScans'):
+                yield smpRecord.readScans(start, start + chunkSize)
+                continue
+            rows = mask[start:start + chunkSize]
+            scans = {'scanTime': self.session.scanTime[rows], 'FCF': self.session.FCF[rows], 'masses': {}}
+            # The stored ACF is the per-scan instrument value, common to all isotopes
+            scans['ACF'] = next(iter(self.session.masses.values())).ACF[rows]
+            for massName, massObj in self.session.masses.items():
+                scans['masses'][massName] = {'pulse': massObj.pulse[rows], 'analog': massObj.analog[rows],
+                                             'faraday': massObj.faraday[rows]}
+            yield scans
+
+    @staticmethod
+    def chromRows(cycleTime, columns):
+        """
+        FIN2 data block: time truncated to 0.1 ms and intensities truncated to 0.01 CPS
+        :param cycleTime: (n,) time since the first scan of the sample
+        :param columns: list of (n,) time series, one per isotope
+        :return: (n, 1 + isotopes) array
+        """
+        chromData = np.empty((len(cycleTime), 1 + len(columns)))
+        chromData[:, 0] = (cycleTime * 10000).astype(int) / 10000
+        for j, series in enumerate(columns):
+            chromData[:, j + 1] = (100 * series).astype(int) / 100
+        return chromData
+
+    @staticmethod
+    def chromText(chromData):
+        """
+        :param chromData: (n, 1 + isotopes) array returned by chromRows
+        :return: string of the data block, identical to csv.writer.writerows
+        """
+        return ChromFormat.formatRows(chromData, [4] + [2] * (chromData.shape[1] - 1))
+
+    def writeHeader(self, fin2, smpRecord, finName, nScans):
+        """
+        Writes the eight FIN2 header lines
+        :param fin2: text file (or buffer) opened with newline=''
+        """
+        chromHdr = ['Time'] + list(self.session.masses.keys())
+        line6 = ["16"] * len(self.session.masses)
+        fin2writer = csv.writer(fin2, delimiter=',')
+        fin2writer.writerow(["Finnigan MAT ELEMENT Raw Data"])  # Header 1:  File type description
+        timestamp = time.strftime('%A, %B %d, %Y %H:%M:%S', smpRecord.fileTimes["DAT"])
+        fin2.write(timestamp + '\r\n')  # Header 2:  timestamp
+        fin2writer.writerow([finName])  # Header 3:  FIN file name
+        fin2writer.writerow([f'{nScans}'])  # Header 4:  n Scans
+        fin2writer.writerow([0])  # Header 5:  unknown
+        fin2writer.writerow(line6)  # Header 6:  unknown
+        fin2writer.writerow(["CPS"])  # Header 7:  units
+        fin2writer.writerow(chromHdr)  # Header 8:  column names
+
+    def writeFIN(self, finPath, fNames, smpRecord, startTime):
+        """
+        Writes the *.FIN index of the FIN2 files
+        :param finPath: string path of the *.FIN file
+        :param fNames: list of FIN2 file names
+        :param smpRecord: Sample providing the SEQ, MET, TPF and DAT paths
+        :param startTime: struct_time of the export
+        """
         with open(finPath, 'w', newline='') as fin:
             finwriter = csv.writer(fin, delimiter=',')
             finwriter.writerow(["Finnigan MAT ELEMENT"])  # Header 1:  File type description
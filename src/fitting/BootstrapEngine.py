@@ -0,0 +1,180 @@
+import os
+import warnings
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+# Project imports
+from src.fitting import LinearEngine, RobustEngine
+from src.fitting.ParallelFit import SharedBlock, attachArrays, MIN_OBSERVATIONS
+
+"""
+BLOCK BOOTSTRAP OF THE ISOTOPE REGRESSIONS
+Observations are grouped into blocks (scans or samples) and each isotope is reduced once, in a process pool, to the
+augmented Gram matrix of every block.  A bootstrap replicate draws session blocks with replacement, so its Gram
+matrix is the count-weighted sum of the block Gram matrices.  All isotopes share the same draws (the blocks of a
+scan or sample are resampled jointly), so a chunk of replicates for every isotope is one
+(replicates x blocks) @ (blocks x isotopes*Gram) product followed by one batched solve.
+Robust fits are bootstrapped with the IRLS weights of the full-data fit held fixed (one-step bootstrap).
+"""
+
+MAX_COUNT_CELLS = 4000000  # replicates x blocks held in memory at once
+MIN_BLOCKS = 20  # fewer sample blocks give meaningless percentile intervals; scans are resampled instead
+
+
+def blockGrams(y, X, w, blocks, nBlocks):
+    """
+    Augmented Gram matrix of every block
+    :param y: (n,) response
+    :param X: (n, p) design matrix
+    :param w: (n,) fitting weights, None for unit weights
+    :param blocks: (n,) int block index of each observation
+    :param nBlocks: int number of blocks
+    :return: (nBlocks, p+1, p+1) Gram matrices
+    """
+    p = X.shape[1]
+    Z = np.empty((len(y), p + 1))
+    Z[:, :-1] = X
+    Z[:, -1] = y
+    Zw = Z if w is None else Z * w[:, None]
+    grams = np.zeros((nBlocks, p + 1, p + 1))
+    for i in range(p + 1):
+        for j in range(i, p + 1):
+            grams[:, i, j] = np.bincount(blocks, weights=Zw[:, i] * Z[:, j], minlength=nBlocks)
+            grams[:, j, i] = grams[:, i, j]
+    return grams
+
+
+def bootstrapGrams(grams, nReplicates, rng):
+    """
+    Parameter replicates of the block bootstrap
+    :param grams: (nBlocks, k, p+1, p+1) block Gram matrices of k isotopes
+    :param nReplicates: int number of bootstrap replicates
+    :param rng: numpy Generator
+    :return: (nReplicates, k, p) parameter replicates
+    """
+    nBlocks, k, q, _ = grams.shape
+    # Gram matrices are symmetric; only the upper triangle enters the product
+    upper = np.triu_indices(q)
+    flat = grams[:, :, upper[0], upper[1]].reshape(nBlocks, -1)
+    chunk = max(1, MAX_COUNT_CELLS // nBlocks)
+    replicates = []
+    for start in range(0, nReplicates, chunk):
+        r = min(chunk, nReplicates - start)
+        draws = rng.integers(0, nBlocks, (r, nBlocks)) + np.arange(r)[:, None] * nBlocks
+        counts = np.bincount(draws.ravel(), minlength=r * nBlocks).reshape(r, nBlocks).astype(float)
+        triangle = (counts @ flat).reshape(r, k, -1)
+        sums = np.empty((r, k, q, q))
+        sums[:, :, upper[0], upper[1]] = triangle
+        sums[:, :, upper[1], upper[0]] = triangle
+        replicates.append(LinearEngine.solveGram(sums)[0])
+    return np.concatenate(replicates)
+
+
+def blockGramWorker(specs, model, regType, normType, nBlocks, startParams=None):
+    """
+    Worker process entry point.
+    :param specs: (pulse, analog, time, block) shared memory specs or arrays
+    :param model: dictionary with deadTime, dwell and startTime of the isotope
+    :param regType: string "Weighted", "Ordinary" or "Robust"
+    :param normType: string M-estimator for robust fits
+    :param nBlocks: int number of blocks in the session
+    :param startParams: [tau, a1, a2] warm start of the robust weights
+    :return: (nBlocks, 4, 4) block Gram matrices under the fitting weights
+    """
+    pulse, analog, time, block = attachArrays(specs)
+    y, X, W = LinearEngine.designArrays(pulse, analog, time, model['deadTime'], model['dwell'],
+                                        model['startTime'])
+    if regType == "Robust":
+        startWeights = W
+        if normType is not None and normType.replace(" ", "") == "Whitened":
+            # Whitened rows already carry the weights; their unweighted Gram gives the WLS warm start of Session
+            y, X = RobustEngine.whiten(y, X, W)
+            startWeights = None
+        if startParams is None:
+            startParams = LinearEngine.solveGram(LinearEngine.augmentedGram(X, y, startWeights))[0]
+        w = RobustEngine.irls(y, X, RobustEngine.getNorm(normType), startParams)['weights']
+    elif "Weighted" in regType:
+        w = W
+    else:
+        w = None
+    return blockGrams(y, X, w, block.astype(int), nBlocks)
+
+
+class BootstrapRegressor:
+    def __init__(self, workers=None):
+        """
+        :param workers: int number of worker processes, None for one per core
+        """
+        self.workers = workers or os.cpu_count() or 1
+
+    def bootstrap(self, session, by='scan', nReplicates=1000, alpha=0.05, seed=None):
+        """
+        Block bootstraps the regression of every isotope and loads the intervals into each MassFits["bootstrap"]
+        :param session: Session with filtered masses
+        :param by: string "scan" or "sample", the resampled block; sessions of fewer than MIN_BLOCKS samples are
+        resampled by scan (with a warning), and the block used is stored as "by" in the results
+        :param nReplicates: int number of bootstrap replicates
+        :param alpha: float two-sided significance level of the percentile intervals
+        :param seed: int seed for reproducible replicates, None for fresh entropy
+        :return: {massName: bootstrap results}
+        """
+        regType = session.isotopeFit["algorithm"]
+        normType = session.isotopeFit["norm"]
+        if by == 'sample':
+            scanBlock = np.unique(session.sampleKeys, return_inverse=True)[1]
+            nSamples = int(np.max(scanBlock)) + 1 if len(scanBlock) else 0
+            if nSamples < MIN_BLOCKS:
+                warnings.warn(f'{nSamples} samples are too few blocks for a sample bootstrap (minimum '
+                              f'{MIN_BLOCKS}); resampling scans instead')
+                by = 'scan'
+        if by != 'sample':
+            scanBlock = np.arange(len(session.scanTime))
+        nBlocks = int(np.max(scanBlock)) + 1 if len(scanBlock) else 0
+        fitted = {massName: massRecord for massName, massRecord in session.masses.items()
+                  if massRecord.nIn > MIN_OBSERVATIONS}
+        arrays = []
+        for massRecord in fitted.values():
+            arrays += [massRecord.filteredPulse, massRecord.filteredAnalog, massRecord.filteredTime,
+                       scanBlock[massRecord.filteredScan].astype(float)]
+        tasks = []
+        for massRecord in fitted.values():
+            model = {'deadTime': session.machineDeadTime, 'dwell': massRecord.totalDwell,
+                     'startTime': session.startTime}
+            startParams = massRecord.warmStart()
+            tasks.append((model, regType, normType, nBlocks, startParams))
+
+        grams = []
+        if self.workers > 1 and len(fitted) > 1:
+            try:
+                block = SharedBlock(arrays)
+                specs = [block.spec(i) for i in range(len(arrays))]
+            except (OSError, ValueError):
+                block = None
+                specs = arrays
+            try:
+                with ProcessPoolExecutor(max_workers=min(self.workers, len(fitted))) as pool:
+                    futures = [pool.submit(blockGramWorker, specs[4 * i:4 * i + 4], *args)
+                               for i, args in enumerate(tasks)]
+                    grams = [future.result() for future in futures]
+            finally:
+                if block is not None:
+                    block.release()
+        else:
+            grams = [blockGramWorker(arrays[4 * i:4 * i + 4], *args) for i, args in enumerate(tasks)]
+
+        results = {}
+        if len(grams) > 0:
+            replicates = bootstrapGrams(np.stack(grams, axis=1), nReplicates, np.random.default_rng(seed))
+            lower, upper = np.nanpercentile(replicates, [50 * alpha, 100 - 50 * alpha], axis=0)
+            se = np.nanstd(replicates, axis=0, ddof=1)
+            for i, massName in enumerate(fitted):
+                results[massName] = {'by': by, 'nBlocks': nBlocks, 'nReplicates': nReplicates, 'alpha': alpha}
+                for j, key in enumerate(LinearEngine.PARAMETER_KEYS):
+                    results[massName]['se_' + key] = se[i, j]
+                    results[massName]['lci_' + key] = lower[i, j]
+                    results[massName]['uci_' + key] = upper[i, j]
+
+        for massName, massRecord in session.masses.items():
+            if massRecord.fits is not None:
+                massRecord.fits['bootstrap'] = results.get(massName, {'by': by})
+        return results
@@ -0,0 +1,111 @@
+import numpy as np
+
+# Project imports
+from src.fitting import LinearEngine
+from src.fitting.SpectrumEngine import splineBasis
+
+"""
+JOINT SPECTRUM REGRESSION
+Single-stage fit of every isotope's filtered data with a1, a2 and tau expressed as functions of mass,
+
+    1/P = tau(M) + a1(M)/A + a2(M)*t/A,    p(M) = phi_p(M)' beta_p
+
+so the design row of an observation of isotope k is the Kronecker product of its [1, 1/A, t/A] row with the mass
+basis phi(M_k).  The joint normal equations are therefore sums over isotopes of Kronecker products of each
+isotope's 4x4 augmented Gram matrix (the filter-time sufficient statistics) with phi(M_k) phi(M_k)': building
+them costs O(isotopes x basis^2) whatever the number of observations, and isotopes with few observations borrow
+strength from the rest of the spectrum.
+"""
+
+DESIGN = {'a1': ('polynomial', 2), 'a2': ('polynomial', 2), 'tau': ('polynomial', 2)}
+
+
+class MassBasis:
+    def __init__(self, masses, spec):
+        """
+        Basis functions of mass for one parameter
+        :param masses: (k,) masses of all isotopes in the fit (sets scaling and spline knots)
+        :param spec: ('polynomial', order) or ('spline', number of knots) natural cubic regression spline
+        """
+        self.kind, self.size = spec
+        masses = np.asarray(masses, dtype=float)
+        self.center = np.mean(masses)
+        self.scale = np.std(masses) if np.std(masses) > 0 else 1.0
+        if self.kind == 'spline':
+            self.knots = np.unique(np.quantile(masses, np.linspace(0, 1, max(int(self.size), 2))))
+
+    def evaluate(self, mass):
+        """
+        :param mass: (n,) masses
+        :return: (n, q) basis matrix
+        """
+        mass = np.asarray(mass, dtype=float)
+        if self.kind == 'spline' and len(self.knots) >= 3:
+            return splineBasis(self.knots, mass)
+        if self.kind == 'spline':
+            return np.vander((mass - self.center) / self.scale, len(self.knots), increasing=True)
+        return np.vander((mass - self.center) / self.scale, int(self.size) + 1, increasing=True)
+
+
+def jointGram(grams, bases):
+    """
+    Augmented Gram matrix of the joint design from per-isotope augmented Gram matrices
+    :param grams: (k, 4, 4) augmented Gram matrices of [1, 1/A, t/A, 1/P], one per isotope
+    :param bases: list of 3 (k, q_p) mass basis matrices, in design column order [tau, a1, a2]
+    :return: (Q+1, Q+1) augmented Gram matrix, Q = sum of q_p
+    """
+    sizes = [basis.shape[1] for basis in bases]
+    offsets = np.concatenate([[0], np.cumsum(sizes)])
+    Q = offsets[-1]
+    gram = np.zeros((Q + 1, Q + 1))
+    for p, phiP in enumerate(bases):
+        rows = slice(offsets[p], offsets[p + 1])
+        for r, phiR in enumerate(bases):
+            gram[rows, offsets[r]:offsets[r + 1]] = np.einsum('k,ki,kj->ij', grams[:, p, r], phiP, phiR)
+        gram[rows, Q] = np.einsum('k,ki->i', grams[:, p, 3], phiP)
+        gram[Q, rows] = gram[rows, Q]
+    gram[Q, Q] = np.sum(grams[:, 3, 3])
+    return gram
+
+
+def jointRegress(accumulators, masses, design=None, weighted=True):
+    """
+    Joint fit of all isotopes with a1, a2 and tau as functions of mass
+    :param accumulators: list of RegressionAccumulator, one per isotope
+    :param masses: (k,) isotope masses
+    :param design: dictionary {'a1': spec, 'a2': spec, 'tau': spec} of MassBasis specs, None for DESIGN
+    :param weighted: bool True for WLS with W = dwell * P^3, False for OLS
+    :return: list of dictionaries keyed as the MassFits "self" entries (one per isotope), global results dictionary
+    """
+    design = dict(DESIGN, **(design or {}))
+    masses = np.asarray(masses, dtype=float)
+    basisFunctions = [MassBasis(masses, design[key]) for key in LinearEngine.PARAMETER_KEYS]
+    bases = [basis.evaluate(masses) for basis in basisFunctions]
+    gramsW = np.stack([acc.gramW for acc in accumulators])
+    nObs = np.sum([acc.nObs for acc in accumulators])
+    gramChi2 = jointGram(gramsW, bases)
+    gramFit = gramChi2 if weighted else jointGram(np.stack([acc.gram1 for acc in accumulators]), bases)
+    results = LinearEngine.fitGrams(gramFit[None], [nObs], gramChi2[None])
+    params = results['params'][0]
+    cov = results['normCov'][0] * results['scale'][0]
+    # Spline bases carry no intercept column; center the total sum of squares on the pooled weighted mean
+    pooled = np.sum(np.stack([acc.gramW if weighted else acc.gram1 for acc in accumulators]), axis=0)
+    rSqr = 1 - results['ssr'][0] / (pooled[3, 3] - pooled[0, 3] ** 2 / pooled[0, 0])
+
+    sizes = [basis.shape[1] for basis in bases]
+    offsets = np.concatenate([[0], np.cumsum(sizes)])
+    fits = [{} for _ in masses]
+    for p, (key, basis) in enumerate(zip(LinearEngine.PARAMETER_KEYS, bases)):
+        block = slice(offsets[p], offsets[p + 1])
+        values = basis @ params[block]
+        errors = np.sqrt(np.einsum('ki,ij,kj->k', basis, cov[block, block], basis))
+        for k in range(len(masses)):
+            fits[k][key] = values[k]
+            fits[k]['se_' + key] = errors[k]
+    for k, acc in enumerate(accumulators):
+        fits[k]['nObs'] = acc.nObs
+        fits[k]['rSqr'] = rSqr
+        fits[k]['redChi2'] = results['redChi2'][0]
+    summary = {'design': design, 'coefs': params, 'cov': cov, 'nObs': nObs, 'rSqr': rSqr,
+               'redChi2': results['redChi2'][0], 'dfResid': results['dfResid'][0]}
+    return fits, summary
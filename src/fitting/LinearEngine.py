@@ -0,0 +1,290 @@
+import numpy as np
+
+"""
+CLOSED-FORM LINEAR REGRESSION ENGINE
+Lightweight NumPy replacement for the statsmodels WLS/OLS fits of the isotope model
+
+    1/P = tau + a1/A + a2*t/A
+
+The model has a fixed, small number of parameters so everything needed for a fit is contained in the augmented
+Gram matrix Z'WZ of Z = [X, y].  Gram matrices of several isotopes are stacked and solved together in one batched
+call.  Parameter order follows the design matrix columns: [tau, a1, a2].
+"""
+
+PARAMETER_KEYS = ['tau', 'a1', 'a2']
+
+
+def designArrays(pulse, analog, time, deadTime, dwell, startTime):
+    """
+    Builds the response, design matrix and physical weights of the isotope regression.
+    :param pulse: array of dead-time corrected pulse count rates
+    :param analog: array of analog bits
+    :param time: array of absolute observation times
+    :param deadTime: float machine dead-time used to remove the instrument dead-time correction
+    :param dwell: float total dwell time of the mass
+    :param startTime: float absolute start time of the experiment
+    :return: y (n,), X (n, 3), W (n,)
+    """
+    P = pulse / (1 + pulse * deadTime)  # Remove Deadtime Correction
+    t = time - startTime  # Relative to start of experiment
+    y = 1 / P
+    X = np.ones((len(y), 3))
+    X[:, 1] = 1 / analog
+    X[:, 2] = t / analog
+    W = dwell * P ** 3
+    return y, X, W
+
+
+def augmentedGram(X, y, w=None):
+    """
+    Weighted Gram matrix of the augmented design Z = [X, y]
+    :param X: (n, p) design matrix
+    :param y: (n,) response
+    :param w: (n,) weights, None for unit weights
+    :return: (p+1, p+1) array; [:p, :p] = X'WX, [:p, p] = X'Wy, [p, p] = y'Wy
+    """
+    Z = np.empty((len(y), X.shape[1] + 1))
+    Z[:, :-1] = X
+    Z[:, -1] = y
+    if w is None:
+        return Z.T @ Z
+    return (Z * w[:, None]).T @ Z
+
+
+def quadraticResidual(gram, params):
+    """
+    Sum of weighted squared residuals evaluated from an augmented Gram matrix alone.
+    Subject to cancellation for very good fits; use residuals directly when the data are available.
+    :param gram: (..., p+1, p+1) augmented Gram matrices
+    :param params: (..., p) parameter vectors
+    :return: (...) weighted residual sums of squares
+    """
+    v = np.concatenate([-params, np.ones(params.shape[:-1] + (1,))], axis=-1)
+    ssr = np.einsum('...i,...ij,...j->...', v, gram, v)
+    return np.maximum(ssr, 0)
+
+
+def solveGram(gram):
+    """
+    Batched solution of the normal equations with Jacobi (column) scaling for conditioning.
+    :param gram: (k, p+1, p+1) stacked augmented Gram matrices
+    :return: params (k, p), normalized covariance inv(X'WX) (k, p, p)
+    """
+    p = gram.shape[-1] - 1
+    xtwx = gram[..., :p, :p]
+    xtwy = gram[..., :p, p]
+    d = np.sqrt(np.diagonal(xtwx, axis1=-2, axis2=-1))
+    d = np.where(d > 0, d, 1)
+    dd = d[..., :, None] * d[..., None, :]
+    normCov = np.linalg.pinv(xtwx / dd) / dd
+    params = np.einsum('...ij,...j->...i', normCov, xtwy)
+    return params, normCov
+
+
+def summarizeFits(gram, params, normCov, nObs, ssr, ssrChi2=None):
+    """
+    Calculates standard errors and goodness of fit statistics, mirroring statsmodels RegressionResults.
+    :param gram: (k, p+1, p+1) augmented Gram matrices of the fitting weights (intercept in column 0)
+    :param params: (k, p) fitted parameters
+    :param normCov: (k, p, p) normalized covariance matrices
+    :param nObs: (k,) number of observations
+    :param ssr: (k,) sum of squared residuals under the fitting weights
+    :param ssrChi2: (k,) sum of squared residuals under the physical weights, defaults to ssr
+    :return: dictionary of stacked results
+    """
+    p = params.shape[-1]
+    dfResid = np.asarray(nObs, dtype=float) - p
+    if ssrChi2 is None:
+        ssrChi2 = ssr
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scale = ssr / dfResid
+        bse = np.sqrt(np.diagonal(normCov, axis1=-2, axis2=-1) * scale[..., None])
+        # Weighted centered total sum of squares (np.average(y, weights=w) as the center)
+        centeredTSS = gram[..., p, p] - gram[..., 0, p] ** 2 / gram[..., 0, 0]
+        rSqr = 1 - ssr / centeredTSS
+        redChi2 = ssrChi2 / dfResid
+    return {'params': params, 'bse': bse, 'normCov': normCov, 'scale': scale, 'rSqr': rSqr,
+            'redChi2': redChi2, 'ssr': ssr, 'nObs': np.asarray(nObs), 'dfResid': dfResid}
+
+
+def fitGrams(gramFit, nObs, gramChi2=None):
+    """
+    Solves and summarizes stacked fits from their augmented Gram matrices alone.
+    :param gramFit: (k, p+1, p+1) augmented Gram matrices under the fitting weights
+    :param nObs: (k,) number of observations
+    :param gramChi2: (k, p+1, p+1) augmented Gram matrices under the physical weights, defaults to gramFit
+    :return: dictionary of stacked results (see summarizeFits)
+    """
+    params, normCov = solveGram(gramFit)
+    ssr = quadraticResidual(gramFit, params)
+    ssrChi2 = ssr if gramChi2 is None else quadraticResidual(gramChi2, params)
+    return summarizeFits(gramFit, params, normCov, nObs, ssr, ssrChi2)
+
+
+def regress(y, X, W, weighted=True):
+    """
+    Single-isotope convenience wrapper around batchRegress.
+    :return: dictionary of results for the isotope (see resultsToFits)
+    """
+    return batchRegress([(y, X, W)], weighted)[0]
+
+
+def batchRegress(datasets, weighted=True):
+    """
+    Fits every dataset (isotope) with one batched solve.  Each dataset is reduced to its sufficient statistics as
+    soon as it is visited, so datasets may be a generator that builds the arrays of one isotope at a time.
+    :param datasets: iterable of (y, X, W) tuples, W are the physical weights (dwell * P^3)
+    :param weighted: bool True for WLS with W, False for OLS.  Reduced chi-square always uses W.
+    :return: list of dictionaries, one per dataset, keyed as the MassFits "self" entries
+    """
+    accumulators = []
+    for y, X, W in datasets:
+        accumulator = RegressionAccumulator(nParams=X.shape[1])
+        accumulator.updateDesign(y, X, W)
+        accumulators.append(accumulator)
+    return fitAccumulators(accumulators, weighted)
+
+
+def fitAccumulators(accumulators, weighted=True):
+    """
+    Fits a list of RegressionAccumulators with one batched solve.
+    :param accumulators: list of RegressionAccumulator
+    :param weighted: bool True for WLS with W, False for OLS
+    :return: list of dictionaries keyed as the MassFits "self" entries
+    """
+    if len(accumulators) == 0:
+        return []
+    nObs = np.array([acc.nObs for acc in accumulators])
+    gramsW = np.stack([acc.gramW for acc in accumulators])
+    if weighted:
+        results = fitGrams(gramsW, nObs)
+    else:
+        results = fitGrams(np.stack([acc.gram1 for acc in accumulators]), nObs, gramsW)
+    return [resultsToFits(results, i) for i in range(len(accumulators))]
+
+
+class RegressionAccumulator:
+    """
+    Streaming sufficient statistics of the isotope regression.  The weighted (W = dwell * P^3) and unweighted
+    augmented Gram matrices are updated chunk by chunk (per file, per sample or per block of scans), so a refit is
+    O(1) in the number of observations and the filtered arrays need not be kept in memory.  Accumulators of
+    different chunks are combined with merge() or +=.
+    """
+    def __init__(self, deadTime=0.0, dwell=0.0, startTime=0.0, nParams=3):
+        """
+        :param deadTime: float machine dead-time removed from the pulse rates in update()
+        :param dwell: float total dwell time of the mass
+        :param startTime: float absolute start time of the experiment
+        :param nParams: int number of design matrix columns
+        """
+        self.deadTime = deadTime
+        self.dwell = dwell
+        self.startTime = startTime
+        self.nParams = nParams
+        self.reset()
+
+    def reset(self):
+        self.nObs = 0
+        self.gramW = np.zeros((self.nParams + 1, self.nParams + 1))
+        self.gram1 = np.zeros((self.nParams + 1, self.nParams + 1))
+
+    def update(self, pulse, analog, time):
+        """
+        Adds a chunk of filtered observations
+        :param pulse: array of dead-time corrected pulse count rates
+        :param analog: array of analog bits
+        :param time: array of absolute observation times
+        """
+        self.updateDesign(*designArrays(pulse, analog, time, self.deadTime, self.dwell, self.startTime))
+
+    def updateDesign(self, y, X, W):
+        """
+        Adds a chunk already expressed as response, design matrix and physical weights
+        """
+        if len(y) == 0:
+            return
+        self.gramW += augmentedGram(X, y, W)
+        self.gram1 += augmentedGram(X, y)
+        self.nObs += len(y)
+
+    def merge(self, other):
+        """
+        :return: new RegressionAccumulator holding the statistics of both accumulators
+        """
+        merged = RegressionAccumulator(self.deadTime, self.dwell, self.startTime, self.nParams)
+        merged += self
+        merged += other
+        return merged
+
+    def __iadd__(self, other):
+        self.gramW += other.gramW
+        self.gram1 += other.gram1
+        self.nObs += other.nObs
+        return self
+
+    def fit(self, weighted=True):
+        """
+        :return: dictionary keyed as the MassFits "self" entries
+        """
+        return fitAccumulators([self], weighted)[0]
+
+    def fitColumns(self, columns, weighted=True):
+        """
+        Fits a reduced model on a subset of the design matrix columns from the same sufficient statistics
+        :param columns: list of design matrix column indices, e.g. [0, 1] for 1/P vs. 1/A
+        :param weighted: bool True for WLS with W, False for OLS
+        :return: dictionary keyed as the MassFits "self" entries (parameter keys follow the column order)
+        """
+        index = list(columns) + [self.nParams]
+        gramW = self.gramW[np.ix_(index, index)][None]
+        if weighted:
+            results = fitGrams(gramW, [self.nObs])
+        else:
+            results = fitGrams(self.gram1[np.ix_(index, index)][None], [self.nObs], gramW)
+        return resultsToFits(results, 0)
+
+
+def lineSums(x, y, groups, nGroups):
+    """
+    Sufficient statistics of straight-line fits of y vs. x within each group, in one pass over the data.
+    Non-finite observations are ignored.
+    :param x: (n,) abscissa
+    :param y: (n,) ordinate
+    :param groups: (n,) int group index of each observation
+    :param nGroups: int number of groups
+    :return: (nGroups, 5) array of [n, sum x, sum x^2, sum y, sum xy]; rows of sums may be added to pool groups
+    """
+    valid = np.isfinite(x) & np.isfinite(y)
+    x = x[valid]
+    y = y[valid]
+    groups = groups[valid]
+    terms = [np.ones_like(x), x, x * x, y, x * y]
+    return np.stack([np.bincount(groups, weights=term, minlength=nGroups) for term in terms], axis=-1)
+
+
+def lineFromSums(sums):
+    """
+    Closed-form ordinary least squares straight lines from lineSums
+    :param sums: (..., 5) array of [n, sum x, sum x^2, sum y, sum xy]
+    :return: intercepts (...), slopes (...); NaN where a group has fewer than two distinct x values
+    """
+    n, sx, sxx, sy, sxy = np.moveaxis(np.asarray(sums, dtype=float), -1, 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        den = n * sxx - sx ** 2
+        slope = np.where(den > 0, (n * sxy - sx * sy) / den, np.nan)
+        intercept = (sy - slope * sx) / n
+    return intercept[()], slope[()]
+
+
+def resultsToFits(results, i):
+    """
+    Converts row i of stacked results into a dictionary keyed as the MassFits "self" entries
+    """
+    fits = {}
+    for j, key in enumerate(PARAMETER_KEYS[:results['params'].shape[-1]]):
+        fits[key] = results['params'][i, j]
+        fits['se_' + key] = results['bse'][i, j]
+    fits['rSqr'] = results['rSqr'][i]
+    fits['redChi2'] = results['redChi2'][i]
+    fits['nObs'] = int(results['nObs'][i])
+    return fits
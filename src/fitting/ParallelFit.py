@@ -0,0 +1,143 @@
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+# Project imports
+from src.fitting import LinearEngine, RobustEngine
+
+"""
+PARALLEL ISOTOPE REGRESSION
+The filtered pulse, analog and time arrays of every isotope are copied once into a single shared memory block.
+Worker processes attach to the block by name and build their own design matrices, so only a few integers and
+strings are pickled per task.  If shared memory is not available the arrays are pickled to the workers instead.
+"""
+
+MIN_OBSERVATIONS = 50
+
+
+class SharedBlock:
+    """
+    Stack of 1-D float arrays packed end to end in one shared memory block
+    """
+    def __init__(self, arrays):
+        lengths = [len(a) for a in arrays]
+        self.offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(int)
+        nBytes = max(int(self.offsets[-1]) * 8, 8)
+        self.shm = shared_memory.SharedMemory(create=True, size=nBytes)
+        buffer = np.ndarray((int(self.offsets[-1]),), dtype=np.float64, buffer=self.shm.buf)
+        for a, start in zip(arrays, self.offsets[:-1]):
+            buffer[start:start + len(a)] = a
+        self.name = self.shm.name
+
+    def spec(self, i):
+        """
+        :return: picklable (name, start, stop) of the i-th array
+        """
+        return self.name, int(self.offsets[i]), int(self.offsets[i + 1])
+
+    def release(self):
+        self.shm.close()
+        self.shm.unlink()
+
+
+def attachArrays(specs):
+    """
+    Copies arrays out of shared memory blocks
+    :param specs: list of (name, start, stop) or ndarrays (pickled fallback)
+    :return: list of ndarrays
+    """
+    arrays = []
+    for spec in specs:
+        if isinstance(spec, np.ndarray):
+            arrays.append(spec)
+            continue
+        name, start, stop = spec
+        shm = shared_memory.SharedMemory(name=name)
+        try:
+            view = np.ndarray((stop,), dtype=np.float64, buffer=shm.buf)
+            arrays.append(np.array(view[start:stop]))
+            del view
+        finally:
+            shm.close()
+    return arrays
+
+
+def regressWorker(specs, model, regType, normType, startParams=None):
+    """
+    Worker process entry point.
+    :param specs: (pulse, analog, time) shared memory specs or arrays
+    :param model: dictionary with deadTime, dwell and startTime of the isotope
+    :param regType: string "Weighted", "Ordinary" or "Robust"
+    :param normType: string M-estimator for robust fits
+    :param startParams: [tau, a1, a2] warm start of robust fits, None for the WLS solution
+    :return: dictionary keyed as the MassFits "self" entries
+    """
+    pulse, analog, time = attachArrays(specs)
+    y, X, W = LinearEngine.designArrays(pulse, analog, time, model['deadTime'], model['dwell'],
+                                        model['startTime'])
+    if regType == "Robust":
+        return RobustEngine.robustRegress(y, X, W, normType, startParams)
+    return LinearEngine.regress(y, X, W, "Weighted" in regType)
+
+
+class ParallelRegressor:
+    def __init__(self, workers=None):
+        """
+        :param workers: int number of worker processes, None for one per core
+        """
+        self.workers = workers or os.cpu_count() or 1
+
+    def regress(self, session, refit=False):
+        """
+        Fits all isotopes of a filtered session across a process pool and loads the results into each MassFits.
+        Isotopes with a cached regression of the same settings are reloaded instead of refit.
+        :param session: Session with filtered masses
+        :param refit: bool if True, ignore cached regressions
+        :return: {massName: selfFits}
+        """
+        # Session imports this module, so its records are imported at call time
+        from src.records.Session import MassFits
+        regType = session.isotopeFit["algorithm"]
+        normType = session.isotopeFit["norm"]
+        fitted = {}
+        for massName, massRecord in session.masses.items():
+            if massRecord.fits is None:
+                massRecord.fits = MassFits()
+            if not refit and massRecord.restoreFits():
+                continue
+            if massRecord.nIn > MIN_OBSERVATIONS:
+                fitted[massName] = massRecord
+            else:
+                massRecord.cacheFits(None)
+        if len(fitted) == 0:
+            return {}
+
+        arrays = []
+        for massRecord in fitted.values():
+            arrays += [massRecord.filteredPulse, massRecord.filteredAnalog, massRecord.filteredTime]
+        try:
+            block = SharedBlock(arrays)
+            specs = [block.spec(i) for i in range(len(arrays))]
+        except (OSError, ValueError):
+            block = None
+            specs = arrays
+
+        results = {}
+        try:
+            with ProcessPoolExecutor(max_workers=min(self.workers, max(len(fitted), 1))) as pool:
+                futures = {}
+                for i, (massName, massRecord) in enumerate(fitted.items()):
+                    model = {'deadTime': session.machineDeadTime, 'dwell': massRecord.totalDwell,
+                             'startTime': session.startTime}
+                    futures[massName] = pool.submit(regressWorker, specs[3 * i:3 * i + 3], model, regType, normType,
+                                                    massRecord.warmStart())
+                for massName, future in futures.items():
+                    results[massName] = future.result()
+        finally:
+            if block is not None:
+                block.release()
+
+        for massName, selfFits in results.items():
+            fitted[massName].cacheFits(selfFits)
+        return results
@@ -0,0 +1,169 @@
+import os
+import itertools
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+# Project imports
+from src.fitting import LinearEngine, RobustEngine
+from src.fitting.ParallelFit import SharedBlock, attachArrays, MIN_OBSERVATIONS
+
+"""
+FILTER SETTING SWEEP
+Evaluates a grid of isotope filter settings (pMax, pMin, aMin, outlier) x regression algorithms without touching
+the session's filtered data.  The raw observations of each isotope are flattened and sorted by pulse rate once and
+shared with the worker processes; the pulse window of every grid point is then a contiguous slice found by binary
+search.  Weighted and ordinary fits of a grid point come from one set of sufficient statistics.  The filter follows
+Mass.filter so a grid point reproduces the results of filtering and fitting with those settings in the UI.
+"""
+
+FILTER_KEYS = ['pMax', 'pMin', 'aMin', 'outlier']
+RESULT_KEYS = ['tau', 'se_tau', 'a1', 'se_a1', 'a2', 'se_a2', 'rSqr', 'redChi2', 'ACF', 'Drift']
+
+
+def sortedRawData(session, massRecord):
+    """
+    Flattened raw observations of an isotope sorted by pulse rate
+    :return: pulse, analog, time arrays
+    """
+    chs = massRecord.channels
+    offsets = np.arange(0, chs) * (massRecord.chDwell + session.chSettle) + massRecord.timeOffset
+    t = (np.tile(session.scanTime, (chs, 1)).T + offsets).flatten()
+    p = massRecord.pulse.flatten()
+    a = massRecord.analog.flatten()
+    idx = np.argsort(p, kind='stable')
+    return p[idx], a[idx], t[idx]
+
+
+def filterSorted(pulse, analog, time, pMax, pMin, outlier):
+    """
+    Mass.filter applied to pulse-sorted observations
+    :return: filtered pulse, analog, time and the number of observations in the pulse window (nQual)
+    """
+    lo = np.searchsorted(pulse, pMin, side='right')
+    hi = np.searchsorted(pulse, pMax, side='left')
+    p = pulse[lo:hi]
+    a = analog[lo:hi].copy()
+    t = time[lo:hi]
+    nQual = len(p)
+    a[a == 0] = np.nan
+    if outlier > 0:
+        acf = p / a
+        med = np.nanmedian(acf)
+        Q3 = np.nanpercentile(acf, 75, interpolation='midpoint')  # Upper quartile
+        Q1 = np.nanpercentile(acf, 25, interpolation='midpoint')  # Lower quartile
+        iqr = Q3 - Q1
+        mask = []
+        if iqr > 0:
+            mask = np.where(np.abs((acf - med) / iqr) <= outlier)
+        p = p[mask]
+        a = a[mask]
+        t = t[mask]
+    return p, a, t, nQual
+
+
+def sweepWorker(specs, model, points, algorithms):
+    """
+    Worker process entry point: every grid point and algorithm of one isotope
+    :param specs: (pulse, analog, time) pulse-sorted shared memory specs or arrays
+    :param model: dictionary with deadTime, dwell, startTime, delTime and acfMean of the isotope
+    :param points: list of dictionaries of filter settings
+    :param algorithms: list of (algorithm, norm) tuples
+    :return: list of result rows
+    """
+    pulse, analog, time = attachArrays(specs)
+    rows = []
+    for point in points:
+        pMin = point['pMin']
+        if pMin == 0:
+            pMin = point['aMin'] * model['acfMean']
+        p, a, t, nQual = filterSorted(pulse, analog, time, point['pMax'], pMin, point['outlier'])
+        fitted = len(p) > MIN_OBSERVATIONS
+        if fitted:
+            y, X, W = LinearEngine.designArrays(p, a, t, model['deadTime'], model['dwell'], model['startTime'])
+            stats = LinearEngine.RegressionAccumulator()
+            stats.updateDesign(y, X, W)
+        for algorithm, norm in algorithms:
+            row = dict(point, algorithm=algorithm, norm=norm, nQual=nQual, nIn=len(p))
+            selfFits = None
+            if fitted and algorithm == "Robust":
+                selfFits = RobustEngine.robustRegress(y, X, W, norm)
+            elif fitted:
+                selfFits = stats.fit("Weighted" in algorithm)
+            if selfFits is None:
+                row.update({key: np.nan for key in RESULT_KEYS})
+            else:
+                row.update({key: selfFits[key] for key in RESULT_KEYS[:8]})
+                row['ACF'] = 1 / selfFits['a1']
+                row['Drift'] = selfFits['a1'] / (selfFits['a1'] + selfFits['a2'] * model['delTime']) - 1
+            rows.append(row)
+    return rows
+
+
+def gridPoints(grid, defaults):
+    """
+    :param grid: dictionary of filter setting lists, e.g. {'pMax': [4E+6, 5E+6], 'outlier': [3, 4, 10]}
+    :param defaults: dictionary of settings used for keys missing from the grid (session.isotopeFit)
+    :return: list of dictionaries, one per combination of settings
+    """
+    values = [list(np.atleast_1d(grid.get(key, defaults[key]))) for key in FILTER_KEYS]
+    return [dict(zip(FILTER_KEYS, combination)) for combination in itertools.product(*values)]
+
+
+class ParameterSweep:
+    def __init__(self, workers=None):
+        """
+        :param workers: int number of worker processes, None for one per core
+        """
+        self.workers = workers or os.cpu_count() or 1
+
+    def sweep(self, session, grid, algorithms=("Weighted",)):
+        """
+        Filters and fits every isotope for every combination of filter settings and algorithms
+        :param session: imported Session
+        :param grid: dictionary of filter setting lists (see gridPoints)
+        :param algorithms: iterable of "Weighted", "Ordinary" or ("Robust", norm)
+        :return: list of rows (dictionaries) with mass, filter settings, algorithm, norm, nQual, nIn and fit results
+        """
+        points = gridPoints(grid, session.isotopeFit)
+        algorithms = [(a, None) if isinstance(a, str) else tuple(a) for a in algorithms]
+        delTime = np.max(session.scanTime) - np.min(session.scanTime)
+        arrays = []
+        tasks = []
+        for massRecord in session.masses.values():
+            arrays += list(sortedRawData(session, massRecord))
+            model = {'deadTime': session.machineDeadTime, 'dwell': massRecord.totalDwell,
+                     'startTime': session.startTime, 'delTime': delTime, 'acfMean': np.nanmean(massRecord.ACF)}
+            tasks.append((model, points, algorithms))
+
+        results = []
+        if self.workers > 1 and len(tasks) > 1:
+            try:
+                block = SharedBlock(arrays)
+                specs = [block.spec(i) for i in range(len(arrays))]
+            except (OSError, ValueError):
+                block = None
+                specs = arrays
+            try:
+                with ProcessPoolExecutor(max_workers=min(self.workers, len(tasks))) as pool:
+                    futures = [pool.submit(sweepWorker, specs[3 * i:3 * i + 3], *args) for i, args in enumerate(tasks)]
+                    results = [future.result() for future in futures]
+            finally:
+                if block is not None:
+                    block.release()
+        else:
+            results = [sweepWorker(arrays[3 * i:3 * i + 3], *args) for i, args in enumerate(tasks)]
+
+        table = []
+        for massName, rows in zip(session.masses, results):
+            for row in rows:
+                table.append(dict(mass=massName, **row))
+        return table
+
+
+def toDataFrame(table):
+    """
+    :param table: list of rows returned by ParameterSweep.sweep
+    :return: pandas DataFrame, one row per isotope x grid point x algorithm
+    """
+    import pandas as pd
+    return pd.DataFrame(table)
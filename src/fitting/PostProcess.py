@@ -0,0 +1,114 @@
+import warnings
+import numpy as np
+
+"""
+BATCHED TIME SERIES POST-PROCESSING
+Applies the selected ACF and dead-time models to the raw channels of every isotope and averages them into
+modeledTimeSeries (and modeledTimeSeriesError when uncertainties are included).  The relative scan time is computed
+once for the session and the scans are processed in chunks, so only (chunk x channels) temporaries are alive at a
+time while the per-isotope outputs are preallocated for the whole session:
+
+    acf      = 1/(a1 + a2*t)                               (alphaSource 'Self' or 'Internal', else Mass.ACF)
+    dA       = A * acf^2 * sqrt(se_a1^2 + (t*se_a2)^2)
+    P        = Pu/(1 - Pu*tau),  Pu = P_raw/(1 + P_raw*machineDeadTime)    (tauSource 'Self' or 'Internal')
+    dP       = sqrt(P_raw/chDwell + (P_raw^2 * se_tau)^2) / (1 - P_raw*tau)
+
+Pulse observations below the cross-over (pCross) are reported as pulse counts, all others as ACF-scaled analog.
+"""
+
+CHUNK_SCANS = 50000  # scans modeled at once
+
+
+def modelSources(massRecord):
+    """
+    :return: (a1, a2, se_a1, se_a2) or None, (tau, se_tau) or None from Mass.postProcessPars
+    """
+    pars = massRecord.postProcessPars
+    alpha = None
+    if pars.get('alphaSource') in ['Self', 'Internal']:
+        alpha = (pars['a1'], pars['a2'], pars['sea1'], pars['sea2'])
+    deadTime = None
+    if pars.get('tauSource') in ['Self', 'Internal']:
+        deadTime = (pars['tau'], pars['setau'])
+    return alpha, deadTime
+
+
+def modelArrays(pulse, analog, acf, t, alpha, deadTime, chDwell, session):
+    """
+    Modeled (and uncertainty) time series of a block of scans
+    :param pulse: (c, channels) reported pulse rates
+    :param analog: (c, channels) analog readings
+    :param acf: (c,) stored per-scan ACF, used when alpha is None
+    :param t: (c,) scan times relative to the first scan of the session
+    :param alpha: (a1, a2, se_a1, se_a2) or None to use the stored per-scan ACF
+    :param deadTime: (tau, se_tau) or None to use the reported pulse rates
+    :param chDwell: float dwell time of one channel (s)
+    :param session: Session with pCross, inclUnc and machineDeadTime
+    :return: (c,) modeled time series, (c,) modeled time series error or None
+    """
+    inclUnc = session.inclUnc and alpha is not None and deadTime is not None
+    if alpha is not None:
+        a1, a2, se_a1, se_a2 = alpha
+        acf = 1 / (a1 + a2 * t)
+    modelAnalog = analog * acf[:, None]
+    if deadTime is not None:
+        tau, se_tau = deadTime
+        pUncorr = pulse / (1 + pulse * session.machineDeadTime)
+        modelPulse = pUncorr / (1 - pUncorr * tau)
+    else:
+        modelPulse = pulse
+    usePulse = session.pCross > modelPulse
+    series = np.nanmean(np.where(usePulse, modelPulse, modelAnalog), axis=1)
+    if not inclUnc:
+        return series, None
+    dA = modelAnalog * (acf * np.sqrt(se_a1 ** 2 + (t * se_a2) ** 2))[:, None]
+    dP = np.sqrt(pulse / chDwell + (pulse ** 2 * se_tau) ** 2) / (1 - pulse * tau)
+    return series, np.nanmean(np.where(usePulse, dP, dA), axis=1)
+
+
+def reportedArrays(pulse, analog, faraday, acf, fcf, session):
+    """
+    Reported (unmodeled) time series of a block of scans, as calculated at import
+    :param pulse: (c, channels) reported pulse rates
+    :param analog: (c, channels) analog readings
+    :param faraday: (c, channels) Faraday readings
+    :param acf: (c,) stored per-scan ACF
+    :param fcf: (c,) stored per-scan Faraday conversion factor
+    :param session: Session with pCross and ignoreFaraday
+    :return: (c,) time series
+    """
+    analogCounts = (analog.T * acf).T
+    # Pulse NaNs or values above the cross-over are replaced with the ACF-scaled analog value
+    reported = np.where(session.pCross > pulse, pulse, analogCounts)
+    if not session.ignoreFaraday:
+        reported = np.where(np.isnan(reported), (faraday.T * fcf).T, reported)
+    return np.nanmean(reported, axis=1)
+
+
+def postProcessMasses(session, massRecords, chunkSize=CHUNK_SCANS):
+    """
+    Fills modeledTimeSeries (and modeledTimeSeriesError) of every isotope in one pass over the scans
+    :param session: Session
+    :param massRecords: iterable of Mass with postProcessPars set
+    :param chunkSize: int number of scans modeled at once
+    """
+    t = session.scanTime - np.amin(session.scanTime)
+    nScans = len(t)
+    tasks = []
+    for massRecord in massRecords:
+        alpha, deadTime = modelSources(massRecord)
+        massRecord.modeledTimeSeries = np.empty(nScans)
+        withError = session.inclUnc and alpha is not None and deadTime is not None
+        massRecord.modeledTimeSeriesError = np.empty(nScans) if withError else None
+        tasks.append((massRecord, alpha, deadTime))
+    with np.errstate(divide='ignore', invalid='ignore'), warnings.catch_warnings():
+        # All-NaN scans (no pulse or analog reading) average to NaN, as np.nanmean reports them
+        warnings.simplefilter('ignore', RuntimeWarning)
+        for start in range(0, nScans, chunkSize):
+            rows = slice(start, min(start + chunkSize, nScans))
+            for massRecord, alpha, deadTime in tasks:
+                series, error = modelArrays(massRecord.pulse[rows], massRecord.analog[rows], massRecord.ACF[rows],
+                                            t[rows], alpha, deadTime, massRecord.chDwell, session)
+                massRecord.modeledTimeSeries[rows] = series
+                if error is not None:
+                    massRecord.modeledTimeSeriesError[rows] = error
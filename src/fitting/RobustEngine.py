@@ -0,0 +1,292 @@
+import numpy as np
+
+# Project imports
+from src.fitting import LinearEngine
+
+"""
+ROBUST REGRESSION ENGINE
+Iteratively reweighted least squares (IRLS) for the 3-parameter isotope model.  The design matrix is built once and
+only the observation weights change between iterations, so every iteration is one weighted Gram product and a 3x3
+solve.  The iteration follows statsmodels RLM.fit (MAD scale, deviance convergence, H1 covariance) so results match
+sm.RLM within the convergence tolerance.  Norm tuning constants are the statsmodels defaults.
+"""
+
+MAD_NORMALIZATION = 0.6744897501960817  # scipy.stats.norm.ppf(3/4.)
+
+
+class LeastSquares:
+    def rho(self, z):
+        return 0.5 * z ** 2
+
+    def psi(self, z):
+        return z
+
+    def weights(self, z):
+        return np.ones_like(z)
+
+    def psiDeriv(self, z):
+        return np.ones_like(z)
+
+
+class HuberT:
+    def __init__(self, t=1.345):
+        self.t = t
+
+    def rho(self, z):
+        absz = np.abs(z)
+        return np.where(absz <= self.t, 0.5 * z ** 2, absz * self.t - 0.5 * self.t ** 2)
+
+    def psi(self, z):
+        return np.where(np.abs(z) <= self.t, z, self.t * np.sign(z))
+
+    def weights(self, z):
+        absz = np.abs(z)
+        return np.where(absz <= self.t, 1.0, self.t / np.where(absz <= self.t, 1.0, absz))
+
+    def psiDeriv(self, z):
+        return (np.abs(z) <= self.t).astype(float)
+
+
+class Hampel:
+    def __init__(self, a=2., b=4., c=8.):
+        self.a = a
+        self.b = b
+        self.c = c
+
+    def _subset(self, absz):
+        t1 = absz <= self.a
+        t2 = (absz <= self.b) & (absz > self.a)
+        t3 = (absz <= self.c) & (absz > self.b)
+        return t1, t2, t3
+
+    def rho(self, z):
+        a, b, c = self.a, self.b, self.c
+        absz = np.abs(z)
+        t1, t2, t3 = self._subset(absz)
+        v = np.where(t1, absz ** 2 * 0.5, 0.0)
+        v = np.where(t2, a * absz - a ** 2 * 0.5, v)
+        v = np.where(t3, a * (c - absz) ** 2 / (c - b) * (-0.5), v)
+        return v + np.where(t1 | t2, 0.0, a * (b + c - a) * 0.5)
+
+    def psi(self, z):
+        a, b, c = self.a, self.b, self.c
+        absz = np.abs(z)
+        t1, t2, t3 = self._subset(absz)
+        v = np.where(t1, z, 0.0)
+        v = np.where(t2, a * np.sign(z), v)
+        return np.where(t3, a * np.sign(z) * (c - absz) / (c - b), v)
+
+    def weights(self, z):
+        a, b, c = self.a, self.b, self.c
+        absz = np.abs(z)
+        t1, t2, t3 = self._subset(absz)
+        safe = np.where(t1, 1.0, absz)
+        v = np.where(t1, 1.0, 0.0)
+        v = np.where(t2, a / safe, v)
+        return np.where(t3, a * (c - absz) / (safe * (c - b)), v)
+
+    def psiDeriv(self, z):
+        t1, t2, t3 = self._subset(np.abs(z))
+        return np.where(t1, 1.0, np.where(t3, -self.a / (self.c - self.b), 0.0))
+
+
+class AndrewWave:
+    def __init__(self, a=1.339):
+        self.a = a
+
+    def _subset(self, z):
+        return np.abs(z) <= self.a * np.pi
+
+    def rho(self, z):
+        a = self.a
+        return np.where(self._subset(z), a ** 2 * (1 - np.cos(z / a)), a ** 2 * 2)
+
+    def psi(self, z):
+        return np.where(self._subset(z), self.a * np.sin(z / self.a), 0.0)
+
+    def weights(self, z):
+        ratio = z / self.a
+        small = np.abs(ratio) < np.finfo(np.double).eps
+        safe = np.where(small, 1.0, ratio)
+        return np.where(small, 1.0, self._subset(z) * np.sin(safe) / safe)
+
+    def psiDeriv(self, z):
+        return self._subset(z) * np.cos(z / self.a)
+
+
+class RamsayE:
+    def __init__(self, a=.3):
+        self.a = a
+
+    def rho(self, z):
+        absz = np.abs(z)
+        return (1 - np.exp(-self.a * absz) * (1 + self.a * absz)) / self.a ** 2
+
+    def psi(self, z):
+        return z * np.exp(-self.a * np.abs(z))
+
+    def weights(self, z):
+        return np.exp(-self.a * np.abs(z))
+
+    def psiDeriv(self, z):
+        x = np.exp(-self.a * np.abs(z))
+        return x - z * self.a * x * np.sign(z)
+
+
+class TrimmedMean:
+    def __init__(self, c=2.):
+        self.c = c
+
+    def rho(self, z):
+        return np.where(np.abs(z) <= self.c, z ** 2 * 0.5, self.c ** 2 * 0.5)
+
+    def psi(self, z):
+        return np.where(np.abs(z) <= self.c, z, 0.0)
+
+    def weights(self, z):
+        return (np.abs(z) <= self.c).astype(float)
+
+    def psiDeriv(self, z):
+        return (np.abs(z) <= self.c).astype(float)
+
+
+class TukeyBiweight:
+    def __init__(self, c=4.685):
+        self.c = c
+
+    def rho(self, z):
+        subset = np.abs(z) <= self.c
+        factor = self.c ** 2 / 6.
+        return -(1 - (z / self.c) ** 2) ** 3 * subset * factor + factor
+
+    def psi(self, z):
+        return z * (1 - (z / self.c) ** 2) ** 2 * (np.abs(z) <= self.c)
+
+    def weights(self, z):
+        return (1 - (z / self.c) ** 2) ** 2 * (np.abs(z) <= self.c)
+
+    def psiDeriv(self, z):
+        u = (z / self.c) ** 2
+        return (np.abs(z) <= self.c) * ((1 - u) ** 2 - 4 * u * (1 - u))
+
+
+NORMS = {"HuberT": HuberT, "Hampel": Hampel, "LeastSquares": LeastSquares, "AndrewWave": AndrewWave,
+         "RamsayE": RamsayE, "TrimmedMean": TrimmedMean, "TukeyBiweight": TukeyBiweight}
+
+
+def getNorm(normType: str):
+    """
+    :param normType: string M-estimator name as shown in the UI (spaces are ignored)
+    :return: norm instance, TukeyBiweight if unknown, "Whitened" or the abstract "Robust Norm"
+    """
+    norm = normType.replace(" ", "") if normType is not None else ''
+    return NORMS.get(norm, TukeyBiweight)()
+
+
+def mad(resid):
+    """
+    Median absolute deviation about zero, normalized to the Gaussian standard deviation
+    """
+    return np.median(np.abs(resid)) / MAD_NORMALIZATION
+
+
+def irls(y, X, norm, startParams=None, maxiter=50, tol=1e-8):
+    """
+    M-estimation by iteratively reweighted least squares
+    :param y: (n,) response
+    :param X: (n, p) design matrix, shared by every iteration
+    :param norm: norm instance with rho, psi, weights and psiDeriv methods
+    :param startParams: (p,) warm start, e.g. the WLS solution or a previous fit; None starts from OLS
+    :param maxiter: int maximum number of iterations
+    :param tol: float early-stopping tolerance on the change of the deviance
+    :return: dictionary with params, bse, cov, scale, weights, iterations and resid
+    """
+    n, p = X.shape
+    gram1 = LinearEngine.augmentedGram(X, y)
+    if startParams is None:
+        params = LinearEngine.solveGram(gram1)[0]
+    else:
+        params = np.asarray(startParams, dtype=float)
+    resid = y - X @ params
+    scale = mad(resid)
+    deviance = norm.rho(resid / (np.dot(resid, resid) / (n - p))).sum()
+    weights = np.ones(n)
+    iteration = 1
+    converged = False
+    while not converged:
+        if scale == 0.0:
+            break
+        weights = norm.weights(resid / scale)
+        params = LinearEngine.solveGram(LinearEngine.augmentedGram(X, y, weights))[0]
+        resid = y - X @ params
+        wlsScale = np.dot(weights * resid, resid) / (n - p)
+        scale = mad(resid)
+        previous = deviance
+        deviance = norm.rho(resid / wlsScale).sum()
+        iteration += 1
+        converged = not (np.abs(deviance - previous) > tol and iteration < maxiter)
+
+    # Huber's H1 covariance (statsmodels RLM default)
+    sresid = resid / scale if scale != 0 else resid
+    psiDeriv = norm.psiDeriv(sresid)
+    m = np.mean(psiDeriv)
+    k = 1 + p / n * np.var(psiDeriv) / m ** 2
+    ssPsi = np.sum(norm.psi(sresid) ** 2)
+    normCov = LinearEngine.solveGram(gram1)[1]
+    cov = k ** 2 * (ssPsi / (n - p) * scale ** 2) / (np.mean(psiDeriv) ** 2) * normCov
+    return {'params': params, 'bse': np.sqrt(np.diag(cov)), 'cov': cov, 'scale': scale, 'weights': weights,
+            'iterations': iteration, 'resid': resid}
+
+
+def whiten(y, X, W):
+    """
+    Scales rows by the normalized square root of the physical weights ("Whitened" robust option)
+    """
+    w = len(W) * np.sqrt(W) / np.sum(np.sqrt(W))
+    return w * y, (w * X.T).T
+
+
+def robustRSquared(y, resid, weights):
+    """
+    Pseudo r-squared of an M-estimate: the weighted r-squared under the final IRLS weights, so down-weighted
+    outliers count as little in the total as in the residual sum of squares
+    :param y: (n,) response of the fit
+    :param resid: (n,) residuals of the fit
+    :param weights: (n,) final IRLS weights
+    :return: float r-squared, NaN if every observation was rejected
+    """
+    if np.sum(weights) <= 0:
+        return np.nan
+    centeredTSS = np.sum(weights * (y - np.average(y, weights=weights)) ** 2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return float(1 - np.sum(weights * resid ** 2) / centeredTSS)
+
+
+def robustRegress(y, X, W, normType: str, startParams=None, maxiter=50, tol=1e-8):
+    """
+    Robust linear regression of 1/P vs. 1/A & t/A
+    :param y: response (1/P)
+    :param X: design matrix [1, 1/A, t/A]
+    :param W: physical weights (dwell * P^3), used for whitening and reduced chi-square
+    :param normType: string M-estimator type, https://www.statsmodels.org/stable/rlm.html
+    :param startParams: [tau, a1, a2] warm start; None starts from the WLS solution
+    :param maxiter: int maximum number of IRLS iterations
+    :param tol: float early-stopping tolerance on the change of the deviance
+    :return: dictionary keyed as the MassFits "self" entries
+    """
+    if startParams is None:
+        startParams = LinearEngine.solveGram(LinearEngine.augmentedGram(X, y, W))[0]
+    if normType is not None and normType.replace(" ", "") == "Whitened":
+        y, X = whiten(y, X, W)
+    results = irls(y, X, getNorm(normType), startParams, maxiter, tol)
+    res = results['resid']
+    selfFits = {}
+    for key, param, err in zip(LinearEngine.PARAMETER_KEYS, results['params'], results['bse']):
+        selfFits[key] = param
+        selfFits['se_' + key] = err
+    # Calculate Reduced Chi-Square (aka MSWD)
+    # https://en.wikipedia.org/wiki/Reduced_chi-squared_statistic
+    selfFits['redChi2'] = np.sum(W * res ** 2) / (len(res) - 3)
+    selfFits['rSqr'] = robustRSquared(y, res, results['weights'])
+    selfFits['iterations'] = results['iterations']
+    return selfFits
@@ -0,0 +1,305 @@
+import numpy as np
+from collections import OrderedDict
+
+# Project imports
+from src.fitting import RobustEngine
+
+"""
+SPECTRUM FIT ENGINE
+Polynomial fits of the isotope regression parameters (a1, a2, tau) against mass.  The Vandermonde design matrices
+of the isotope masses are built once per polynomial order and reused by every refit, so a mask toggle or a model
+design edit is a weighted least squares solve on a handful of rows.  Parameters, covariance and the mean prediction intervals at
+every isotope are computed together in one pass.  Results follow statsmodels WLS get_prediction().summary_frame();
+robust (HuberT) fits use the IRLS engine with normal intervals as in statsmodels RLM.
+Beyond the polynomials, the model design offers a weighted cubic smoothing spline, its smoothing parameter chosen
+by generalized cross-validation from one eigendecomposition, and a monotone piecewise-linear fit on fixed knots
+(sign-constrained slopes by non-negative least squares).  Both are linear smoothers y_hat = S y, which gives their
+intervals.
+Results are kept in a least-recently-used cache keyed by parameter, mask bitset and model design, so toggling
+isotopes back to a previous configuration does not refit.  scipy is imported on first use, keeping the import of the
+fit engines light.
+"""
+
+CACHE_SIZE = 256
+CUBIC_SPLINE = 4  # FitTypes index of the smoothing spline; indices 0-3 are polynomial orders
+PIECEWISE_LINEAR = 5  # FitTypes index of the monotone piecewise-linear model
+MODEL_TYPES = ['Mean', 'Linear', '2nd Order', '3rd Order', 'Cubic Spline', 'Piecewise Linear']  # FitTypes items
+GCV_GRID = np.logspace(-8, 8, 321)  # smoothing parameters relative to the scale of the penalty eigenvalues
+
+
+def splinePenalty(x):
+    """
+    Roughness penalty K = Q R^-1 Q' of the natural cubic spline with knots x (Green & Silverman, 1994)
+    :param x: (n,) strictly increasing knots, n >= 3
+    :return: (n, n) penalty matrix, integral of f''^2 = f' K f
+    """
+    n = len(x)
+    h = np.diff(x)
+    Q = np.zeros((n, n - 2))
+    R = np.zeros((n - 2, n - 2))
+    j = np.arange(n - 2)
+    Q[j, j] = 1 / h[:-1]
+    Q[j + 1, j] = -1 / h[:-1] - 1 / h[1:]
+    Q[j + 2, j] = 1 / h[1:]
+    R[j, j] = (h[:-1] + h[1:]) / 3
+    R[j[:-1], j[:-1] + 1] = h[1:-1] / 6
+    R[j[:-1] + 1, j[:-1]] = h[1:-1] / 6
+    return Q @ np.linalg.solve(R, Q.T)
+
+
+def smoothingSpline(x, y, w, lams=None):
+    """
+    Weighted cubic smoothing spline minimizing sum w (y - f)^2 + lam * integral f''^2, with lam chosen by GCV.
+    With K~ = W^-1/2 K W^-1/2 = U diag(d) U', the smoother is S = W^-1/2 U diag(1/(1 + lam d)) U' W^1/2, so the
+    GCV score of every candidate lam costs O(n).
+    :param x: (n,) strictly increasing knots, n >= 3
+    :param y: (n,) values
+    :param w: (n,) weights
+    :param lams: candidate smoothing parameters, None for GCV_GRID scaled to the penalty
+    :return: smoother matrix S (n, n), chosen lam, effective degrees of freedom tr(S)
+    """
+    n = len(x)
+    sw = np.sqrt(w)
+    d, U = np.linalg.eigh(splinePenalty(x) / np.outer(sw, sw))
+    d = np.maximum(d, 0)
+    z = U.T @ (sw * y)
+    if lams is None:
+        lams = GCV_GRID / np.mean(d[d > 0])
+    shrink = 1 / (1 + np.outer(lams, d))
+    rss = np.sum(((1 - shrink) * z) ** 2, axis=1)
+    edf = np.sum(shrink, axis=1)
+    gcv = n * rss / (n - edf) ** 2
+    best = int(np.nanargmin(gcv))
+    S = (U * shrink[best]) @ U.T / sw[:, None] * sw[None, :]
+    return S, lams[best], edf[best]
+
+
+def splineBasis(knots, x):
+    """
+    Evaluation matrix B of the natural cubic interpolant: f(x) = B f(knots).  Linear beyond the end knots.
+    """
+    from scipy.interpolate import CubicSpline
+    spline = CubicSpline(knots, np.eye(len(knots)), bc_type='natural')
+    B = spline(np.clip(x, knots[0], knots[-1]))
+    slope = spline(knots[[0, -1]], 1)
+    below = x < knots[0]
+    above = x > knots[-1]
+    B[below] += np.outer(x[below] - knots[0], slope[0])
+    B[above] += np.outer(x[above] - knots[-1], slope[1])
+    return B
+
+
+def monotoneBasis(knots, x):
+    """
+    Ramp basis of the piecewise-linear functions with the given knots: column j rises from 0 to the width of segment
+    j across it, so f(x) = b0 + sum c_j ramp_j(x) has slope c_j on segment j and is constant beyond the end knots
+    :param knots: (k+1,) increasing knots
+    :param x: (m,) evaluation points
+    :return: (m, k) basis
+    """
+    return np.clip(np.asarray(x, dtype=float)[:, None] - knots[None, :-1], 0, np.diff(knots)[None, :])
+
+
+def monotoneSmoother(x, y, w, xEval):
+    """
+    Monotone (increasing or decreasing, whichever fits better) weighted least squares piecewise-linear fit with
+    fixed knots at about sqrt(n) of the masses, the segment slopes constrained to one sign by non-negative least
+    squares.  For the chosen set of sloped segments the fit is the WLS projection onto them, a linear smoother with
+    edf = 1 + number of sloped segments < n.
+    :param x: (n,) increasing masses, at least 3 distinct
+    :param y: (n,) values
+    :param w: (n,) weights
+    :param xEval: (m,) masses at which the fit is evaluated
+    :return: smoother matrix S (n, n), evaluation matrix H (m, n) (f(xEval) = H y), edf tr(S)
+    """
+    from scipy.optimize import nnls
+    unique = np.unique(x)
+    nSegments = int(np.clip(np.round(np.sqrt(len(unique))), 1, len(unique) - 2))
+    knots = unique[np.round(np.linspace(0, len(unique) - 1, nSegments + 1)).astype(int)]
+    R = monotoneBasis(knots, x)
+    REval = monotoneBasis(knots, xEval)
+    sw = np.sqrt(w)
+    scale = np.linalg.norm(sw * y)
+    scale = scale if scale > 0 else 1
+    best = None
+    for sign in [1, -1]:
+        # The intercept is free: it enters as the difference of two non-negative columns
+        A = np.column_stack([sw, -sw, sign * R * sw[:, None]])
+        coefs = nnls(A, sw * y / scale)[0]
+        active = np.flatnonzero(coefs[2:] > 0)
+        X = np.column_stack([np.ones(len(x)), R[:, active]])
+        XEval = np.column_stack([np.ones(len(xEval)), REval[:, active]])
+        P = np.linalg.pinv(X * sw[:, None]) * sw[None, :]
+        S = X @ P
+        ssr = np.sum(w * (y - S @ y) ** 2)
+        if best is None or ssr < best[0]:
+            best = (ssr, S, XEval @ P)
+    return best[1], best[2], np.trace(best[1])
+
+
+class SpectrumFitEngine:
+    def __init__(self, cacheSize=CACHE_SIZE):
+        """
+        :param cacheSize: int maximum number of fits kept in the LRU cache
+        """
+        self.mass = None
+        self.vandermonde = {}
+        self.cache = OrderedDict()
+        self.cacheSize = cacheSize
+
+    def design(self, mass, order):
+        """
+        Cached Vandermonde matrix [1, M, M^2, ...] of the isotope masses
+        :param mass: (n,) isotope masses
+        :param order: int polynomial order (0 for the mean)
+        :return: (n, order+1) design matrix
+        """
+        mass = np.asarray(mass, dtype=float)
+        if self.mass is None or len(self.mass) != len(mass) or np.any(self.mass != mass):
+            self.mass = mass.copy()
+            self.vandermonde = {}
+            self.cache.clear()
+        if order not in self.vandermonde:
+            self.vandermonde[order] = np.vander(mass, order + 1, increasing=True)
+        return self.vandermonde[order]
+
+    def cachedFit(self, par, mass, y, yerr, mask, order, weighted=True, robust=False, alpha=0.05):
+        """
+        fit() through the LRU cache.  The key is (parameter, mask bitset, order, weighted, robust) plus alpha and the
+        bytes of the values and errors, so new isotope regressions never hit stale fits.
+        :param par: string parameter name ('a1', 'a2' or 'tau')
+        :return: dictionary returned by fit(); shared with the cache, do not modify
+        """
+        y = np.asarray(y, dtype=float)
+        yerr = np.asarray(yerr, dtype=float)
+        maskBits = sum(1 << i for i, use in enumerate(mask) if use)
+        self.design(mass, 0)
+        key = (par, maskBits, order, bool(weighted), bool(robust), alpha, y.tobytes(), yerr.tobytes())
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        result = self.fit(mass, y, yerr, mask, order, weighted, robust, alpha)
+        self.cache[key] = result
+        if len(self.cache) > self.cacheSize:
+            self.cache.popitem(last=False)
+        return result
+
+    def fit(self, mass, y, yerr, mask, order, weighted=True, robust=False, alpha=0.05):
+        """
+        Polynomial (or smoother) fit of one parameter against mass with predictions and confidence intervals at every mass
+        :param mass: (n,) isotope masses
+        :param y: (n,) parameter values
+        :param yerr: (n,) standard errors of the values
+        :param mask: (n,) bool True for isotopes used in the fit
+        :param order: int polynomial order, CUBIC_SPLINE or PIECEWISE_LINEAR
+        :param weighted: bool True to weight by 1/yerr^2
+        :param robust: bool True for a HuberT robust fit (unweighted)
+        :param alpha: float significance level of the confidence intervals
+        :return: dictionary with coefs, se_coefs, best (Y, seY), ci (l, u), rSqr, rChi2
+        """
+        from scipy import stats
+        if order in [CUBIC_SPLINE, PIECEWISE_LINEAR]:
+            return self.fitSmoother(mass, y, yerr, mask, order, weighted, alpha)
+        X = self.design(mass, order)
+        y = np.asarray(y, dtype=float)
+        yerr = np.asarray(yerr, dtype=float)
+        mask = np.asarray(mask, dtype=bool)
+        w = 1 / yerr ** 2 if weighted else np.ones_like(y)
+        valid = mask & np.isfinite(y) & np.isfinite(w)
+        if not np.any(valid):
+            return self.emptyFit(len(y), X.shape[1])
+        Xv, yv, wv = X[valid], y[valid], w[valid]
+        nParams = X.shape[1]
+        dfResid = np.sum(valid) - nParams
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if robust:
+                results = RobustEngine.irls(yv, Xv, RobustEngine.HuberT())
+                params = results['params']
+                cov = results['cov']
+                quantile = stats.norm.ppf(1 - alpha / 2)
+                rSqr = np.nan
+            else:
+                # Vandermonde columns span many decades: solve the whitened, column-scaled system by SVD rather
+                # than through the normal equations
+                sw = np.sqrt(wv)
+                Xw = Xv * sw[:, None]
+                d = np.linalg.norm(Xw, axis=0)
+                d = np.where(d > 0, d, 1)
+                pinvX = np.linalg.pinv(Xw / d) / d[:, None]
+                params = pinvX @ (sw * yv)
+                resid = yv - Xv @ params
+                ssr = np.sum(wv * resid ** 2)
+                cov = pinvX @ pinvX.T * ssr / dfResid
+                quantile = stats.t.ppf(1 - alpha / 2, dfResid)
+                # Weighted centered total sum of squares; the constant column is always present
+                rSqr = 1 - ssr / np.sum(wv * (yv - np.average(yv, weights=wv)) ** 2)
+            best = X @ params
+            seBest = np.sqrt(np.einsum('ij,jk,ik->i', X, cov, X))
+            # Reduced Chi^2
+            wrss = np.sum(wv * (yv - best[valid]) ** 2 / yerr[valid])  # Sum of squares of weighted residuals
+            v = np.sum(wv) / ((np.sum(wv)) ** 2 - np.sum(wv ** 2))  # weighted normalizing factor
+        return {'model': 'polynomial', 'coefs': params, 'se_coefs': np.sqrt(np.diag(cov)),
+                'best': {'Y': best, 'seY': seBest},
+                'ci': {'l': best - quantile * seBest, 'u': best + quantile * seBest}, 'rSqr': rSqr,
+                'rChi2': wrss / v}
+
+    @staticmethod
+    def emptyFit(n, nParams):
+        """
+        Result of a fit without any used isotope: NaN predictions and intervals at every mass
+        :param n: int number of isotopes
+        :param nParams: int number of model coefficients
+        """
+        nan = np.full(n, np.nan)
+        return {'model': 'polynomial', 'coefs': np.full(nParams, np.nan), 'se_coefs': np.full(nParams, np.nan),
+                'best': {'Y': nan, 'seY': nan.copy()}, 'ci': {'l': nan.copy(), 'u': nan.copy()}, 'rSqr': np.nan,
+                'rChi2': np.nan}
+
+    def fitSmoother(self, mass, y, yerr, mask, order, weighted=True, alpha=0.05):
+        """
+        Smoothing spline (CUBIC_SPLINE) or monotone piecewise-linear (PIECEWISE_LINEAR) fit against mass.  Fitted
+        values at the used masses are y_hat = S y and predictions at every mass f = H y (for the spline H = B S, B
+        interpolating y_hat), so Cov(f) = s^2 H W^-1 H' with s^2 = weighted RSS / (n - tr(S)).  Fewer than three used
+        masses fall back to the mean or a line.
+        Parameters as fit(); coefs are the fitted values at the used masses.  The robust option does not apply.
+        """
+        from scipy import stats
+        mass = np.asarray(mass, dtype=float)
+        y = np.asarray(y, dtype=float)
+        yerr = np.asarray(yerr, dtype=float)
+        mask = np.asarray(mask, dtype=bool)
+        w = 1 / yerr ** 2 if weighted else np.ones_like(y)
+        valid = mask & np.isfinite(y) & np.isfinite(w)
+        if len(np.unique(mass[valid])) < 3:
+            # Too few masses for a smoother with residual degrees of freedom: mean or line
+            fit = self.fit(mass, y, yerr, mask, max(0, min(1, len(np.unique(mass[valid])) - 1)), weighted, False, alpha)
+            fit['model'] = 'polynomial'
+            return fit
+        idx = np.flatnonzero(valid)[np.argsort(mass[valid], kind='stable')]
+        knots, yv, wv = mass[idx], y[idx], w[idx]
+        lam = np.nan
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if order == CUBIC_SPLINE:
+                S, lam, edf = smoothingSpline(knots, yv, wv)
+                H = splineBasis(knots, mass) @ S
+                model = 'cubic spline'
+            else:
+                S, H, edf = monotoneSmoother(knots, yv, wv, mass)
+                model = 'piecewise linear'
+            fitted = S @ yv
+            ssr = np.sum(wv * (yv - fitted) ** 2)
+            dfResid = len(yv) - edf
+            s2 = ssr / dfResid
+            covFitted = (S / wv[None, :]) @ S.T * s2
+            best = H @ yv
+            seBest = np.sqrt(np.maximum(np.einsum('ij,ij->i', H / wv[None, :], H) * s2, 0))
+            quantile = stats.t.ppf(1 - alpha / 2, dfResid)
+            rSqr = 1 - ssr / np.sum(wv * (yv - np.average(yv, weights=wv)) ** 2)
+            # Reduced Chi^2, as for the polynomials
+            wrss = np.sum(wv * (yv - fitted) ** 2 / yerr[idx])
+            v = np.sum(wv) / ((np.sum(wv)) ** 2 - np.sum(wv ** 2))
+        return {'model': model, 'coefs': fitted, 'se_coefs': np.sqrt(np.diag(covFitted)), 'edf': edf, 'lam': lam,
+                'best': {'Y': best, 'seY': seBest},
+                'ci': {'l': best - quantile * seBest, 'u': best + quantile * seBest}, 'rSqr': rSqr,
+                'rChi2': wrss / v}
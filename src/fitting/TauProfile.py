@@ -0,0 +1,118 @@
+import numpy as np
+
+"""
+DEAD-TIME PROFILE SCAN
+Evaluates the model ACF residuals of an isotope over a grid of dead-times (tau) instead of one spin box value at a
+time.  The filtered data are sorted by time once (the order used by the isotope fit plots) and the residuals of a
+chunk of tau values are a single broadcast (tau x observations) operation:
+
+    residual(tau) = 100 * (P/(1 - P*tau) / A * (a1 + a2*t) - 1)
+
+with P the pulse rate after removing the machine dead-time.  Statistics follow isotopeFitWidget.Residue.  The
+optimum tau minimizes the weighted sum of squared residuals; its uncertainty is taken from the curvature of a
+parabola through the grid points around the minimum.
+"""
+
+MAX_PROFILE_CELLS = 20000000  # tau values x observations evaluated at once
+
+
+def residualData(session, massRecord):
+    """
+    One time-sorted copy of the filtered data of an isotope with everything the residuals need
+    :param session: Session
+    :param massRecord: filtered and fitted Mass
+    :return: dictionary with time, pulse (machine dead-time removed), analog, weights and modeled ACF
+    """
+    idx = massRecord.filteredTime.argsort()
+    time = massRecord.filteredTime[idx] - np.min(session.scanTime)
+    p = massRecord.filteredPulse[idx]
+    a = massRecord.filteredAnalog[idx]
+    pobs = p / (1 + p * session.machineDeadTime)
+    a1 = massRecord.fits["self"]["a1"]
+    a2 = massRecord.fits["self"]["a2"]
+    return {'time': time, 'pulse': pobs, 'analog': a, 'weights': pobs ** 3 * massRecord.totalDwell,
+            'bestFit': 1 / (a1 + a2 * time)}
+
+
+def profileResiduals(data, taus):
+    """
+    Residue statistics of the model ACF residuals for every tau of the grid
+    :param data: dictionary returned by residualData
+    :param taus: (m,) dead-time grid in seconds
+    :return: dictionary of (m,) arrays: tau, mean, wMean, stdev, wStdev, ssr (weighted sum of squares)
+    """
+    taus = np.asarray(taus, dtype=float)
+    p = data['pulse']
+    w = data['weights']
+    c = p / data['analog'] / data['bestFit']
+    n = len(p)
+    sumW = np.sum(w)
+    profile = {key: np.empty(len(taus)) for key in ['mean', 'wMean', 'stdev', 'wStdev', 'ssr']}
+    chunk = max(1, MAX_PROFILE_CELLS // max(n, 1))
+    for start in range(0, len(taus), chunk):
+        tau = taus[start:start + chunk, None]
+        residual = 100 * (c / (1 - p * tau) - 1)
+        mean = np.mean(residual, axis=1)
+        wMean = residual @ w / sumW
+        ssr = (residual ** 2) @ w
+        profile['mean'][start:start + chunk] = mean
+        profile['stdev'][start:start + chunk] = np.sqrt(np.maximum(np.mean(residual ** 2, axis=1) - mean ** 2, 0))
+        profile['wMean'][start:start + chunk] = wMean
+        profile['wStdev'][start:start + chunk] = (ssr - sumW * wMean ** 2) / (((n - 1) / n) * sumW)
+        profile['ssr'][start:start + chunk] = ssr
+    profile['tau'] = taus
+    return profile
+
+
+def profileOptimum(profile, nObs, halfWidth=2):
+    """
+    Optimum tau and its curvature-based uncertainty.  A parabola is fit through the grid points around the minimum
+    weighted sum of squares S; with S/s^2 treated as chi-square (s^2 = S_min/(n-1)), delta chi-square = 1 gives
+    se = sqrt(2 s^2 / S'').
+    :param profile: dictionary returned by profileResiduals
+    :param nObs: int number of observations
+    :param halfWidth: int grid points on each side of the minimum used for the parabola
+    :return: optimum tau, standard error (NaN if the minimum is at the edge of the grid or not convex)
+    """
+    taus = profile['tau']
+    ssr = profile['ssr']
+    if np.all(np.isnan(ssr)):
+        return np.nan, np.nan
+    i = int(np.nanargmin(ssr))
+    if i < halfWidth or i >= len(taus) - halfWidth:
+        return taus[i], np.nan
+    local = slice(i - halfWidth, i + halfWidth + 1)
+    step = taus[i + 1] - taus[i]
+    x = (taus[local] - taus[i]) / step
+    c2, c1, c0 = np.polyfit(x, ssr[local], 2)
+    if not c2 > 0:
+        return taus[i], np.nan
+    optimum = taus[i] - c1 / (2 * c2) * step
+    sMin = c0 - c1 ** 2 / (4 * c2)
+    curvature = 2 * c2 / step ** 2
+    return optimum, np.sqrt(2 * (sMin / (nObs - 1)) / curvature)
+
+
+def tauGrid(massRecord, machineDeadTime, span=20E-9, nPoints=201):
+    """
+    :return: dead-time grid centered on the fitted tau of the isotope (machine dead-time if not fitted)
+    """
+    center = massRecord.fits["self"]["tau"]
+    if center is None or np.isnan(center):
+        center = machineDeadTime
+    return np.linspace(center - span, center + span, nPoints)
+
+
+def tauProfile(session, massRecord, taus=None):
+    """
+    Dead-time profile of one isotope
+    :param session: Session
+    :param massRecord: filtered and fitted Mass
+    :param taus: (m,) dead-time grid in seconds, None for tauGrid
+    :return: profile dictionary (see profileResiduals) with optimum and se_optimum
+    """
+    if taus is None:
+        taus = tauGrid(massRecord, session.machineDeadTime)
+    profile = profileResiduals(residualData(session, massRecord), taus)
+    profile['optimum'], profile['se_optimum'] = profileOptimum(profile, len(massRecord.filteredTime))
+    return profile
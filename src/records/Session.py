@@ -1,10 +1,18 @@
+import os
+import hashlib
 import numpy as np
 
-import statsmodels.api as sm
-from sklearn.preprocessing import PolynomialFeatures
-
 # Project imports
-from src.ui.spectrumModelDesignTable import ModelDesignTable
+from src.fitting import LinearEngine, RobustEngine
+from src.fitting.ParallelFit import ParallelRegressor
+from src.fitting.BootstrapEngine import BootstrapRegressor
+from src.fitting import TauProfile
+from src.fitting.ParameterSweep import ParameterSweep
+from src.fitting.SpectrumEngine import SpectrumFitEngine
+from src.fitting import JointEngine, PostProcess
+
+SOURCES = ['Self', 'Internal', 'External']  # postProcessPars sources, in the order of the fit type selectors
+
 
 class Session:
     def __init__(self):
@@ -25,17 +33,86 @@ class Session:
         self.status = {'imported': False, 'filtered': False, 'fit': False, 'new': False}
         self.pCross = 4E+6
         self.ignoreFaraday = True
-        self.isotopeFit = {'algorithm': None, 'norm': None, 'pMax': 5E+6, 'pMin': 0, 'aMin': 1000, 'outlier': 0}
+        self.isotopeFit = {'algorithm': None, 'norm': None, 'pMax': 5E+6, 'pMin': 0, 'aMin': 1000, 'outlier': 0,
+                           'bootstrap': None}
         self.machineDeadTime = 0
         self.inclUnc = False
         self.scanTime = np.array([])
         self.EDAC = np.array([])
         self.FCF = np.array([])
         self.sampleKeys = np.array([])
+        self.machineACF0 = None
+        self.machineDrift = None
+        self.machineDriftFits = {}
+        self.machineDriftSeries = {}
+        self.jointFit = None
         self.samples = {}
         self.masses = {}
         self.spectrumFit = SpectrumFits()
 
+    def appendRecord(self, smpRecord, scans, massPrecision=0.5):
+        """
+        Appends the columnar record of one sample (as returned by ThermoDAT.readScans or a RawDataImporter) to the
+        session: per-scan arrays are concatenated, isotopes are created on first sight and extended afterwards
+        :param smpRecord: Sample with a unique ID
+        :param scans: dictionary with ACF, FCF, EDAC, scanTime (absolute) arrays and masses,
+        {isotope: {pulse, analog, faraday, chDwell, channels, magMasses, actMasses}}
+        :param massPrecision: float rounding of the average mass into truncMass
+        """
+        ACF = scans['ACF']
+        FCF = scans['FCF']
+        EDAC = scans['EDAC']
+        scanTime = scans['scanTime']
+        sampleKeys = np.ones_like(scanTime)*smpRecord.ID
+
+        for isotope, block in scans['masses'].items():
+            pulse = block['pulse']
+            analog = block['analog']
+            faraday = block['faraday']
+            actMasses = block['actMasses']
+            # Calculate CHROM Data
+            timeSeries = PostProcess.reportedArrays(pulse, analog, faraday, ACF, FCF, self)
+
+            if isotope not in self.masses.keys():
+                self.masses[isotope] = Mass(self)
+                self.masses[isotope].ACF = ACF
+                self.masses[isotope].pulse = pulse
+                self.masses[isotope].analog = analog
+                self.masses[isotope].faraday = faraday
+                self.masses[isotope].timeSeries = timeSeries
+                self.masses[isotope].chDwell = block['chDwell']
+                self.masses[isotope].aveMass = np.mean(actMasses)
+                truncMass = round(np.mean(actMasses) / massPrecision) * massPrecision
+                self.masses[isotope].truncMass = truncMass
+                self.masses[isotope].channels = block['channels']
+                self.masses[isotope].totalDwell = block['channels'] * block['chDwell']
+                self.masses[isotope].magMasses = block['magMasses']
+                self.masses[isotope].actMasses = actMasses
+            else:
+                self.masses[isotope].ACF = np.append(self.masses[isotope].ACF, ACF, axis=0)
+                self.masses[isotope].pulse = np.append(self.masses[isotope].pulse, pulse, axis=0)
+                self.masses[isotope].analog = np.append(self.masses[isotope].analog, analog, axis=0)
+                self.masses[isotope].faraday = np.append(self.masses[isotope].faraday, faraday, axis=0)
+                self.masses[isotope].timeSeries = np.append(self.masses[isotope].timeSeries, timeSeries, axis=0)
+
+        if self.FCF.size == 0:
+            self.FCF = FCF
+        else:
+            self.FCF = np.append(self.FCF, FCF)
+        if self.EDAC.size == 0:
+            self.EDAC = EDAC
+        else:
+            self.EDAC = np.append(self.EDAC, EDAC)
+        if self.scanTime.size == 0:
+            self.scanTime = scanTime
+        else:
+            self.scanTime = np.append(self.scanTime, scanTime)
+        if self.sampleKeys.size == 0:
+            self.sampleKeys = sampleKeys
+        else:
+            self.sampleKeys = np.append(self.sampleKeys, sampleKeys)
+        self.samples[smpRecord.name] = smpRecord
+
     def getChromData(self, postProcessed = False):
         for smpName, smpRecord in self.samples.items():
             mask = np.where(self.sampleKeys == smpRecord.ID)
@@ -82,32 +159,191 @@ class Session:
         if self.status["imported"] == True:
             for massName, massRecord in self.masses.items():
                 massRecord.filter()
-            relTime = self.scanTime - self.startTime
-            acfKey = list(self.masses.keys())[0]
-            acf = self.masses[acfKey].ACF
-            X = np.ones((len(acf), 2))
-            X[:, 1] = relTime
-            model = sm.OLS(acf, X)
-            results = model.fit()
-            acf0 = results.params[0]
-            acfF = acf0 + results.params[1] * max(relTime)
-            drift = acfF / acf0 - 1
-            self.machineACF0 = acf0
-            self.machineDrift = drift
-            # print(f'{__name__} Machine ACF0: {acf0:0.2f}, Drift: {drift:0.1%}')
-
-    def regressRawData(self):
+                massRecord.regressionStats = massRecord.accumulate()
+            self.estimateMachineDrift()
+
+    def estimateMachineDrift(self, bySample=True):
+        """
+        Closed-form straight-line fits of the machine ACF (reported with the first isotope) vs. time for the session,
+        every sequence and, optionally, every sample.  Per-sample sums are accumulated in one pass and pooled into
+        sequence and session fits.  Results are stored in machineDriftFits and the modeled ACF per scan in
+        machineDriftSeries so plots and exports need not refit.
+        :param bySample: bool if True, also keep per-sample fits and their modeled ACF series
+        """
+        relTime = self.scanTime - self.startTime
+        acfKey = list(self.masses.keys())[0]
+        acf = self.masses[acfKey].ACF
+        sampleIDs, scanSample = np.unique(self.sampleKeys, return_inverse=True)
+        if len(scanSample) != len(relTime):
+            scanSample = np.zeros(len(relTime), dtype=int)
+            sampleIDs = np.array([None])
+        sums = LinearEngine.lineSums(relTime, acf, scanSample, len(sampleIDs))
+        names = {smpRecord.ID: smpName for smpName, smpRecord in self.samples.items()}
+        sequences = {}
+        for i, ID in enumerate(sampleIDs):
+            smpRecord = self.samples.get(names.get(ID))
+            seqName = getattr(smpRecord, 'filePaths', {}).get("SEQ", '') if smpRecord is not None else ''
+            sequences.setdefault(seqName, []).append(i)
+
+        def driftFit(groupSums, span):
+            acf0, slope = LinearEngine.lineFromSums(groupSums)
+            return {'acf0': acf0, 'slope': slope, 'drift': (acf0 + slope * span[1]) / (acf0 + slope * span[0]) - 1}
+
+        # Session fit: ACF0 at the start of the experiment, drift at the last scan
+        fits = {'session': driftFit(sums.sum(axis=0), (0, np.max(relTime))), 'sequence': {}, 'sample': {}}
+        series = {'time': relTime,
+                  'session': fits['session']['acf0'] + fits['session']['slope'] * relTime,
+                  'sequence': np.full(len(relTime), np.nan)}
+        for seqName, members in sequences.items():
+            scans = np.isin(scanSample, members)
+            span = (np.min(relTime[scans]), np.max(relTime[scans]))
+            fits['sequence'][seqName] = driftFit(sums[members].sum(axis=0), span)
+            series['sequence'][scans] = fits['sequence'][seqName]['acf0'] + \
+                fits['sequence'][seqName]['slope'] * relTime[scans]
+        if bySample:
+            acf0, slope = LinearEngine.lineFromSums(sums)
+            series['sample'] = acf0[scanSample] + slope[scanSample] * relTime
+            starts = np.full(len(sampleIDs), np.inf)
+            ends = np.full(len(sampleIDs), -np.inf)
+            np.minimum.at(starts, scanSample, relTime)
+            np.maximum.at(ends, scanSample, relTime)
+            for i, ID in enumerate(sampleIDs):
+                fits['sample'][names.get(ID, ID)] = driftFit(sums[i], (starts[i], ends[i]))
+        self.machineDriftFits = fits
+        self.machineDriftSeries = series
+        self.machineACF0 = fits['session']['acf0']
+        self.machineDrift = fits['session']['drift']
+        # print(f'{__name__} Machine ACF0: {self.machineACF0:0.2f}, Drift: {self.machineDrift:0.1%}')
+
+    def regressRawData(self, workers=None, refit=False):
+        """
+        Regresses the filtered data of every isotope.  Isotopes whose filtered observations and fit settings are
+        unchanged since their last regression are reloaded from the MassFits cache; robust fits of the others
+        warm-start from cached parameters of the same algorithm and norm.
+        :param workers: int number of worker processes for robust fits; None uses all cores, 1 fits serially
+        :param refit: bool if True, ignore cached regressions and refit every isotope
+        """
         if self.status["filtered"] == True:
-            for massName, massRecord in self.masses.items():
-                massRecord.regress(self, massName)
+            regType = self.isotopeFit["algorithm"]
+            workers = workers or os.cpu_count() or 1
+            if regType == "Robust" and workers > 1 and len(self.masses) > 1:
+                ParallelRegressor(workers).regress(self, refit)
+            elif regType == "Robust":
+                for massName, massRecord in self.masses.items():
+                    massRecord.regress(self, massName, refit)
+            else:
+                # Closed-form fits of all isotopes are solved together from the filter-time sufficient statistics
+                weighted = "Weighted" in regType
+                fitted = []
+                for massRecord in self.masses.values():
+                    if massRecord.fits is None:
+                        massRecord.fits = MassFits()
+                    if not refit and massRecord.restoreFits():
+                        continue
+                    if massRecord.nIn > 50:
+                        if getattr(massRecord, 'regressionStats', None) is None:
+                            massRecord.regressionStats = massRecord.accumulate()
+                        fitted.append(massRecord)
+                    else:
+                        massRecord.cacheFits(None)
+                accumulators = [massRecord.regressionStats for massRecord in fitted]
+                for massRecord, selfFits in zip(fitted, LinearEngine.fitAccumulators(accumulators, weighted)):
+                    massRecord.cacheFits(selfFits)
+            if self.isotopeFit.get('bootstrap') is not None:
+                self.bootstrapRegressions(self.isotopeFit['bootstrap'], workers=workers)
             self.status['fit'] = True
 
+    def bootstrapRegressions(self, by='scan', nReplicates=1000, alpha=0.05, workers=None, seed=None):
+        """
+        Block bootstrap confidence intervals of the isotope regressions, stored in each MassFits["bootstrap"]
+        :param by: string "scan" or "sample", the block resampled with replacement
+        :param nReplicates: int number of bootstrap replicates
+        :param alpha: float two-sided significance level of the percentile intervals
+        :param workers: int number of worker processes; None uses all cores, 1 runs serially
+        :param seed: int seed for reproducible replicates
+        :return: {massName: bootstrap results}
+        """
+        return BootstrapRegressor(workers).bootstrap(self, by, nReplicates, alpha, seed)
+
+    def sweepFilterSettings(self, grid, algorithms=("Weighted",), workers=None):
+        """
+        Filters and fits every isotope over a grid of filter settings x regression algorithms, leaving the session's
+        own filter and fits untouched
+        :param grid: dictionary of lists keyed by pMax, pMin, aMin and outlier; missing keys use self.isotopeFit
+        :param algorithms: iterable of "Weighted", "Ordinary" or ("Robust", norm)
+        :param workers: int number of worker processes; None uses all cores, 1 runs serially
+        :return: list of result rows, one per isotope x grid point x algorithm (see ParameterSweep.toDataFrame)
+        """
+        return ParameterSweep(workers).sweep(self, grid, algorithms)
+
+    def profileTau(self, taus=None):
+        """
+        Sweeps a dead-time grid for every fitted isotope; results are stored in each MassFits["tauProfile"]
+        :param taus: (m,) dead-time grid in seconds, None for +/- 20 ns around the fitted tau of each isotope
+        :return: {massName: profile dictionary with optimum and se_optimum}
+        """
+        profiles = {}
+        for massName, massRecord in self.masses.items():
+            if massRecord.fits is None or massRecord.nIn <= 50 or massRecord.fits['self']['a1'] is None:
+                continue
+            profiles[massName] = TauProfile.tauProfile(self, massRecord, taus)
+            massRecord.fits['tauProfile'] = profiles[massName]
+        return profiles
+
+    def regressJoint(self, design=None):
+        """
+        Single-stage fit of every isotope with a1, a2 and tau as functions of mass, reduced from the filter-time
+        sufficient statistics of each isotope; per-isotope values are stored in each MassFits["joint"]
+        :param design: dictionary {'a1': spec, 'a2': spec, 'tau': spec}, spec ('polynomial', order) or
+        ('spline', number of knots); missing keys use JointEngine.DESIGN
+        :return: dictionary of global results (design, coefs, cov, nObs, rSqr, redChi2, dfResid)
+        """
+        if self.status["filtered"] != True:
+            return None
+        included = {massName: massRecord for massName, massRecord in self.masses.items() if massRecord.nIn > 0}
+        for massRecord in included.values():
+            if getattr(massRecord, 'regressionStats', None) is None:
+                massRecord.regressionStats = massRecord.accumulate()
+        accumulators = [massRecord.regressionStats for massRecord in included.values()]
+        masses = [massRecord.aveMass for massRecord in included.values()]
+        # Ordinary least squares until a fit algorithm has been chosen
+        algorithm = self.isotopeFit["algorithm"]
+        weighted = algorithm is not None and "Ordinary" not in algorithm
+        fits, summary = JointEngine.jointRegress(accumulators, masses, design, weighted)
+        for massRecord, jointFits in zip(included.values(), fits):
+            if massRecord.fits is None:
+                massRecord.fits = MassFits()
+            massRecord.fits['joint'] = jointFits
+        self.jointFit = summary
+        return summary
+
+    def accumulateRegressions(self, bySample=False, chunkSize=1000000):
+        """
+        Sufficient statistics of the isotope regressions built from the filtered data one chunk at a time
+        :param bySample: bool if True, return separate accumulators for each sample
+        :param chunkSize: int maximum number of observations held in the design matrix at once
+        :return: {massName: RegressionAccumulator} or {massName: {sampleName: RegressionAccumulator}}
+        """
+        stats = {}
+        for massName, massRecord in self.masses.items():
+            if not bySample:
+                stats[massName] = massRecord.accumulate(chunkSize=chunkSize)
+                continue
+            stats[massName] = {}
+            keys = self.sampleKeys[massRecord.filteredScan]
+            for smpName, smpRecord in self.samples.items():
+                stats[massName][smpName] = massRecord.accumulate(keys == smpRecord.ID, chunkSize)
+        return stats
+
     def releaseRawDataRegression(self):
         for massRecord in self.masses.values():
-            massRecord.fits = MassFits()
+            # Keep the regression cache so an unchanged refit is free
+            massRecord.fits = MassFits(massRecord.fits.get('cache') if massRecord.fits is not None else None)
         self.status['fit'] = False
 
     def regressSpectrum(self):
+        import statsmodels.api as sm
+        from sklearn.preprocessing import PolynomialFeatures
         keys = ["a1", "a2", "tau"]
         uses = ["useACF", "useACF", "useTau"]
         """ EXTRACT DATA TO FIT """
@@ -185,13 +421,42 @@ class Session:
                 self[key]["seModel"].append(seY)
                 # Todo: implement "external" type (i.e. use machine values)
 
-    def postProcessTimeSeries(self):
-        if self.status["modeled"] == True:
-            for massName, massRecord in self.masses.items():
-                massRecord.postProcessTimeSeries(self)
+    def postProcessTimeSeries(self, chunkSize=PostProcess.CHUNK_SCANS):
+        """
+        Models the time series of every isotope with its postProcessPars in one chunked pass over the scans
+        :param chunkSize: int number of scans modeled at once
+        """
+        if self.status["fit"] == True:
+            massRecords = [massRecord for massRecord in self.masses.values() if hasattr(massRecord, 'postProcessPars')]
+            PostProcess.postProcessMasses(self, massRecords, chunkSize)
 
-    def commitSpectrumFits(self):
-        pass
+    def commitSpectrumFits(self, alphaSources=None, tauSources=None):
+        """
+        Sets the postProcessPars of every isotope from the mass spectrum fits: 'Self' uses the isotope's own
+        regression, 'Internal' the value of the spectrum model at its mass; other sources leave the parameters unset
+        :param alphaSources: list of 'Self', 'Internal' or 'External' per isotope, None for spectrumFit['alphaSource']
+        :param tauSources: list of 'Self', 'Internal' or 'External' per isotope, None for spectrumFit['tauSource']
+        """
+        sf = self.spectrumFit
+        if alphaSources is None:
+            alphaSources = [SOURCES[i] for i in sf['alphaSource']]
+        if tauSources is None:
+            tauSources = [SOURCES[i] for i in sf['tauSource']]
+        for row, massRecord in enumerate(self.masses.values()):
+            if not hasattr(massRecord, 'postProcessPars'):
+                massRecord.__setattr__('postProcessPars', {})
+            a = alphaSources[row]
+            t = tauSources[row]
+            massRecord.postProcessPars["alphaSource"] = a
+            massRecord.postProcessPars["tauSource"] = t
+            for par, source in zip(['a1', 'a2', 'tau'], [a, a, t]):
+                for var in ['', 'se']:
+                    val = None
+                    if source == 'Self':
+                        val = sf[par][var+'Y'][row]
+                    elif source == 'Internal':
+                        val = sf[par]['best'][var+'Y'][row]
+                    massRecord.postProcessPars[var+par] = val
 
     def timeOffsets(self, massSettle = 0, chSettle = 0):
         if self.status["imported"] == True:
@@ -252,9 +517,13 @@ class Mass:
         self.reported = np.array([[]])
         self.timeSeries = np.array([])
         self.modeledTimeSeries = np.array([])
+        self.modeledTimeSeriesError = None
         self.filteredTime = np.array([])
         self.filteredPulse = np.array([])
         self.filteredAnalog = np.array([])
+        self.filteredScan = np.array([], dtype=int)
+        self.filterDigest = None
+        self.regressionStats = None
         self.anOnlyTime = np.array([])
         self.fits = MassFits()
         self.postProcessPars = {"tauSource": None, "tau": None, "setau": None,
@@ -278,14 +547,17 @@ class Mass:
         t = time2d.flatten()
         p = self.pulse.flatten()
         a = self.analog.flatten()
+        scan = np.repeat(np.arange(len(self.session.scanTime)), chs)
 
         anOnlyMask = np.logical_and(np.isnan(p), np.isreal(a))
         self.anOnlyTime = t[anOnlyMask]
         self.anOnly = np.sum(anOnlyMask)
         mask = np.where(np.logical_and(pMax > p, p > pMin, a > aMin))
+        index = np.arange(len(p))[mask]
         self.filteredTime = t[mask]
         self.filteredPulse = p[mask]
         self.filteredAnalog = a[mask]
+        self.filteredScan = scan[mask]
         self.nQual = len(self.filteredTime)     # Measurements in fitting range
         self.filteredAnalog[self.filteredAnalog == 0] = np.nan
         acf = self.filteredPulse / self.filteredAnalog
@@ -301,7 +573,12 @@ class Mass:
             self.filteredPulse = self.filteredPulse[mask]
             self.filteredAnalog= self.filteredAnalog[mask]
             self.filteredTime = self.filteredTime[mask]
+            self.filteredScan = self.filteredScan[mask]
+            index = index[mask]
         self.nIn = len(self.filteredTime)       # Measurements that pass Tukey filtered acf values
+        # Identifies the filtered observations, so a filter change that leaves them unchanged keeps the regression
+        self.filterDigest = hashlib.blake2b(np.ascontiguousarray(index, dtype=np.int64).tobytes(),
+                                            digest_size=16).hexdigest()
         if self.nQual > 0:
             try:
                 self.maxP = max(self.filteredPulse)
@@ -309,7 +586,7 @@ class Mass:
                 # print(f'{__name__} filter problem')
                 pass
 
-    def regress(self, session: Session, mass: str):
+    def regress(self, session: Session, mass: str, refit=False):
         """
         Regresses 1/P vs. 1/A & t/A
         :param deadtime: float used to remove deadtime correction from corrected data
@@ -328,110 +605,144 @@ class Mass:
             "RobustNorm",
             "TrimmedMean",
             "TukeyBiweight"
+        :param refit: bool if True, ignore the cached regression of unchanged settings
         :return: parameters of regression; uploaded to IsotopeFit class data
         """
         if self.fits is None:
             self.fits = MassFits()
+        if not refit and self.restoreFits():
+            return
         regType = self.session.isotopeFit["algorithm"]
         normType = self.session.isotopeFit['norm']
-        deadtime = self.session.machineDeadTime
         if self.nIn > 50:
-            P = self.filteredPulse
-            P = P / (1 + P * deadtime)  # Remove Deadtime Correction
-            A = self.filteredAnalog
-            t = self.filteredTime - self.session.startTime  # Relative to start of experiment
-            W = self.totalDwell * P ** 3
-            y = 1 / P
-            X = np.ones((len(y), 3))
-            X[:, 1] = 1 / A
-            X[:, 2] = t / A
+            y, X, W = self.designArrays()
             if regType == "Robust":
-                M = sm.robust.norms.TukeyBiweight()
-                norm = normType.replace(" ","")
-                if norm == "Whitened":
-                    w = len(W) * np.sqrt(W) / np.sum(np.sqrt(W))
-                    y = w * y
-                    X = w * X
-                elif norm == "HuberT": M = sm.robust.norms.HuberT()
-                elif norm == "Hampel": M = sm.robust.norms.Hampel()
-                elif norm == "LeastSquares": M = sm.robust.norms.LeastSquares()
-                elif norm == "AndrewWave": M = sm.robust.norms.AndrewWave()
-                elif norm == "RamsayE": M = sm.robust.norms.RamsayE()
-                elif norm == "RobustNorm": M = sm.robust.norms.RobustNorm()
-                elif norm == "TrimmedMean": M = sm.robust.norms.TrimmedMean()
-                elif norm == "TukeyBiweight": M = sm.robust.norms.TukeyBiweight()
-                else: M = sm.robust.norms.TukeyBiweight()
-                model3D = sm.RLM(y, X, M)
-
-            elif "Weighted" in regType:
-                model3D = sm.WLS(y, X, weights=W)
-                x2D = np.ones((len(y), 2))
-                x2D = np.delete(X, 2, 1)
-                model2D = sm.WLS(y, x2D, weights=W)
-                results2D = model2D.fit()
-                pred2D = results2D.predict(x2D)
-                ci = results2D.conf_int()
-                self.fits["2D"] = {}
-                self.fits["2D"]["tau"] = results2D.params[0]
-                self.fits["2D"]["a1"] = results2D.params[1]
-                self.fits["2D"]["dtau"] = results2D.bse[0]
-                self.fits["2D"]["da1"] = results2D.bse[1]
-
-            elif "Ordinary" in regType:
-                model3D = sm.OLS(y, X)
-
-
-            # Calculate Reduced Chi-Square (aka MSWD)
-            results = model3D.fit()
-            pred = results.predict(X)
-            res = y - pred
-            # https://en.wikipedia.org/wiki/Reduced_chi-squared_statistic
-            redChi2 = np.sum(W * res ** 2)/(len(res)-3)
-            a1 = results.params[1]
-            a2 = results.params[2]
-            initialACF = 1/a1
-            delTime = np.max(self.session.scanTime) - np.min(self.session.scanTime)
-            finalACF = 1/(a1 + a2 * delTime)
-            drift = (finalACF/initialACF)-1
-            self.dtMaxP = self.maxP/(1-self.maxP*results.params[0])
-            self.dtCorrPct = self.dtMaxP/self.maxP-1
-            rse = []
-            for i, [param, err] in enumerate(zip(results.params, results.bse)):
-                rse.append(err/param)
-            if "Robust" in regType:
-                r2 = 'N/A`'
+                selfFits = RobustEngine.robustRegress(y, X, W, normType, self.warmStart())
             else:
-                r2 = {f'{results.rsquared:0.3f}'}
-                # print(f'{mass}: ACF - {initialACF:0.2f}({100*rse[1]:0.2G}%), Drift = {drift:0.2%}({100*rse[2]:0.2G}%);'
-                #   f' Tau = {results.params[0]:0.4G}({rse[0]:0.1%}); rSqr = {r2};'
-                #   f' Dead Corr % at Pmax ({self.maxP}) = {self.dtCorrPct:0.2%}')
-
-            self.fits["self"]['tau'] = results.params[0]
-            self.fits["self"]["a1"] = results.params[1]
-            self.fits["self"]["a2"] = results.params[2]
-            self.fits["self"]["se_tau"] = results.bse[0]
-            self.fits["self"]["se_a1"] = results.bse[1]
-            self.fits["self"]["se_a2"] = results.bse[2]
-            if "Robust" in regType:
-                self.fits["self"]["rSqr"] = 'N/A'
-            else:
-                self.fits["self"]["rSqr"] = results.rsquared
-            self.fits["self"]["redChi2"] = redChi2
-            self.fits["self"]["ACF"] = initialACF
-            self.fits['self']["Drift"] = drift
-            self.fits["self"]["dtCorrPct"] = self.dtCorrPct
+                selfFits = LinearEngine.regress(y, X, W, "Weighted" in regType)
+            self.cacheFits(selfFits)
         else:
-            self.fits["self"]['tau'] = np.nan
-            self.fits["self"]["a1"] = np.nan
-            self.fits["self"]["a2"] = np.nan
-            self.fits["self"]["se_tau"] = np.nan
-            self.fits["self"]["se_a1"] = np.nan
-            self.fits["self"]["se_a2"] = np.nan
-            self.fits["self"]["rSqr"] = np.nan
-            self.fits["self"]["redChi2"] = np.nan
-            self.fits["self"]["ACF"] = np.nan
-            self.fits['self']["Drift"] = np.nan
-            self.fits['self']["dtCorrPct"] = np.nan
+            self.cacheFits(None)
+
+    def fitFingerprint(self):
+        """
+        :return: tuple of the fit algorithm and norm, dead time, start time, observation count and digest of the
+        filtered observations that determine the regression
+        """
+        settings = self.session.isotopeFit
+        return (settings['algorithm'], settings['norm'], self.session.machineDeadTime, self.session.startTime,
+                self.nIn, getattr(self, 'filterDigest', None))
+
+    def warmStart(self):
+        """
+        :return: [tau, a1, a2] of the cached regression if it was fit with the current algorithm and norm, else None
+        (robust estimates depend on the start, so fits of other settings would make them order dependent)
+        """
+        cache = self.fits['cache'] if self.fits is not None else None
+        if cache is None or cache['fingerprint'] is None or cache['params'] is None:
+            return None
+        settings = self.session.isotopeFit
+        if tuple(cache['fingerprint'][:2]) != (settings['algorithm'], settings['norm']):
+            return None
+        return cache['params']
+
+    def restoreFits(self):
+        """
+        Reloads the cached regression if the filter and fit settings are unchanged
+        :return: bool True if the cached regression was loaded
+        """
+        cache = self.fits['cache']
+        if cache['fingerprint'] is None or cache['fingerprint'] != self.fitFingerprint():
+            return False
+        self.updateSelfFits(cache['selfFits'])
+        self.fits.pop('2D', None)
+        return True
+
+    def cacheFits(self, selfFits):
+        """
+        Loads regression results into fits["self"] and stores them, with the settings fingerprint, in the cache
+        :param selfFits: dictionary of regression results; None if not fitted
+        """
+        self.updateSelfFits(selfFits)
+        cache = self.fits['cache']
+        cache['fingerprint'] = self.fitFingerprint()
+        cache['selfFits'] = None if selfFits is None else dict(selfFits)
+        self.fits.pop('2D', None)
+        if selfFits is not None:
+            cache['params'] = [selfFits[key] for key in LinearEngine.PARAMETER_KEYS]
+
+    def designArrays(self):
+        """
+        Response, design matrix and weights of the 1/P vs. 1/A & t/A regression for the filtered data
+        :return: y, X, W (see LinearEngine.designArrays)
+        """
+        return LinearEngine.designArrays(self.filteredPulse, self.filteredAnalog, self.filteredTime,
+                                         self.session.machineDeadTime, self.totalDwell, self.session.startTime)
+
+    def accumulate(self, mask=None, chunkSize=1000000):
+        """
+        Reduces the filtered data to the sufficient statistics of the regression, chunk by chunk
+        :param mask: boolean array selecting a subset of the filtered observations (e.g. one sample)
+        :param chunkSize: int maximum number of observations held in the design matrix at once
+        :return: RegressionAccumulator
+        """
+        stats = LinearEngine.RegressionAccumulator(self.session.machineDeadTime, self.totalDwell,
+                                                   self.session.startTime)
+        idx = np.arange(len(self.filteredTime))
+        if mask is not None:
+            idx = idx[mask]
+        for start in range(0, len(idx), chunkSize):
+            chunk = idx[start:start + chunkSize]
+            stats.update(self.filteredPulse[chunk], self.filteredAnalog[chunk], self.filteredTime[chunk])
+        return stats
+
+    def regress2D(self):
+        """
+        Time-independent 1/P vs. 1/A WLS shown in the 2D reciprocal plot, solved from the [1, 1/A, 1/P] block of
+        the filter-time sufficient statistics
+        :return: dictionary with tau, a1, dtau and da1
+        """
+        if getattr(self, 'regressionStats', None) is None:
+            self.regressionStats = self.accumulate()
+        results2D = self.regressionStats.fitColumns([0, 1])
+        self.fits["2D"] = {}
+        self.fits["2D"]["tau"] = results2D['tau']
+        self.fits["2D"]["a1"] = results2D['a1']
+        self.fits["2D"]["dtau"] = results2D['se_tau']
+        self.fits["2D"]["da1"] = results2D['se_a1']
+        return self.fits["2D"]
+
+    def get2DFit(self):
+        """
+        :return: fits["2D"], regressed on first request
+        """
+        if "2D" not in self.fits:
+            self.regress2D()
+        return self.fits["2D"]
+
+    def updateSelfFits(self, selfFits):
+        """
+        Loads regression results into fits["self"] and derives ACF, drift and dead-time correction at max pulse
+        :param selfFits: dictionary with tau, a1, a2, their standard errors, rSqr and redChi2; None if not fitted
+        """
+        if selfFits is None:
+            for key in ['tau', 'a1', 'a2', 'se_tau', 'se_a1', 'se_a2', 'rSqr', 'redChi2', 'ACF', 'Drift',
+                        'dtCorrPct']:
+                self.fits['self'][key] = np.nan
+            return
+        a1 = selfFits["a1"]
+        a2 = selfFits["a2"]
+        initialACF = 1/a1
+        delTime = np.max(self.session.scanTime) - np.min(self.session.scanTime)
+        finalACF = 1/(a1 + a2 * delTime)
+        drift = (finalACF/initialACF)-1
+        self.dtMaxP = self.maxP/(1-self.maxP*selfFits["tau"])
+        self.dtCorrPct = self.dtMaxP/self.maxP-1
+        for key in ['tau', 'a1', 'a2', 'se_tau', 'se_a1', 'se_a2', 'rSqr', 'redChi2']:
+            self.fits["self"][key] = selfFits[key]
+        self.fits["self"]["ACF"] = initialACF
+        self.fits['self']["Drift"] = drift
+        self.fits["self"]["dtCorrPct"] = self.dtCorrPct
 
     def calculateTimeSeries(self):
         # Multiply raw analog ADC values by stored ACF to get equivalent counts
@@ -447,45 +758,10 @@ class Mass:
             self.timeSeries = np.nan
 
     def postProcessTimeSeries(self):
-        pCross = self.session.pCross
-        inclUnc = self.session.inclUnc
-        t = self.session.scanTime - np.amin(self.session.scanTime)
-        acfType = self.fits['acfType']
-        fits = self.postProcessPars
-        if fits['alphaSource'] in ['Self', 'Internal']:
-            a1 = fits['a1']
-            a2 = fits['a2']
-            se_a1 = fits['sea1']
-            se_a2 = fits['sea2']
-            acf = 1 / (a1 + a2 * t)
-            modelAnalog = (self.analog.T * acf).T
-            if inclUnc:
-                B = acf ** 2
-                dA = np.sqrt(se_a1 ** 2 + (t * se_a2) ** 2)
-                dA = (self.analog.T * B * dA).T
-            else:
-                dP = None
-        else:
-            modelAnalog = (self.analog.T * self.ACF).T
-            dP = None
-        if fits['tauSource'] in ['Self', 'Internal']:
-            tau = fits['tau']
-            se_tau = fits['setau']
-            pUncorr = self.pulse / (1 + self.pulse * self.session.machineDeadTime)
-            modelPulse = pUncorr / (1 - pUncorr * tau)
-            if inclUnc:
-                D = 1 / (1 - self.pulse * tau)
-                dP = np.sqrt(self.pulse / self.dwell + (self.pulse ** 2 * se_tau) ** 2)
-                dP = D * dP
-            else:
-                dP = None
-        else:
-            modelPulse = self.pulse
-            dP = None
-        tmp = np.where(pCross > modelPulse, modelPulse, modelAnalog)
-        self.modeledTimeSeries = np.nanmean(tmp, axis=1)
-        if not dP is None and not dA is None:
-            self.modeledTimeSeriesError = np.nanmean(np.where(modelPulse > pCross, dA, dP), axis = 1)
+        """
+        Models the time series of this isotope (see PostProcess.postProcessMasses)
+        """
+        PostProcess.postProcessMasses(self.session, [self])
 
     def count(self):
         self.nObs = self.pulse.size
@@ -493,7 +769,10 @@ class Mass:
 
 class MassFits(dict):
 
-    def __init__(self):
+    def __init__(self, cache=None):
+        """
+        :param cache: regression cache of a released MassFits to carry over
+        """
         super().__init__()
         self['useTau'] = True
         self['useACF'] = True
@@ -505,6 +784,16 @@ class MassFits(dict):
                             'se_a1': None, 'se_a2': None, 'se_tau': None,
                             'lci': None, 'uci': None}
         self['external'] = {'a1': None, 'a2': None, 'tau': None}
+        # Block bootstrap standard errors and percentile intervals (se_, lci_, uci_ + tau/a1/a2)
+        self['bootstrap'] = {}
+        # Dead-time profile scan: residual statistics over a tau grid, optimum and se_optimum
+        self['tauProfile'] = {}
+        # Joint all-isotope fit with mass-dependent parameters (tau, a1, a2 and se_ at this isotope's mass)
+        self['joint'] = {}
+        # Last regression with the settings fingerprint it was fit under; params warm-start robust refits
+        if cache is None:
+            cache = {'fingerprint': None, 'selfFits': None, 'params': None}
+        self['cache'] = cache
 
 
 class SpectrumFits(dict):
@@ -519,6 +808,7 @@ class SpectrumFits(dict):
         self['alphaSource'] = []
         self['tauSource'] = []
         self['pMax'] = []
+        self.engine = SpectrumFitEngine()
         self['a1'] = {'order': 3,
                       'weighted': True,
                       'robust': False,
@@ -571,60 +861,61 @@ class SpectrumFits(dict):
                 self[par]['seY'].append(mass.fits['self']['se_'+par])
 
 
-    def fitByMass(self, modelSetUp: ModelDesignTable):
-        modelDesign = modelSetUp.getFitPars()
-        for i, par in enumerate(['a1', 'a2', 'tau']):
+    def recommendSources(self):
+        """
+        Suggests which isotopes inform the spectrum models: alpha (a1, a2) is used when both are precise and the
+        isotope regression fits well, tau when it is precise and the isotope reached high pulse rates.  Isotopes
+        that are not used take the 'Internal' (spectrum model) value.  Sets the masks and the alphaSource and
+        tauSource indices.
+        :return: list of bool alpha used, list of bool tau used
+        """
+        a1errs = np.array(self['a1']['seY']) / np.array(self['a1']['Y'])
+        a2errs = np.array(self['a2']['seY']) / np.array(self['a2']['Y'])
+        tauerrs = np.array(self['tau']['seY']) / np.array(self['tau']['Y'])
+        # Isotopes without a numeric r-squared (unfit, or 'N/A' in sessions of older versions) are not used
+        rSqrs = [r if isinstance(r, (int, float, np.number)) and np.isfinite(r) else -np.inf for r in self['rSqr']]
+        useAlpha = []
+        useTau = []
+        for i, (a1e, a2e, te, r, p) in enumerate(zip(a1errs, a2errs, tauerrs, rSqrs, self['pMax'])):
+            ok = bool(a1e < 0.005 and a2e < 0.01 and r > 0.95)
+            self['a1']['mask'][i] = ok
+            self['a2']['mask'][i] = ok
+            self['alphaSource'][i] = int(not ok)
+            useAlpha.append(ok)
+            ok = bool(te < 0.01 and r > 0.97 and p > 1E+6)
+            self['tau']['mask'][i] = ok
+            self['tauSource'][i] = int(not ok)
+            useTau.append(ok)
+        return useAlpha, useTau
+
+    def fitByMass(self, modelSetUp, pars=('a1', 'a2', 'tau')):
+        """
+        Fits a1, a2 and tau against mass with the model design of the spectrum fit table
+        :param modelSetUp: ModelDesignTable, or dictionary {par: {'order', 'weighted', 'robust'}}, with the settings
+        of each parameter
+        :param pars: iterable of parameters to refit, e.g. ['tau'] after toggling a "use Tau" box
+        """
+        modelDesign = modelSetUp.getFitPars() if hasattr(modelSetUp, 'getFitPars') else modelSetUp
+        if not hasattr(self, 'engine'):
+            self.engine = SpectrumFitEngine()
+        numForms = {'a1': '0.5f', 'a2': '0.3E', 'tau': '0.3E'}
+        x = np.array(self['mass'])
+        for par in pars:
             a = 0.05 # 95% CI
-            order = modelDesign[par]['order']
-            """ EXTRACT INLIER AND OUTLIER DATA """
-            # Inliers
-
-            x = np.array(self['mass'])
-            mask = self[par]['mask']
-            y = np.array(np.where(mask, self[par]['Y'], np.nan))
-            yerr = np.array(np.where(mask, self[par]['seY'], np.nan))
-
-            """ CURVE FITTING """
-            # Transform to design matrix of specified order
-            polyFeat = PolynomialFeatures(degree=order)
-            xP = polyFeat.fit_transform(x.reshape(-1, 1))
-
-            # Get model fitting parameters
-            weighted = modelDesign[par]['weighted']
-            w = {True: 1/yerr**2, False: np.ones_like(x)}[weighted]
-            #Todo: Add Spline option
-            #Todo: Test Robust
-            robust = modelDesign[par]['robust']
-            if robust:
-                model = sm.RLM(y, xP, M=sm.robust.norms.HuberT(), missing='drop').fit()
-            else:
-                model = sm.WLS(y, xP, weights = w, missing='drop').fit()
-            pred = model.get_prediction(xP)
-
-            ypred = pred.summary_frame(a)["mean"]
-            yprederr = pred.summary_frame(a)["mean_se"]
-            rse = np.abs(100*(yprederr/ypred))
-            numForms = ['0.5f', '0.3E', '0.3E']
-            intText = [f'{yp:{numForms[i]}} (±{err:0.1f}%)' for yp, err in zip(ypred,rse)]
+            # Inliers are flagged by mask; excluded values still get predictions and intervals
+            fit = self.engine.cachedFit(par, x, self[par]['Y'], self[par]['seY'], self[par]['mask'],
+                                        modelDesign[par]['order'], modelDesign[par]['weighted'],
+                                        modelDesign[par]['robust'], a)
+            ypred = fit['best']['Y']
+            rse = np.abs(100*(fit['best']['seY']/ypred))
+            intText = [f'{yp:{numForms[par]}} (±{err:0.1f}%)' for yp, err in zip(ypred, rse)]
             intText = [it.replace("E-0", "E-").replace("E+0", "E+") for it in intText]
             self[par]['intText'] = intText
-            self[par]['best']['Y'] = ypred
-            self[par]['best']['seY'] = yprederr
-            self[par]['ci']['l'] = pred.summary_frame()["mean_ci_lower"] #Alternate "mean_ci_lower"
-            self[par]['ci']['u'] = pred.summary_frame()["mean_ci_upper"] #Alternate "mean_ci_upper"
-            # Todo: use mean ci or obs ci?
-
-            self[par]['coefs'] = model.params
-            self[par]['se_coefs'] = model.bse
-            self[par]['rSqr'] = model.rsquared
-
-            # Reduced Chi^2
-            wrss = np.sum(w*(y-ypred)**2/yerr)  # Sum of squares of weighted residuals
-            v = np.sum(w) / ((np.sum(w)) ** 2 - np.sum(w ** 2))  #weighted normalizing factor
-            self[par]['rChi2'] = wrss/v
-
-
-
-
-
-
+            self[par]['best'] = fit['best']
+            self[par]['ci'] = fit['ci']
+            self[par]['coefs'] = fit['coefs']
+            self[par]['se_coefs'] = fit['se_coefs']
+            self[par]['rSqr'] = fit['rSqr']
+            self[par]['rChi2'] = fit['rChi2']
+            self[par]['model'] = fit['model']
+            self[par]['edf'] = fit.get('edf', len(fit['coefs']))
@@ -1,14 +1,73 @@
 import sys
+import time
+import importlib
 
-from PyQt6.QtWidgets import QApplication, QMainWindow, QTabWidget, QWidget
-from PyQt6.QtCore import pyqtSlot
+from PyQt6.QtWidgets import QApplication, QMainWindow, QTabWidget, QWidget, QVBoxLayout
+from PyQt6.QtCore import QObject, QRunnable, QThreadPool, QTimer, pyqtSignal, pyqtSlot
 
 # Project imports
 import src.ui.importWidget as importer
-import src.ui.isotopeFitWidget as fitter
-import src.ui.spectrumFitWidget as spectrum
 import src.records.Session as session
 
+"""
+LAZY STARTUP
+Only the import tab is built before the window is shown.  The filter & fit and mass spectrum tabs (and their
+matplotlib canvases) are built the first time they are shown.  After the first paint a background thread imports
+matplotlib and scipy, which create no Qt objects; the matplotlib Qt backend and the tab modules, which define Qt
+classes, are then imported on the GUI thread (a few tens of ms once the libraries are loaded), so everything is
+usually loaded by the time a tab is opened.
+"""
+
+PRELOAD_MODULES = ['matplotlib.figure', 'scipy.stats', 'scipy.interpolate']  # imported off the GUI thread
+GUI_PRELOAD_MODULES = ['matplotlib.backends.backend_qtagg', 'src.ui.isotopeFitWidget', 'src.ui.spectrumFitWidget']
+
+
+class PreloadSignals(QObject):
+    finished = pyqtSignal(float)
+
+
+class PreloadWorker(QRunnable):
+    def __init__(self, modules=PRELOAD_MODULES):
+        """
+        Imports modules off the GUI thread
+        :param modules: list of names of modules that create no Qt objects on import
+        """
+        super().__init__()
+        self.modules = modules
+        self.signals = PreloadSignals()
+
+    @pyqtSlot()
+    def run(self):
+        start = time.perf_counter()
+        for module in self.modules:
+            try:
+                importlib.import_module(module)
+            except ImportError:
+                pass
+        self.signals.finished.emit(time.perf_counter() - start)
+
+
+class LazyTab(QWidget):
+    def __init__(self, builder):
+        """
+        Tab page whose content is built the first time it is shown
+        :param builder: callable returning the content widget
+        """
+        super().__init__()
+        self.builder = builder
+        self.content = None
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+
+    def build(self):
+        if self.content is None:
+            self.content = self.builder()
+            self.layout().addWidget(self.content)
+        return self.content
+
+    def showEvent(self, event):
+        self.build()
+        super().showEvent(event)
 
 
 class ACFModelMain(QMainWindow):
@@ -24,6 +83,8 @@ class ACFModelMain(QMainWindow):
 
         self.session = session.Session()
         self.session.pickleFile = None
+        self.painted = False
+        self.preloadTime = None
 
         self.importer = importer.Ui_ImportWidget(self.session)
         self.importer.setupUi()
@@ -41,29 +102,67 @@ class ACFModelMain(QMainWindow):
 
         self.tabs.currentChanged.connect(self.tabChanged)
 
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        if not self.painted:
+            self.painted = True
+            QTimer.singleShot(0, self.preloadModules)
+
+    def preloadModules(self):
+        worker = PreloadWorker()
+        worker.signals.finished.connect(self.modulesPreloaded)
+        QThreadPool.globalInstance().start(worker)
+
+    @pyqtSlot(float)
+    def modulesPreloaded(self, seconds: float):
+        start = time.perf_counter()
+        for module in GUI_PRELOAD_MODULES:
+            try:
+                importlib.import_module(module)
+            except ImportError:
+                pass
+        self.preloadTime = seconds + time.perf_counter() - start
+
+    def setLazyTab(self, index: int, builder, label: str):
+        self.tabs.blockSignals(True)
+        current = self.tabs.currentIndex()
+        self.tabs.removeTab(index)
+        self.tabs.insertTab(index, LazyTab(builder), label)
+        self.tabs.setCurrentIndex(current)
+        self.tabs.blockSignals(False)
+
     def tabChanged(self, current: int):
+        page = self.tabs.widget(current)
+        if isinstance(page, LazyTab):
+            page.build()
         if current == 1 and self.session.status['new']:
             self.rawFitWidget.dataImported()
             self.session.status['new'] = False
             self.session.status['imported'] = True
 
-    @pyqtSlot(str)
-    def dataImported(self, pickleFilePath: str):
-        self.session = self.importer.session
-        self.tabs.removeTab(1)
+    def buildRawFitWidget(self):
+        import src.ui.isotopeFitWidget as fitter
         self.rawFitWidget = fitter.FilterFitWidget(self.session)
         self.rawFitWidget.setupUi()
         self.rawFitWidget.regressionPickled.connect(self.dataFit)
-        self.tabs.insertTab(1, self.rawFitWidget,"Filter & Fit Raw Data")
+        return self.rawFitWidget
+
+    def buildSpectrumWidget(self):
+        import src.ui.spectrumFitWidget as spectrum
+        self.massSpectrumWidget = spectrum.SpectrumWidget(self.session)
+        self.massSpectrumWidget.spectrumFitSaved.connect(self.spectrumFitPickled)
+        return self.massSpectrumWidget
+
+    @pyqtSlot(str)
+    def dataImported(self, pickleFilePath: str):
+        self.session = self.importer.session
+        self.setLazyTab(1, self.buildRawFitWidget, "Filter & Fit Raw Data")
         self.session.pickleFile = pickleFilePath
 
     @pyqtSlot(str)
     def dataFit(self, pickleFilePath:str):
-        self.massSpectrumWidget = spectrum.SpectrumWidget(self.session)
-        self.tabs.removeTab(2)
-        self.tabs.insertTab(2, self.massSpectrumWidget, "Model Mass Spectrum")
+        self.setLazyTab(2, self.buildSpectrumWidget, "Model Mass Spectrum")
         self.session.pickleFile = pickleFilePath
-        self.massSpectrumWidget.spectrumFitSaved.connect(self.spectrumFitPickled)
 
 
     @pyqtSlot(str)
@@ -75,4 +174,4 @@ if __name__ == "__main__":
     app = QApplication(sys.argv)
     demo = ACFModelMain()
     demo.show()
-    app.exit(app.exec())
\ No newline at end of file
+    app.exit(app.exec())
@@ -3,24 +3,20 @@ import time
 import numpy as np
 import pathlib
 import pickle
+import traceback
 from datetime import datetime
 
 from PyQt6.QtWidgets import QApplication, QWidget, QLabel, QComboBox, QPushButton, \
     QSizePolicy, QTreeWidget, QFileDialog, QTreeWidgetItem, QProgressBar, QMessageBox, \
     QGridLayout
 from PyQt6.QtCore import QRunnable, QObject, QThreadPool, pyqtSignal as Signal, pyqtSlot as Slot, QMutex, \
-    QRect,  QCoreApplication, QMetaObject, Qt
-
-# Matplotlib imports
-import matplotlib
-from matplotlib.figure import Figure
-from matplotlib.backends.backend_qtagg import FigureCanvasQTAgg as FigureCanvas
+    QRect,  QCoreApplication, QMetaObject, Qt, QTimer
 
 # Project imports
 from src.records.Session import Session
-from src.fileIO.ThermoE2XR import ThermoDAT
-
-matplotlib.use("QTAgg")
+from src.fileIO.ThermoE2XR import ThermoDAT, ThermoFIN2
+from src.fileIO.ChromExporter import EXPORTERS, FIN2Exporter, getExporter
+from src.fileIO.RawImporter import IMPORTERS, getImporter
 
 """ 
 IMPORT WORKER CLASSES 
@@ -41,6 +37,7 @@ class ImporterSignals(QObject):
     importStatus = Signal(str)
     queueStatus = Signal(str)
     completed = Signal()
+    failed = Signal(str)
 
 
 class ImportWorker(QRunnable):
@@ -97,20 +94,19 @@ class ImportWorker(QRunnable):
                 for j in range(dirItem.childCount()):
                     fileItem = dirItem.child(k)
                     fileName = fileItem.text(0)
-                    name = fileName.strip('.dat')
                     self.signals.progressMsg.emit(f'Importing {fileName}')
                     if fileItem.checkState(0) == Qt.CheckState.Checked:
                         fpath = self.queueDict[dirName][fileName]["path"]
                         self.treeData['fullFileName'] = fpath
-                        if '.dat' in fpath:
-                            ThermoDAT(fpath, self.session).parseDAT()
-                        else:
+                        try:
+                            smpRecord = getImporter(fpath)(fpath, self.session).importFile()
+                        except KeyError:
                             print("No parser for this file type")
                             break
                         self.session.status['imported'] = True
-                        self.treeData["name"] = self.session.samples[name].group
-                        self.treeData["fileName"] = self.session.samples[name].name
-                        self.treeData['sampleNum'] = self.session.samples[name].smpNum
+                        self.treeData["name"] = smpRecord.group
+                        self.treeData["fileName"] = smpRecord.name
+                        self.treeData['sampleNum'] = smpRecord.smpNum
                         self.treeData["dirName"] = dirName
                         self.treeData["fullFileName"] = fileName
                         self.treeData['takeParent'] = m
@@ -143,73 +139,53 @@ class ImportWorker(QRunnable):
 
 
 class ExportWorker(QRunnable):
-    def __init__(self, session: Session, mutex: QMutex):
+    def __init__(self, session: Session, outDir, baseName, postProcessed=True, form='FIN2', workers=None,
+                 streamed=False):
+        """
+        Exports the time series of every sample off the GUI thread.  FIN2 sample files are written concurrently and
+        the *.FIN index last; other formats are written chunk by chunk through their ChromExporter.
+        :param session: Session (with committed postProcessPars for post-processed exports)
+        :param outDir: string output directory
+        :param baseName: string export name (*.FIN index or session file name without extension)
+        :param postProcessed: bool True to export modeled time series
+        :param form: string ChromExporter name or label
+        :param workers: int number of FIN2 writer threads, None for one per core
+        :param streamed: bool True to model the series from the raw *.dat files, which must still be at their import
+        paths; False to write the time series held in the session
+        """
         super().__init__()
         self.session = session
-        self.mutex = QMutex
+        self.outDir = outDir
+        self.baseName = baseName
+        self.postProcessed = postProcessed
+        self.form = form
+        self.workers = workers
+        self.streamed = streamed
         self.signals = ImporterSignals()
 
+    def progress(self, name):
+        self.signals.progressMsg.emit(f'Exported {name}')
+        self.signals.progressInc.emit()
+
     @Slot()
     def run(self):
-        m = 0
-        smpNames = list(self.session.samples.keys())
-        self.signals.progressMax.emit(len(smpNames))
-        # Iterate Sequence Directories
-        self.mutex.tryLock(1000)
-        for smpName in smpNames:
-            primaryKey = self.session.samples[smpName].ID
-
-        self.session.startTime = time.localtime()
-        for i in range(nSeq):
-            self.treeData['removeDir'] = False
-            dirItem = self.qTree.invisibleRootItem().child(m)
-            dirName = dirItem.text(0)
-            # Check for checkbox status
-            if dirItem.checkState(0) == Qt.Checked or Qt.PartiallyChecked:
-                # Import children of checked or partially
-                # Iterate through analysis in Sequence
-                k = 0
-                for j in range(dirItem.childCount()):
-                    fileItem = dirItem.child(k)
-                    fileName = fileItem.text(0)
-                    name = fileName.strip('.dat')
-                    self.signals.progressMsg.emit(f'Importing {fileName}')
-                    if fileItem.checkState(0) == Qt.CheckState.Checked:
-                        fpath = self.queueDict[dirName][fileName]["path"]
-                        self.treeData['fullFileName'] = fpath
-                        # self.smp = self.session.createSample(name)
-                        # datReader.parseDAT(fpath, self.session, self.mutex)
-                        self.session.status['imported'] = True
-                        # print(type(s.fileTimes["DAT"])
-                        self.treeData["name"] = self.session.samples[name].group
-                        self.treeData["fileName"] = self.session.samples[name].name
-                        self.treeData['sampleNum'] = self.session.samples[name].smpNum
-                        self.treeData["dirName"] = dirName
-                        self.treeData["fullFileName"] = fileName
-                        self.treeData['takeParent'] = m
-                        self.treeData['takeChild'] = k
-                        self.treeData['mutex'] = self.mutex
-                        self.signals.addToImport.emit(self.treeData)
-                        self.signals.progressInc.emit()
-                        while not self.mutex.tryLock(10):
-                            print("locked")
-                    else:
-                        k += 1
-                    if dirItem.childCount() == 0:
-                        self.treeData['removeDir'] = True
-                        self.signals.addToImport.emit(self.treeData)
-                        while not self.mutex.tryLock(10):
-                            print("locked")
+        # completed is always emitted so the caller re-enables its export controls; errors are reported by failed
+        try:
+            self.signals.progressMax.emit(len(self.session.samples))
+            exporterClass = getExporter(self.form)
+            if exporterClass is FIN2Exporter:
+                ThermoFIN2(self.session).writeParallel(self.outDir, self.baseName + '.FIN', self.postProcessed,
+                                                       self.streamed, self.workers, self.progress)
             else:
-                pass
-                # m += 1
-        self.session.status['imported'] = True
-        self.session.timeOffsets()
-        self.session.startTime = np.min(self.session.scanTime)
-        self.session.calculateTimeSeries()
-        for massName, massRecord in self.session.masses.items():
-            massRecord.totalObservations()
-        self.signals.completed.emit()
+                exporterClass(self.session, self.outDir, self.baseName,
+                              self.postProcessed).export(streamed=self.streamed, progress=self.progress)
+            self.signals.progressMsg.emit(f'Exported {len(self.session.samples)} samples to {self.outDir}')
+        except Exception as e:
+            traceback.print_exc()
+            self.signals.progressMsg.emit(f'Export to {self.outDir} failed')
+            self.signals.failed.emit(f'{type(e).__name__}: {e}')
+        finally:
+            self.signals.completed.emit()
 
 
 class Ui_ImportWidget(QWidget):
@@ -249,8 +225,8 @@ class Ui_ImportWidget(QWidget):
         """ QUEUE QComboBox: File Extension Filter Combobox"""
         self.queueFilter = QComboBox()
         self.queueFilter.setObjectName("queueFilter")
-        self.queueFilter.addItem("")
-        self.queueFilter.addItem("")
+        for importer in IMPORTERS.values():
+            self.queueFilter.addItem(importer.label)
         self.grid.addWidget(self.queueFilter, 0, 0, 1, 1)
 
         """ QUEUE Status: QLabel to store status string"""
@@ -290,8 +266,7 @@ class Ui_ImportWidget(QWidget):
         """ IMPORTED:  QComboBox for Chrom Text File Format"""
         self.rawExportFileTypeCombo = QComboBox()
         self.rawExportFileTypeCombo.setObjectName("rawExportFileTypeCombo")
-        self.rawExportFileTypeCombo.addItem("")
-        self.rawExportFileTypeCombo.addItem("")
+        self.rawExportFileTypeCombo.addItems([exporter.label for exporter in EXPORTERS.values() if exporter.available()])
         self.grid.addWidget(self.rawExportFileTypeCombo, 0, 1, 1, 1)
 
         """ IMPORTED Status: QLabel to store status string"""
@@ -340,16 +315,9 @@ class Ui_ImportWidget(QWidget):
         self.timeSeriesLabel.setStyleSheet('font-weight: bold')
         self.grid.addWidget(self.timeSeriesLabel, 0, 2, 1, 1)
 
-        """TIME-SERIES PLOT:  Configure MatPlotLib Figure Canvas"""
-        # Create Matlplotlib figure
-        self.timesSeriesFigure = Figure(figsize=(5, 3))
-        # FigureCanvas is the Matplotlib Widget for Pyplots
-        self.canvas = FigureCanvas(self.timesSeriesFigure)
-        self.canvas.setObjectName("timeSeriesCanvas")
-        # Add FigureCanvas to grid
-        self.grid.addWidget(self.canvas, 1, 2, 5, 1)
-        # Create Axes for rendering
-        self.dynamic_ax = self.canvas.figure.subplots()
+        """TIME-SERIES PLOT:  MatPlotLib Figure Canvas, created once the widget has been painted"""
+        self.canvas = None
+        self.dynamic_ax = None
 
         """PROGRESS Text:  QLabel to display Import process status messages"""
         self.progressText = QLabel(self)
@@ -399,14 +367,12 @@ class Ui_ImportWidget(QWidget):
     def retranslateUi(self):
         _translate = QCoreApplication.translate
         self.setWindowTitle(_translate("Widget", "Widget"))
-        self.queueFilter.setItemText(0, _translate("Widget", "Thermo Element (*.dat)"))
-        self.queueFilter.setItemText(1, _translate("Widget", "Perkin-Elmer"))
+        for i, importer in enumerate(IMPORTERS.values()):
+            self.queueFilter.setItemText(i, _translate("Widget", importer.label))
         self.queueStatus.setText(_translate("Widget", "TextLabel"))
         self.queueAddFiles.setText(_translate("Widget", "Add Files"))
         self.queueAddDir.setText(_translate("Widget", "Add Directory"))
         self.queueRemove.setText(_translate("Widget", "Remove"))
-        self.rawExportFileTypeCombo.setItemText(0, _translate("Widget", "Thermo Element (*.FIN2)"))
-        self.rawExportFileTypeCombo.setItemText(1, _translate("Widget", "Perkin-Elmer"))
         self.importedStatus.setText(_translate("Widget", "TextLabel"))
         self.importQueuedBtn.setText(_translate("Widget", "Import Queued Files"))
         self.importBinary.setText(_translate("Widget", "Import Binary"))
@@ -438,15 +404,35 @@ class Ui_ImportWidget(QWidget):
 
     def generateChromText(self):
         expType = self.rawExportFileTypeCombo.currentText()
-        if expType == 'Thermo Element (*.FIN2)':
-            writeFIN2(self.dataDir)
+        if self.session.status['imported'] and expType:
+            outDir = QFileDialog.getExistingDirectory(None, "Export Directory", str(self.session.startDir),
+                                                      options=QFileDialog.Option.DontUseNativeDialog)
+            if not outDir:
+                return
+            baseName = os.path.basename(str(self.session.startDir)) or 'session'
+            self.initializeProgress()
+            exportWorker = ExportWorker(self.session, outDir, baseName, postProcessed=False, form=expType)
+            exportWorker.signals.progressMsg.connect(self.progressText.setText)
+            exportWorker.signals.progressInc.connect(self.incrementProgress)
+            exportWorker.signals.progressMax.connect(self.progressRange)
+            exportWorker.signals.failed.connect(self.exportFailed)
+            QThreadPool.globalInstance().start(exportWorker)
         else:
             msg = QMessageBox()
-            msg.setIcon(QMessageBox.Critical)
+            msg.setIcon(QMessageBox.Icon.Critical)
             msg.setText("Error")
-            msg.setInformativeText('No Exporter for this file type')
+            msg.setInformativeText('No imported data to export')
             msg.setWindowTitle("Error")
-            msg.exec_()
+            msg.exec()
+
+    @Slot(str)
+    def exportFailed(self, error: str):
+        msg = QMessageBox()
+        msg.setIcon(QMessageBox.Icon.Critical)
+        msg.setText("Export failed")
+        msg.setInformativeText(error)
+        msg.setWindowTitle("Error")
+        msg.exec()
 
     def removeFiles(self):
         pass
@@ -501,7 +487,7 @@ class Ui_ImportWidget(QWidget):
         else:
             del self.queueDict[dirName]
             dlg = QMessageBox()
-            dlg.setText(f"No {self.extension} files found")
+            dlg.setText(f"No {'/'.join(self.extension)} files found")
             dlg.exec()
 
         paths = []
@@ -627,7 +613,34 @@ class Ui_ImportWidget(QWidget):
 
     """ PLOTTING FUNCTIONS"""
 
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        if self.canvas is None:
+            QTimer.singleShot(0, self.createCanvas)
+
+    def createCanvas(self):
+        """
+        Configure MatPlotLib Figure Canvas.  Matplotlib is imported here rather than with the module so the window
+        is shown before it loads.
+        """
+        if self.canvas is not None:
+            return
+        import matplotlib
+        matplotlib.use("QTAgg")
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_qtagg import FigureCanvasQTAgg as FigureCanvas
+        # Create Matlplotlib figure
+        self.timesSeriesFigure = Figure(figsize=(5, 3))
+        # FigureCanvas is the Matplotlib Widget for Pyplots
+        self.canvas = FigureCanvas(self.timesSeriesFigure)
+        self.canvas.setObjectName("timeSeriesCanvas")
+        # Add FigureCanvas to grid
+        self.grid.addWidget(self.canvas, 1, 2, 5, 1)
+        # Create Axes for rendering
+        self.dynamic_ax = self.canvas.figure.subplots()
+
     def plotSelectedTimeSeries(self, selected, deselected):
+        self.createCanvas()
         item = self.importedTreeWidget.selectedItems()[0]
         file = item.text(2)
         self.session.plotTimeSeries(file, self.dynamic_ax)
@@ -703,16 +716,9 @@ class Ui_ImportWidget(QWidget):
             print("No File to Unpickle")
 
     def getFilterText(self):
-        t = self.queueFilter.currentText()
-        if t == "Thermo Element (*.dat)":
-            self.fileFilter = "Element Data Files (*.dat)"
-            self.extension = '.dat'
-        elif t == "P-E NexION":
-            self.fileFilter = "Perkin-Elmer NexION (*.*)"
-            self.extension = '.csv'
-        else:
-            self.fileFilter = "Any File (*.*)"
-            self.extension = '.txt'
+        importer = getImporter(self.queueFilter.currentText())
+        self.fileFilter = importer.fileFilter
+        self.extension = importer.extensions
 
 
 
@@ -149,9 +149,6 @@ class FilterFitWidget(QWidget):
         self.isotopeFitComboBox.setCurrentIndex(1)
         upperLeftGrid.addWidget(self.isotopeFitComboBox, row, 1, 1, 1)
 
-        #Todo: Test Robust least squared. Disabled here
-        self.isotopeFitComboBox.model().item(2).setEnabled(False)
-
         row += 1
         self.normComboLabel = QLabel()
         self.normComboLabel.setText('RLS Norm:')
@@ -905,8 +902,9 @@ class FilterFitWidget(QWidget):
                 cbar.ax.set_ylabel("Time (x10$^{{{3}}}$ sec)", rotation=270)
                 cbar.ax.get_yaxis().labelpad = 15
             self.savePlotBtn.setEnabled(True)
-            tau2d = data.fits["2D"]["tau"]
-            alpha2d = data.fits["2D"]["a1"]
+            fit2D = data.get2DFit()
+            tau2d = fit2D["tau"]
+            alpha2d = fit2D["a1"]
             if tau2d is not None:
                 xs = [0, self._ax.get_xlim()[1]/100000]
                 ys = [tau2d + alpha2d * x for x in xs]
@@ -921,8 +919,8 @@ class FilterFitWidget(QWidget):
             x = self._ax.get_xlim()
             xrange = np.abs(x[1] - x[0])
             xoff = x[0] + 0.05*xrange
-            dtau = data.fits["2D"]["dtau"]
-            da1 = data.fits["2D"]["da1"]
+            dtau = fit2D["dtau"]
+            da1 = fit2D["da1"]
             rdtau = 100*dtau/tau2d
             rda1 = 100*da1/alpha2d
             acf = 1/alpha2d
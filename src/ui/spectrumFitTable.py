@@ -320,34 +320,12 @@ class CrossCalTableWidget(QTableWidget):
         self.resizeColumnsToContents()
 
     def recommendFitType(self):
-        sf = self.session.spectrumFit
-        """ Evaluate alpha for Fit Type Suggestion """
-        a1errs = np.array(sf['a1']['seY']) / np.array(sf['a1']['Y'])
-        a2errs = np.array(sf['a2']['seY']) / np.array(sf['a2']['Y'])
-        rSqrs = sf['rSqr']
-        for i, (a1e, a2e, r) in enumerate(zip(a1errs, a2errs, rSqrs)):
-            cbox = self.cellWidget(i, self.colHeaders.index('use ACF'))
-            source = self.cellWidget(i, self.colHeaders.index('ACF Type'))
-            ok = a1e < 0.005 and a2e < 0.01 and r > 0.95
-            cbox.setChecked(ok)
-            sf['a1']['mask'][i] = ok
-            sf['a2']['mask'][i] = ok
-            sf['alphaSource'][i] = int(~ok)
-            source.setCurrentIndex(int(~ok))
-
-
-        """ Evaluate Tau for Fit Type Suggestion """
-        tauerrs = np.array(sf['a1']['seY']) / np.array(sf['a1']['Y'])
-        pmaxs = sf['pMax']
-        for i, (te, r, p) in enumerate(zip(tauerrs, rSqrs, pmaxs)):
-            cbox = self.cellWidget(i, self.colHeaders.index('use Tau'))
-            source = self.cellWidget(i, self.colHeaders.index('Tau Type'))
-            ok =  te < 0.01 and r > 0.97 and p>1E+6
-            cbox.setChecked(ok)
-            sf['tau']['mask'][i] = ok
-            sf['tauSource'][i] = int(~ok)
-            source.setCurrentIndex(int(~ok))
-            cbox.setChecked(ok)
+        """ Evaluate alpha and Tau for Fit Type Suggestion """
+        useAlpha, useTau = self.session.spectrumFit.recommendSources()
+        for i, (alphaOk, tauOk) in enumerate(zip(useAlpha, useTau)):
+            for use, col, ok in [('use ACF', 'ACF Type', alphaOk), ('use Tau', 'Tau Type', tauOk)]:
+                self.cellWidget(i, self.colHeaders.index(use)).setChecked(ok)
+                self.cellWidget(i, self.colHeaders.index(col)).setCurrentIndex(int(not ok))
 
     def createPlots(self, **kwargs):
         self.session.spectrumFit.fitByMass(self.modelSetup)
@@ -520,6 +498,11 @@ class CrossCalTableWidget(QTableWidget):
             eq = f'$\\tau$ = '
 
 
+        model = self.session.spectrumFit[par].get('model', 'polynomial')
+        if model != 'polynomial':
+            # Smoothers have no closed-form equation; report the model and its effective degrees of freedom
+            vals = []
+            eq = eq + f"{model} (edf {self.session.spectrumFit[par]['edf']:0.1f})"
         for j,[val, se_val] in enumerate(zip(vals, se_vals)):
             coeffs = f'{val: 0.2E}'
             if inclUnc:
@@ -548,37 +531,25 @@ class CrossCalTableWidget(QTableWidget):
             pars = ['tau']
         for par in pars:
             self.session.spectrumFit[par]['mask'][row] = sendy.cbox.isChecked()
-        self.session.spectrumFit.fitByMass(self.modelSetup)
-        self.updateTable()
+        # createPlots refits (from the spectrum fit cache) and updates the table
         self.createPlots()
 
     def commitFits(self):
-        sf = self.session.spectrumFit
-        for isotope, massRecord in self.session.masses.items():
-            if not hasattr(massRecord, 'postProcessPars'):
-                massRecord.__setattr__('postProcessPars', {})
-            row = list(self.isotopes).index(isotope)
-            # Source strings
-            a = self.cellWidget(row, 4).currentText()
-            t = self.cellWidget(row, 8).currentText()
-            massRecord.postProcessPars["alphaSource"] = a
-            massRecord.postProcessPars["tauSource"] = t
-            for par, source in zip(['a1', 'a2', 'tau'],[a, a, t]):
-                for var in ['','se']:
-                    val = None
-                    if source == 'Self':
-                        val = sf[par][var+'Y'][row]
-                    elif source == 'Internal':
-                        val = sf[par]['best'][var+'Y'][row]
-                    massRecord.postProcessPars[var+par] = val
-            massRecord.postProcessTimeSeries()
-            self.dataPostProcessed.emit()
-            """ Debugging Plots """
-            # y = massRecord.modeledTimeSeries
-            # x = massRecord.timeSeries
-            # plt.scatter(y,x/y, marker='.', s=0.01)
-            # plt.title(isotope)
-            # plt.show()
+        rows = [list(self.isotopes).index(isotope) for isotope in self.session.masses.keys()]
+        # Source strings
+        alphaSources = [self.cellWidget(row, 4).currentText() for row in rows]
+        tauSources = [self.cellWidget(row, 8).currentText() for row in rows]
+        self.session.commitSpectrumFits(alphaSources, tauSources)
+        # All isotopes are modeled in one chunked pass over the scans
+        self.session.postProcessTimeSeries()
+        self.dataPostProcessed.emit()
+        """ Debugging Plots """
+        # for isotope, massRecord in self.session.masses.items():
+        #     y = massRecord.modeledTimeSeries
+        #     x = massRecord.timeSeries
+        #     plt.scatter(y,x/y, marker='.', s=0.01)
+        #     plt.title(isotope)
+        #     plt.show()
 
 class AppDemo(QWidget):
     def __init__(self):
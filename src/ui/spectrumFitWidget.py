@@ -3,8 +3,8 @@ import pickle
 import os
 
 from PyQt6.QtWidgets import QApplication, QWidget, QGridLayout, QComboBox, QPushButton,\
-    QFileDialog, QLabel, QDoubleSpinBox, QCheckBox, QHBoxLayout
-from PyQt6.QtCore import QRect, Qt, pyqtSlot
+    QFileDialog, QLabel, QDoubleSpinBox, QCheckBox, QHBoxLayout, QProgressBar, QMessageBox
+from PyQt6.QtCore import QRect, Qt, pyqtSlot, QThreadPool
 from PyQt6.QtCore import pyqtSlot, pyqtSignal
 
 from matplotlib.figure import Figure
@@ -14,7 +14,8 @@ from matplotlib.backends.backend_qtagg import FigureCanvasQTAgg as FigureCanvas
 import src.ui.spectrumFitTable as acfTable
 import src.ui.spectrumModelDesignTable as modelDesign
 import src.records.Session as Session
-from src.fileIO.ThermoE2XR import ThermoFIN2
+from src.ui.importWidget import ExportWorker
+from src.fileIO.ChromExporter import EXPORTERS
 
 
 class SpectrumWidget(QWidget):
@@ -212,8 +213,8 @@ class SpectrumWidget(QWidget):
         label.setAlignment(align)
         hbox.addWidget(label)
         self.expTypeCombo = QComboBox()
-        self.expTypeCombo.addItems(['*FIN2'])
-        self.expTypeCombo.setFixedWidth(120)
+        self.expTypeCombo.addItems([exporter.label for exporter in EXPORTERS.values() if exporter.available()])
+        self.expTypeCombo.setFixedWidth(180)
         self.expTypeCombo.setContentsMargins(0, 0, 0, 0)
         self.expTypeCombo.setEnabled(False)
         hbox.addWidget(self.expTypeCombo)
@@ -223,6 +224,12 @@ class SpectrumWidget(QWidget):
         self.expStartBtn.setContentsMargins(0, 0, 0, 0)
         self.expStartBtn.setEnabled(False)
         hbox.addWidget(self.expStartBtn)
+
+        self.expProgressBar = QProgressBar()
+        self.expProgressBar.setRange(0, 1)
+        self.expProgressBar.setValue(0)
+        self.expProgressBar.setTextVisible(False)
+        hbox.addWidget(self.expProgressBar)
         hbox.setContentsMargins(0, 0, 0, 0)
 
         axlayout.addLayout(hbox, row, 0, 1, 3)
@@ -338,15 +345,44 @@ class SpectrumWidget(QWidget):
 
     def exportChromText(self):
         form = self.expTypeCombo.currentText()
-        if form == "*FIN2":
-            exporter = ThermoFIN2(self.session)
-            finDir = self.session.startDir.joinpath('FIN2')
-            finDir.mkdir(exist_ok=True)
-            dlg = QFileDialog()
-            dlqOptions = QFileDialog.Option.DontUseNativeDialog | QFileDialog.Option.DontUseNativeDialog
-            fin2Dir = dlg.getExistingDirectory(None, "", str(finDir), options=dlqOptions)
-            finName = os.path.basename(self.session.startDir)+'.FIN'
-            exporter.write(fin2Dir, finName, True)
+        finDir = self.session.startDir.joinpath('FIN2')
+        finDir.mkdir(exist_ok=True)
+        dlg = QFileDialog()
+        dlqOptions = QFileDialog.Option.DontUseNativeDialog | QFileDialog.Option.DontUseNativeDialog
+        outDir = dlg.getExistingDirectory(None, "", str(finDir), options=dlqOptions)
+        if not outDir:
+            return
+        baseName = os.path.basename(self.session.startDir)
+        # Sample files are written off the GUI thread (FIN2 in a thread pool, with the *.FIN index written last)
+        exportWorker = ExportWorker(self.session, outDir, baseName, True, form)
+        exportWorker.signals.progressMax.connect(self.exportProgressRange)
+        exportWorker.signals.progressInc.connect(self.incrementExportProgress)
+        exportWorker.signals.progressMsg.connect(self.expProgressBar.setToolTip)
+        exportWorker.signals.completed.connect(self.exportComplete)
+        exportWorker.signals.failed.connect(self.exportFailed)
+        self.expStartBtn.setEnabled(False)
+        QThreadPool.globalInstance().start(exportWorker)
+
+    def exportProgressRange(self, max):
+        self.expProgressBar.setRange(0, max)
+        self.expProgressBar.setValue(0)
+        self.expProgressBar.setFormat("%p%")
+        self.expProgressBar.setTextVisible(True)
+
+    def incrementExportProgress(self):
+        self.expProgressBar.setValue(self.expProgressBar.value() + 1)
+
+    def exportComplete(self):
+        self.expProgressBar.setValue(self.expProgressBar.maximum())
+        self.expStartBtn.setEnabled(True)
+
+    def exportFailed(self, error: str):
+        msg = QMessageBox()
+        msg.setIcon(QMessageBox.Icon.Critical)
+        msg.setText("Export failed")
+        msg.setInformativeText(error)
+        msg.setWindowTitle("Error")
+        msg.exec()
 
 
 
@@ -10,7 +10,8 @@ class FitTypes(QComboBox):
     'Linear'
     '2nd Order'
     '3rd Order'
-    'Cubic Spline': Not currently active
+    'Cubic Spline': weighted smoothing spline, smoothing chosen by generalized cross-validation
+    'Piecewise Linear': monotone piecewise-linear fit on fixed knots
 
     """
     def __init__(self, row, col, parent):
@@ -18,13 +19,10 @@ class FitTypes(QComboBox):
         self.setStyleSheet('font-size: 10px;'
                            'selection - color: rgb(0, 0, 0);'
                            'selection - background - color: rgb(230, 230, 230);')
-        self.addItems(['Mean', 'Linear', '2nd Order', '3rd Order', 'Cubic Spline'])
+        self.addItems(['Mean', 'Linear', '2nd Order', '3rd Order', 'Cubic Spline', 'Piecewise Linear'])
         self.setProperty('row', row)
         self.setProperty('col', col)
 
-        # Todo: Cubic spline fit in SpectrumFit class
-        self.model().item(4).setEnabled(False)
-
     def getValue(self):
         return self.currentIndex()
 